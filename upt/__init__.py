@@ -10,8 +10,11 @@ from .upt import Frontend
 from .upt import Package
 from .upt import PackageRequirement
 from .upt import PackageDiff
+from .upt import Workspace
 from .exceptions import InvalidPackageNameError
 from .exceptions import InvalidPackageVersionError
 from .exceptions import UnhandledFrontendError
 from .checksum import HashUnknown
 from .checksum import HashUnavailable
+from .download import ChecksumMismatch
+from .download import SizeMismatch
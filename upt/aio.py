@@ -0,0 +1,126 @@
+# Copyright 2021      Cyril Roelandt
+#
+# Licensed under the 3-clause BSD license. See the LICENSE file.
+import asyncio
+import concurrent.futures
+import functools
+import inspect
+import threading
+import urllib.parse
+import weakref
+
+import upt.download
+
+
+def get_hook(plugin, name):
+    """Return the asynchronous counterpart of the NAME method of PLUGIN.
+
+    Frontends and backends may define coroutine methods named after their
+    synchronous hooks, such as parse_async() for parse(). Return None if
+    PLUGIN does not define one.
+    """
+    hook = getattr(plugin, f'{name}_async', None)
+    return hook if inspect.iscoroutinefunction(hook) else None
+
+
+async def call(plugin, name, *args, **kwargs):
+    """Call the NAME hook of PLUGIN from a coroutine.
+
+    The asynchronous counterpart of the hook is awaited if PLUGIN defines
+    one; otherwise, the synchronous hook is run in the default executor of
+    the event loop.
+    """
+    hook = get_hook(plugin, name)
+    if hook is not None:
+        return await hook(*args, **kwargs)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(getattr(plugin, name), *args, **kwargs))
+
+
+def call_sync(plugin, name, *args, **kwargs):
+    """Call the NAME hook of PLUGIN from synchronous code.
+
+    The asynchronous counterpart of the hook is run in a new event loop if
+    PLUGIN defines one; otherwise, the synchronous hook is called directly.
+    """
+    hook = get_hook(plugin, name)
+    if hook is not None:
+        return run(hook(*args, **kwargs))
+    return getattr(plugin, name)(*args, **kwargs)
+
+
+def run(coro, workers=None):
+    """Run CORO in a new event loop and return its result.
+
+    Synchronous hooks called using call() are run in a pool of WORKERS
+    threads, which is shut down before returning.
+    """
+    loop = asyncio.new_event_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(workers)
+    loop.set_default_executor(executor)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        executor.shutdown(wait=True)
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+# Semaphores are bound to an event loop: there is one set of semaphores per
+# loop.
+_host_semaphores = weakref.WeakKeyDictionary()
+_host_semaphores_lock = threading.Lock()
+
+
+def host_semaphore(url):
+    """Return the semaphore limiting the concurrent requests to a host.
+
+    Coroutines should hold it while querying the host of URL, so that no more
+    than Session.max_connections_per_host requests are sent to a given host at
+    the same time, whatever the number of running coroutines.
+    """
+    loop = asyncio.get_event_loop()
+    parts = urllib.parse.urlsplit(url)
+    key = (parts.scheme, parts.hostname, parts.port)
+    with _host_semaphores_lock:
+        semaphores = _host_semaphores.setdefault(loop, {})
+        try:
+            return semaphores[key]
+        except KeyError:
+            limit = upt.download.get_session().max_connections_per_host
+            semaphore = semaphores[key] = asyncio.Semaphore(limit)
+            return semaphore
+
+
+_fetch_executor = None
+_fetch_executor_lock = threading.Lock()
+
+
+def _get_fetch_executor():
+    # Requests are not run in the default executor, whose threads may all be
+    # busy running synchronous hooks.
+    global _fetch_executor
+    with _fetch_executor_lock:
+        if _fetch_executor is None:
+            _fetch_executor = concurrent.futures.ThreadPoolExecutor()
+        return _fetch_executor
+
+
+def _fetch(url, headers):
+    with upt.download.get_session().get(url, headers) as response:
+        response.raise_for_status()
+        return response.read()
+
+
+async def fetch(url, headers=None):
+    """Return the body of URL, without blocking the event loop.
+
+    The request is made using the session returned by
+    upt.download.get_session(), while holding the semaphore of the host of
+    URL. urllib.error.HTTPError is raised for error responses.
+    """
+    async with host_semaphore(url):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(_get_fetch_executor(), _fetch,
+                                          url, headers)
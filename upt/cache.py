@@ -0,0 +1,361 @@
+# Copyright 2021      Cyril Roelandt
+#
+# Licensed under the 3-clause BSD license. See the LICENSE file.
+import collections
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+
+
+DEFAULT_MAX_SIZE = 1024 ** 3  # 1 GiB
+DEFAULT_METADATA_TTL = 6 * 3600  # 6 hours
+
+
+def cache_dir():
+    """Return the directory in which upt stores its caches.
+
+    This is $UPT_CACHE_DIR if set, $XDG_CACHE_HOME/upt or ~/.cache/upt
+    otherwise.
+    """
+    try:
+        return os.environ['UPT_CACHE_DIR']
+    except KeyError:
+        pass
+    base_dir = (os.environ.get('XDG_CACHE_HOME') or
+                os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base_dir, 'upt')
+
+
+def parse_size(size):
+    """Parse a human-readable size, such as '512M' or '2G', into bytes."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    size = size.strip().upper()
+    if size.endswith('B'):
+        size = size[:-1]
+    try:
+        if size and size[-1] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+        return int(size)
+    except ValueError:
+        raise ValueError(f'Invalid size: {size}')
+
+
+def parse_duration(duration):
+    """Parse a human-readable duration, such as '30m' or '2d', into seconds."""
+    units = {'S': 1, 'M': 60, 'H': 3600, 'D': 86400}
+    duration = duration.strip().upper()
+    try:
+        if duration and duration[-1] in units:
+            return int(float(duration[:-1]) * units[duration[-1]])
+        return int(duration)
+    except ValueError:
+        raise ValueError(f'Invalid duration: {duration}')
+
+
+def link_or_copy(src, dst):
+    """Make DST a hard link to SRC, or a copy of SRC if that is impossible."""
+    try:
+        os.remove(dst)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Different filesystems, or links not supported.
+        shutil.copyfile(src, dst)
+
+
+# validators: a dict that may contain the 'etag' and 'last_modified' of the
+# archive, used to check whether the archive changed upstream.
+CachedArchive = collections.namedtuple('CachedArchive',
+                                       ['path', 'size', 'hashes',
+                                        'validators'])
+
+
+class ArchiveCache(object):
+    """A persistent cache for downloaded archives.
+
+    Archives are stored once per content, under their sha256 checksum, and
+    are indexed by URL. When the cache grows bigger than MAX_SIZE bytes, the
+    least recently used archives are evicted.
+
+    directory: where the archives are stored; defaults to a subdirectory of
+               cache_dir().
+    max_size: the maximal size of the cache, in bytes.
+    """
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory or os.path.join(cache_dir(), 'archives')
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.directory, 'index.db'),
+                                   check_same_thread=False, timeout=30)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS archives ('
+                             'url TEXT PRIMARY KEY, '
+                             'sha256 TEXT NOT NULL, '
+                             'size INTEGER NOT NULL, '
+                             'hashes TEXT NOT NULL, '
+                             'last_used REAL NOT NULL, '
+                             'etag TEXT, '
+                             'last_modified TEXT)')
+            # Caches created by older versions of upt lack validators.
+            columns = [row[1] for row in
+                       self._db.execute('PRAGMA table_info(archives)')]
+            for column in ('etag', 'last_modified'):
+                if column not in columns:
+                    self._db.execute(f'ALTER TABLE archives '
+                                     f'ADD COLUMN {column} TEXT')
+
+    def _blob_path(self, sha256):
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+    def lookup(self, url, known_hashes=None):
+        """Return a CachedArchive for URL, or None if it is not cached.
+
+        known_hashes: a dict of checksums already known for this archive, for
+                      instance because they were given by a frontend. Cached
+                      archives that do not match these checksums are ignored.
+        """
+        with self._lock, self._db:
+            row = self._db.execute('SELECT sha256, size, hashes, etag, '
+                                   'last_modified FROM archives '
+                                   'WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            sha256, size, hashes, etag, last_modified = row
+            path = self._blob_path(sha256)
+            if not os.path.exists(path):
+                # Someone removed the file behind our back.
+                self._db.execute('DELETE FROM archives WHERE url = ?', (url,))
+                return None
+            hashes = json.loads(hashes)
+            for hash_name, value in (known_hashes or {}).items():
+                if hashes.get(hash_name, value) != value:
+                    return None
+            self._db.execute('UPDATE archives SET last_used = ? '
+                             'WHERE url = ?', (time.time(), url))
+        validators = {}
+        if etag is not None:
+            validators['etag'] = etag
+        if last_modified is not None:
+            validators['last_modified'] = last_modified
+        return CachedArchive(path, size, hashes, validators)
+
+    def store(self, url, filepath, hashes, validators=None, data=None):
+        """Add the archive located at FILEPATH to the cache.
+
+        url: the URL the archive was downloaded from
+        filepath: the path of the downloaded archive
+        hashes: a dict of checksums of the archive, which must at least
+                contain 'sha256'.
+        validators: a dict that may contain the 'etag' and 'last_modified'
+                    values sent by the server.
+        data: the content of the archive, for archives that were kept in
+              memory; FILEPATH is then ignored.
+        """
+        validators = validators or {}
+        sha256 = hashes['sha256']
+        path = self._blob_path(sha256)
+        size = len(data) if data is not None else os.stat(filepath).st_size
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                if data is not None:
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(data)
+                else:
+                    os.close(fd)
+                    shutil.copyfile(filepath, tmppath)
+                os.replace(tmppath, path)
+            except BaseException:
+                os.remove(tmppath)
+                raise
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO archives '
+                             '(url, sha256, size, hashes, last_used, etag, '
+                             'last_modified) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (url, sha256, size, json.dumps(hashes),
+                              time.time(), validators.get('etag'),
+                              validators.get('last_modified')))
+        self.prune()
+
+    def add_hashes(self, url, hashes):
+        """Add HASHES, a dict of checksums, to the cache entry for URL."""
+        with self._lock, self._db:
+            row = self._db.execute('SELECT sha256, hashes FROM archives '
+                                   'WHERE url = ?', (url,)).fetchone()
+            if row is None or hashes.get('sha256', row[0]) != row[0]:
+                return
+            hashes = {**json.loads(row[1]), **hashes}
+            self._db.execute('UPDATE archives SET hashes = ? WHERE url = ?',
+                             (json.dumps(hashes), url))
+
+    def stats(self):
+        """Return a dict describing the contents of the cache."""
+        with self._lock:
+            urls, = self._db.execute('SELECT COUNT(*) '
+                                     'FROM archives').fetchone()
+            archives, size = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM '
+                '(SELECT DISTINCT sha256, size FROM archives)').fetchone()
+        return {
+            'directory': self.directory,
+            'urls': urls,
+            'archives': archives,
+            'size': size,
+            'max_size': self.max_size,
+        }
+
+    def prune(self, max_size=None):
+        """Evict the least recently used archives.
+
+        Archives are evicted until the cache is no bigger than MAX_SIZE bytes
+        (by default, the max_size given to the constructor). Return the
+        number of archives that were removed.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        with self._lock, self._db:
+            blobs = self._db.execute('SELECT sha256, size, MAX(last_used) '
+                                     'FROM archives GROUP BY sha256 '
+                                     'ORDER BY MAX(last_used)').fetchall()
+            total_size = sum(size for _, size, _ in blobs)
+            removed = 0
+            for sha256, size, _ in blobs:
+                if total_size <= max_size:
+                    break
+                self._db.execute('DELETE FROM archives WHERE sha256 = ?',
+                                 (sha256,))
+                try:
+                    os.remove(self._blob_path(sha256))
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+                removed += 1
+        return removed
+
+    def clear(self):
+        """Remove all archives from the cache."""
+        return self.prune(max_size=0)
+
+    def close(self):
+        self._db.close()
+
+
+_archive_cache = None
+
+
+def get_archive_cache():
+    """Return the ArchiveCache used by upt.Archive, or None."""
+    return _archive_cache
+
+
+def set_archive_cache(cache):
+    """Make upt.Archive use CACHE (an ArchiveCache, or None to disable it)."""
+    global _archive_cache
+    _archive_cache = cache
+
+
+class MetadataCache(object):
+    """A persistent cache of the metadata returned by frontends.
+
+    Metadata is stored as compressed JSON, indexed by frontend, package name
+    and version. Metadata stored for a specific version of a package is
+    "pinned" and never expires, since released versions do not change;
+    metadata stored for the latest version of a package (when no version was
+    requested) expires after TTL seconds.
+
+    path: the path of the database; defaults to a file in cache_dir().
+    ttl: the lifetime of unpinned metadata, in seconds.
+    """
+    def __init__(self, path=None, ttl=DEFAULT_METADATA_TTL):
+        self.path = path or os.path.join(cache_dir(), 'metadata.db')
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False,
+                                   timeout=30)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS metadata ('
+                             'frontend TEXT NOT NULL, '
+                             'name TEXT NOT NULL, '
+                             'version TEXT NOT NULL, '
+                             'pinned INTEGER NOT NULL, '
+                             'created REAL NOT NULL, '
+                             'data BLOB NOT NULL, '
+                             'PRIMARY KEY (frontend, name, version))')
+
+    def lookup(self, frontend, name, version):
+        """Return the metadata of NAME@VERSION, or None if it is not cached.
+
+        VERSION may be None, for the latest version of the package.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT pinned, created, data '
+                                   'FROM metadata WHERE frontend = ? AND '
+                                   'name = ? AND version = ?',
+                                   (frontend, name, version or '')).fetchone()
+        if row is None:
+            return None
+        pinned, created, data = row
+        if not pinned and created + self.ttl <= time.time():
+            return None
+        return json.loads(zlib.decompress(data).decode('utf-8'))
+
+    def store(self, frontend, name, version, metadata):
+        """Remember METADATA, a JSON-serializable object, for NAME@VERSION.
+
+        VERSION may be None, for the latest version of the package: the
+        metadata then expires after self.ttl seconds.
+        """
+        data = zlib.compress(json.dumps(metadata,
+                                        separators=(',', ':')).encode('utf-8'))
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO metadata '
+                             '(frontend, name, version, pinned, created, '
+                             'data) VALUES (?, ?, ?, ?, ?, ?)',
+                             (frontend, name, version or '',
+                              version is not None, time.time(), data))
+
+    def prune(self):
+        """Remove expired metadata, and return the number of packages."""
+        with self._lock, self._db:
+            return self._db.execute('DELETE FROM metadata WHERE pinned = 0 '
+                                    'AND created <= ?',
+                                    (time.time() - self.ttl,)).rowcount
+
+    def stats(self):
+        """Return a dict describing the contents of the cache."""
+        with self._lock:
+            packages, = self._db.execute('SELECT COUNT(*) '
+                                         'FROM metadata').fetchone()
+        return {'path': self.path, 'packages': packages}
+
+    def clear(self):
+        """Remove all metadata from the cache, and return its number."""
+        with self._lock, self._db:
+            return self._db.execute('DELETE FROM metadata').rowcount
+
+    def close(self):
+        self._db.close()
+
+
+_metadata_cache = None
+
+
+def get_metadata_cache():
+    """Return the MetadataCache used when parsing packages, or None."""
+    return _metadata_cache
+
+
+def set_metadata_cache(cache):
+    """Make upt use CACHE (a MetadataCache, or None) when parsing packages."""
+    global _metadata_cache
+    _metadata_cache = cache
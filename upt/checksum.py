@@ -3,7 +3,15 @@
 # Licensed under the 3-clause BSD license. See the LICENSE file.
 import base64
 import binascii
+import concurrent.futures
 import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import threading
+
+import upt.cache
 
 
 class HashUnknown(Exception):
@@ -22,46 +30,342 @@ class HashUnavailable(Exception):
         return f'Hash "{self.hash_name}" is not available on your system'
 
 
-def _compute_checksum(checksum_fn, filepath):
-    # TODO: Compute this chunk by chunk?
-    m = checksum_fn()
+# Maps checksum names to functions returning a new hash object.
+_HASH_FUNCTIONS = {
+    'md5': hashlib.md5,
+    'rmd160': lambda: hashlib.new('ripemd160'),
+    'sha256': hashlib.sha256,
+    'sha512': hashlib.sha512,
+}
+
+
+def _hex_to_base64(hexdigest):
+    return base64.b64encode(binascii.a2b_hex(hexdigest)).decode('ascii')
+
+
+# Checksums that are only another encoding of a "real" checksum. Values are
+# (name of the real checksum, conversion function).
+_DERIVED_CHECKSUMS = {
+    'sha256_base64': ('sha256', _hex_to_base64),
+}
+
+
+def _base_checksum(hash_name):
+    """Return the name of the checksum actually computed for HASH_NAME."""
+    while hash_name in _DERIVED_CHECKSUMS:
+        hash_name, _ = _DERIVED_CHECKSUMS[hash_name]
+    return hash_name
+
+
+def derive_checksums(hashes, hash_names):
+    """Derive checksums from already computed ones.
+
+    hashes: a dict mapping checksum names to known values.
+    hash_names: the names of the wanted checksums.
+
+    Return a dict mapping the names in HASH_NAMES that are not in HASHES, but
+    can be derived from them (such as 'sha256_base64' from 'sha256'), to
+    their values.
+    """
+    hashes = dict(hashes)
+    derived = {}
+
+    def derive(hash_name):
+        if hash_name in hashes:
+            return hashes[hash_name]
+        try:
+            base_name, convert_fn = _DERIVED_CHECKSUMS[hash_name]
+        except KeyError:
+            return None
+        base_value = derive(base_name)
+        if base_value is None:
+            return None
+        value = hashes[hash_name] = derived[hash_name] = convert_fn(base_value)
+        return value
+
+    for hash_name in hash_names:
+        derive(hash_name)
+    return {hash_name: value for hash_name, value in derived.items()
+            if hash_name in hash_names}
+
+
+def is_available(hash_name):
+    """Return whether the checksum HASH_NAME can be computed on this system."""
+    try:
+        Hasher([hash_name])
+    except (HashUnknown, HashUnavailable):
+        return False
+    return True
+
+
+class Hasher(object):
+    """Compute several checksums at once, from a stream of data.
+
+    hash_names: an iterable of checksum names, such as 'md5' or 'sha256'.
+
+    Feed data using update(), then get all checksums using hexdigests().
+    """
+    def __init__(self, hash_names):
+        self.hash_names = set(hash_names)
+        self.reset()
+
+    def reset(self):
+        """Forget about all the data fed so far."""
+        self._hashes = {}
+        for hash_name in self.hash_names:
+            base_name = _base_checksum(hash_name)
+            if base_name in self._hashes:
+                continue
+            try:
+                hash_fn = _HASH_FUNCTIONS[base_name]
+            except KeyError:
+                raise HashUnknown(hash_name)
+            try:
+                self._hashes[base_name] = hash_fn()
+            except ValueError:
+                raise HashUnavailable(hash_name)
+
+    def update(self, data):
+        for m in self._hashes.values():
+            m.update(data)
+
+    def hexdigests(self):
+        """Return a dict mapping checksum names to their values.
+
+        This includes the checksums required to compute derived checksums
+        (such as 'sha256' for 'sha256_base64').
+        """
+        digests = {name: m.hexdigest() for name, m in self._hashes.items()}
+        digests.update(derive_checksums(digests, self.hash_names))
+        return digests
+
+
+# Files are hashed CHUNK_SIZE bytes at a time, so that memory usage does not
+# depend on the size of the file.
+CHUNK_SIZE = 1024 * 1024
+
+# Files at least this big are mapped in memory instead of being read.
+MMAP_MIN_SIZE = 16 * 1024 * 1024
+
+_local = threading.local()
+
+
+def _get_buffer():
+    """Return a buffer of CHUNK_SIZE bytes, reused by the current thread."""
+    buf = getattr(_local, 'buffer', None)
+    if buf is None or len(buf) != CHUNK_SIZE:
+        buf = _local.buffer = bytearray(CHUNK_SIZE)
+    return buf
+
+
+def _hash_file(filepath, update):
+    """Feed the content of FILEPATH to UPDATE, chunk by chunk.
+
+    Big files are mapped in memory, and fed to UPDATE without being copied.
+    Other files are read into a preallocated buffer.
+    """
     with open(filepath, 'rb') as f:
-        m.update(f.read())
-    return m.hexdigest()
+        if os.fstat(f.fileno()).st_size >= MMAP_MIN_SIZE:
+            try:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # Not supported by this file or filesystem.
+                pass
+            else:
+                with m, memoryview(m) as view:
+                    for offset in range(0, len(view), CHUNK_SIZE):
+                        update(view[offset:offset + CHUNK_SIZE])
+                return
+        buf = _get_buffer()
+        with memoryview(buf) as view:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                update(view[:n])
+
+
+def _identity(stat_result):
+    return (stat_result.st_dev, stat_result.st_ino, stat_result.st_size,
+            stat_result.st_mtime_ns)
+
+
+class ChecksumCache(object):
+    """A persistent cache of the checksums of local files.
+
+    Entries are indexed by path, and are only used as long as the device,
+    inode, size and modification time of the file are unchanged.
+
+    path: the path of the database; defaults to a file in
+          upt.cache.cache_dir().
+    """
+    def __init__(self, path=None):
+        self.path = path or os.path.join(upt.cache.cache_dir(),
+                                         'checksums.db')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False,
+                                   timeout=30)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS checksums ('
+                             'path TEXT PRIMARY KEY, '
+                             'device INTEGER NOT NULL, '
+                             'inode INTEGER NOT NULL, '
+                             'size INTEGER NOT NULL, '
+                             'mtime_ns INTEGER NOT NULL, '
+                             'hashes TEXT NOT NULL)')
+
+    def _lookup(self, filepath, stat_result):
+        row = self._db.execute('SELECT device, inode, size, mtime_ns, hashes '
+                               'FROM checksums WHERE path = ?',
+                               (filepath,)).fetchone()
+        if row is None or tuple(row[:4]) != _identity(stat_result):
+            return {}
+        return json.loads(row[4])
+
+    def lookup(self, filepath, stat_result=None):
+        """Return a dict of the known checksums of FILEPATH.
+
+        stat_result: the result of os.stat(FILEPATH), if already known.
+        """
+        filepath = os.path.abspath(filepath)
+        stat_result = stat_result or os.stat(filepath)
+        with self._lock:
+            return self._lookup(filepath, stat_result)
 
+    def store(self, filepath, hashes, stat_result=None):
+        """Remember the checksums of FILEPATH, given as a dict.
 
-def _compute_md5_checksum(filepath):
-    return _compute_checksum(hashlib.md5, filepath)
+        stat_result: the result of os.stat(FILEPATH) before computing the
+                     checksums.
+        """
+        filepath = os.path.abspath(filepath)
+        stat_result = stat_result or os.stat(filepath)
+        with self._lock, self._db:
+            hashes = {**self._lookup(filepath, stat_result), **hashes}
+            self._db.execute('INSERT OR REPLACE INTO checksums '
+                             '(path, device, inode, size, mtime_ns, hashes) '
+                             'VALUES (?, ?, ?, ?, ?, ?)',
+                             (filepath, *_identity(stat_result),
+                              json.dumps(hashes)))
 
+    def prune(self):
+        """Forget about files that were modified or removed.
 
-def _compute_rmd160_checksum(filepath):
-    return _compute_checksum(lambda: hashlib.new('ripemd160'), filepath)
+        Return the number of entries that were removed.
+        """
+        with self._lock, self._db:
+            rows = self._db.execute('SELECT path, device, inode, size, '
+                                    'mtime_ns FROM checksums').fetchall()
+            removed = 0
+            for row in rows:
+                try:
+                    if _identity(os.stat(row[0])) == tuple(row[1:]):
+                        continue
+                except OSError:
+                    pass
+                self._db.execute('DELETE FROM checksums WHERE path = ?',
+                                 (row[0],))
+                removed += 1
+        return removed
 
+    def stats(self):
+        """Return a dict describing the contents of the cache."""
+        with self._lock:
+            files, = self._db.execute('SELECT COUNT(*) '
+                                      'FROM checksums').fetchone()
+        return {'path': self.path, 'files': files}
 
-def _compute_sha256_checksum(filepath):
-    return _compute_checksum(hashlib.sha256, filepath)
+    def clear(self):
+        """Remove all entries from the cache, and return their number."""
+        with self._lock, self._db:
+            return self._db.execute('DELETE FROM checksums').rowcount
 
+    def close(self):
+        self._db.close()
 
-def _compute_sha256_base64_checksum(filepath):
-    sha256 = _compute_sha256_checksum(filepath)
-    return base64.b64encode(binascii.a2b_hex(sha256)).decode('ascii')
 
+_checksum_cache = None
 
-def _compute_sha512_checksum(filepath):
-    return _compute_checksum(hashlib.sha512, filepath)
+
+def get_checksum_cache():
+    """Return the ChecksumCache used by compute_checksums(), or None."""
+    return _checksum_cache
+
+
+def set_checksum_cache(cache):
+    """Make compute_checksums() use CACHE (a ChecksumCache, or None)."""
+    global _checksum_cache
+    _checksum_cache = cache
+
+
+def compute_checksums(filepath, hash_names, known_hashes=None,
+                      use_cache=True):
+    """Compute several checksums of FILEPATH, reading the file only once.
+
+    hash_names: an iterable of checksum names, such as 'md5' or 'sha256'.
+    known_hashes: a dict of checksums of the file that are already known.
+                  They are not computed again, and checksums that can be
+                  derived from them (such as 'sha256_base64' from 'sha256')
+                  are computed without reading the file.
+    use_cache: whether to use the ChecksumCache returned by
+               get_checksum_cache(), if any. It should not be used for
+               short-lived files.
+
+    Return a dict mapping checksum names to their values. It contains all of
+    HASH_NAMES, and may contain the checksums they were derived from.
+    """
+    hash_names = set(hash_names)
+    known_hashes = known_hashes or {}
+    cache = get_checksum_cache() if use_cache else None
+    if cache is not None:
+        stat_result = os.stat(filepath)
+        known_hashes = {**cache.lookup(filepath, stat_result), **known_hashes}
+    hashes = {hash_name: known_hashes[hash_name]
+              for hash_name in hash_names & known_hashes.keys()}
+    hashes.update(derive_checksums(known_hashes, hash_names))
+    missing = hash_names - hashes.keys()
+    if missing:
+        hasher = Hasher(missing)
+        _hash_file(filepath, hasher.update)
+        computed = hasher.hexdigests()
+        hashes.update(computed)
+        # Do not remember checksums of a file modified while being read.
+        if cache is not None and \
+                _identity(os.stat(filepath)) == _identity(stat_result):
+            cache.store(filepath, computed, stat_result)
+    return hashes
+
+
+def compute_many(filepaths, hash_names, workers=None, known_hashes=None,
+                 use_cache=True):
+    """Compute the checksums of several files concurrently.
+
+    filepaths: an iterable of paths.
+    hash_names: the names of the checksums to compute for every file.
+    workers: the maximal number of files hashed at the same time; defaults to
+             the number of processors.
+    known_hashes: a dict mapping paths to the dict of their already known
+                  checksums.
+    use_cache: see compute_checksums().
+
+    hashlib releases the GIL while hashing, so files are hashed in parallel
+    by a pool of threads. Return a dict mapping every path to the result of
+    compute_checksums() for this path.
+    """
+    filepaths = list(dict.fromkeys(filepaths))
+    known_hashes = known_hashes or {}
+
+    def compute(filepath):
+        return compute_checksums(filepath, hash_names,
+                                 known_hashes.get(filepath), use_cache)
+
+    if len(filepaths) <= 1 or workers == 1:
+        return {filepath: compute(filepath) for filepath in filepaths}
+    workers = min(workers or os.cpu_count() or 1, len(filepaths))
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return dict(zip(filepaths, executor.map(compute, filepaths)))
 
 
 def compute_checksum(filepath, hash_name):
-    hash_functions = {
-        'md5': _compute_md5_checksum,
-        'rmd160': _compute_rmd160_checksum,
-        'sha256': _compute_sha256_checksum,
-        'sha256_base64': _compute_sha256_base64_checksum,
-        'sha512': _compute_sha512_checksum,
-    }
-    try:
-        return hash_functions[hash_name](filepath)
-    except KeyError:
-        raise HashUnknown(hash_name)
-    except ValueError:
-        raise HashUnavailable(hash_name)
+    return compute_checksums(filepath, [hash_name])[hash_name]
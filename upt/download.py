@@ -0,0 +1,519 @@
+# Copyright 2021      Cyril Roelandt
+#
+# Licensed under the 3-clause BSD license. See the LICENSE file.
+import base64
+import collections
+import http.client
+import io
+import json
+import os
+import socket
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import weakref
+
+
+CHUNK_SIZE = 64 * 1024
+MAX_RETRIES = 5
+
+
+class NotModified(Exception):
+    """The resource did not change since it was last downloaded."""
+    def __init__(self, url):
+        self.url = url
+
+    def __str__(self):
+        return f'{self.url} has not been modified'
+
+
+class IntegrityError(Exception):
+    """The downloaded data does not match what was expected."""
+    def __init__(self, url, expected, actual):
+        self.url = url
+        self.expected = expected
+        self.actual = actual
+
+
+class SizeMismatch(IntegrityError):
+    def __str__(self):
+        return (f'{self.url}: expected {self.expected} bytes, got '
+                f'{self.actual} bytes')
+
+
+class ChecksumMismatch(IntegrityError):
+    def __init__(self, url, hash_name, expected, actual):
+        super().__init__(url, expected, actual)
+        self.hash_name = hash_name
+
+    def __str__(self):
+        return (f'{self.url}: expected {self.hash_name} checksum '
+                f'{self.expected}, got {self.actual}')
+
+
+# size: the number of bytes that were downloaded
+# validators: a dict that may contain the 'etag' and 'last_modified' values
+#             sent by the server
+# data: the downloaded bytes, if they were kept in memory rather than written
+#       to a file (see download()), None otherwise
+DownloadResult = collections.namedtuple('DownloadResult',
+                                        ['size', 'validators', 'data'])
+DownloadResult.__new__.__defaults__ = (None,)
+
+
+def conditional_headers(validators):
+    """Return the headers of a conditional request, given VALIDATORS.
+
+    VALIDATORS is a dict such as the ones found in DownloadResult.
+    """
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+def _validators(headers):
+    validators = {}
+    if headers.get('ETag'):
+        validators['etag'] = headers['ETag']
+    if headers.get('Last-Modified'):
+        validators['last_modified'] = headers['Last-Modified']
+    return validators
+
+
+def _get_proxy(scheme, host):
+    """Return the URL of the proxy used to reach HOST using SCHEME, as a
+    urllib.parse.SplitResult, or None if no proxy should be used."""
+    proxy = urllib.request.getproxies().get(scheme)
+    if proxy is None or urllib.request.proxy_bypass(host):
+        return None
+    if '://' not in proxy:
+        proxy = f'http://{proxy}'
+    return urllib.parse.urlsplit(proxy)
+
+
+def _proxy_headers(proxy):
+    """Return the headers authenticating requests sent to PROXY, a value
+    returned by _get_proxy()."""
+    if proxy.username is None:
+        return {}
+    credentials = (f'{urllib.parse.unquote(proxy.username)}:'
+                   f'{urllib.parse.unquote(proxy.password or "")}')
+    token = base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+    return {'Proxy-Authorization': f'Basic {token}'}
+
+
+class Response(object):
+    """An HTTP response returned by Session.request.
+
+    Responses should be used as context managers, so that the underlying
+    connection is given back to the session once the response is closed:
+
+        with session.get(url) as response:
+            data = response.read()
+
+    Responses that are not closed release their connection when they are
+    garbage collected, so that they do not hold one of the connections
+    allowed per host forever.
+
+    Attributes:
+    - url: the URL of the response, after following redirections
+    - status: the HTTP status code, as an int
+    - headers: the HTTP headers, as an http.client.HTTPMessage
+    """
+    def __init__(self, session, key, conn, response, url):
+        self._session = session
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self._finalizer = weakref.finalize(self, session._release_connection,
+                                           key, conn, False)
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        while True:
+            chunk = self._response.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def json(self):
+        return json.loads(self.read().decode('utf-8'))
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise urllib.error.HTTPError(self.url, self.status, self.reason,
+                                         self.headers, None)
+
+    def close(self):
+        if self._conn is None:
+            return
+        # The connection may only be reused if the whole response was read.
+        reusable = self._response.isclosed() and not self._response.will_close
+        self._response.close()
+        self._finalizer.detach()
+        self._session._release_connection(self._key, self._conn, reusable)
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Session(object):
+    """A pool of keep-alive HTTP(S) connections.
+
+    Connections are reused across requests made to the same host, which saves
+    a TCP (and TLS) handshake per request. A session may be shared by several
+    threads.
+
+    max_connections_per_host: the maximal number of simultaneous connections
+                              to a given host
+    timeout: timeout of blocking operations, in seconds
+    """
+    MAX_REDIRECTS = 10
+
+    def __init__(self, max_connections_per_host=4, timeout=60):
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._semaphores = {}  # (scheme, host, port) -> BoundedSemaphore
+        self._idle_connections = {}  # (scheme, host, port) -> [conn, ...]
+
+    def _new_connection(self, scheme, host, port):
+        if scheme == 'https':
+            conn_cls = http.client.HTTPSConnection
+        else:
+            conn_cls = http.client.HTTPConnection
+
+        proxy = _get_proxy(scheme, host)
+        if proxy is None:
+            return conn_cls(host, port, timeout=self.timeout)
+
+        conn = conn_cls(proxy.hostname, proxy.port, timeout=self.timeout)
+        if scheme == 'https':
+            conn.set_tunnel(host, port, headers=_proxy_headers(proxy))
+        return conn
+
+    def _get_connection(self, key):
+        with self._lock:
+            semaphore = self._semaphores.setdefault(
+                key, threading.BoundedSemaphore(self.max_connections_per_host))
+        semaphore.acquire()
+        with self._lock:
+            idle_connections = self._idle_connections.get(key)
+            if idle_connections:
+                return idle_connections.pop(), True
+        return self._new_connection(*key), False
+
+    def _release_connection(self, key, conn, reusable):
+        if reusable:
+            with self._lock:
+                self._idle_connections.setdefault(key, []).append(conn)
+        else:
+            conn.close()
+        self._semaphores[key].release()
+
+    def _request_once(self, method, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f'Unsupported URL scheme: {url}')
+        default_port = 443 if parts.scheme == 'https' else 80
+        key = (parts.scheme, parts.hostname, parts.port or default_port)
+        path = urllib.parse.urlunsplit(('', '', parts.path or '/',
+                                        parts.query, ''))
+        if parts.scheme == 'http':
+            proxy = _get_proxy('http', parts.hostname)
+            if proxy is not None:
+                path = url
+                headers = {**(headers or {}), **_proxy_headers(proxy)}
+
+        conn, reused = self._get_connection(key)
+        try:
+            try:
+                conn.request(method, path, headers=headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                if not reused:
+                    raise
+                # The server closed an idle connection: try a new one.
+                conn.close()
+                conn = self._new_connection(*key)
+                conn.request(method, path, headers=headers)
+                response = conn.getresponse()
+        except BaseException:
+            self._release_connection(key, conn, False)
+            raise
+        return Response(self, key, conn, response, url)
+
+    def request(self, method, url, headers=None):
+        """Perform an HTTP request, following redirections.
+
+        Return a Response, which should be closed once it is no longer
+        needed.
+        """
+        headers = dict(headers or {})
+        for _ in range(self.MAX_REDIRECTS + 1):
+            response = self._request_once(method, url, headers)
+            location = response.headers.get('Location')
+            if response.status not in (301, 302, 303, 307, 308) or \
+                    location is None:
+                return response
+            # Read the (usually tiny) body so that the connection is reused.
+            response.read()
+            response.close()
+            url = urllib.parse.urljoin(url, location)
+            if response.status == 303:
+                method = 'GET'
+        raise urllib.error.HTTPError(url, response.status,
+                                     'Too many redirections',
+                                     response.headers, None)
+
+    def get(self, url, headers=None):
+        return self.request('GET', url, headers)
+
+    def head(self, url, headers=None):
+        return self.request('HEAD', url, headers)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            for connections in self._idle_connections.values():
+                for conn in connections:
+                    conn.close()
+            self._idle_connections = {}
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the Session shared by all downloads of the current run.
+
+    Frontends may use it to query package repositories, so that they share
+    connections with the archive downloads.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Session()
+        return _session
+
+
+def close_session():
+    """Close the shared Session, if it was ever used."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def _open(url, session, headers):
+    if _is_http(url):
+        response = session.get(url, headers)
+        try:
+            if response.status == 304:
+                raise NotModified(url)
+            response.raise_for_status()
+        except BaseException:
+            response.close()
+            raise
+        return response
+    # file://, ftp://, etc.
+    return urllib.request.urlopen(url)
+
+
+def _is_http(url):
+    return urllib.parse.urlsplit(url).scheme in ('http', 'https')
+
+
+def _content_length(response):
+    try:
+        return int(response.headers['Content-Length'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _resume(url, session, offset, validators):
+    """Ask for the content of URL starting at byte OFFSET.
+
+    The server may answer with the whole file (status 200) if it does not
+    support ranges, or if the file changed since we started downloading it.
+    """
+    headers = {'Range': f'bytes={offset}-'}
+    if_range = validators.get('etag') or validators.get('last_modified')
+    if if_range:
+        headers['If-Range'] = if_range
+    response = _open(url, session, headers)
+    content_range = response.headers.get('Content-Range', '')
+    if response.status == 206 and \
+            not content_range.startswith(f'bytes {offset}-'):
+        response.close()
+        raise urllib.error.HTTPError(url, 206, 'Unexpected Content-Range',
+                                     response.headers, None)
+    return response
+
+
+# Errors after which an interrupted download is worth resuming. Before Python
+# 3.10, socket.timeout is not a subclass of TimeoutError.
+_TRANSIENT_ERRORS = (http.client.IncompleteRead, ConnectionError,
+                     TimeoutError, socket.timeout)
+
+
+def remote_size(url, session=None):
+    """Return the size of the file located at URL, without downloading it.
+
+    This uses a HEAD request. Return None if the size cannot be found this
+    way (because URL is not an HTTP(S) URL, because the server does not send
+    a Content-Length header, etc.).
+    """
+    if not _is_http(url):
+        return None
+    with (session or get_session()).head(url) as response:
+        if response.status >= 400:
+            return None
+        return _content_length(response)
+
+
+def _remove(filepath):
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
+
+
+def _check_size(url, expected_size, size):
+    if expected_size is not None and size != expected_size:
+        raise SizeMismatch(url, expected_size, size)
+
+
+def _check_hashes(url, expected_hashes, hasher):
+    if not expected_hashes:
+        return
+    digests = hasher.hexdigests()
+    for hash_name, value in sorted(expected_hashes.items()):
+        if digests[hash_name] != value:
+            raise ChecksumMismatch(url, hash_name, value, digests[hash_name])
+
+
+def download(url, filepath, hasher=None, session=None, headers=None,
+             max_retries=MAX_RETRIES, size_callback=None, expected_size=None,
+             expected_hashes=None, spool_max_size=0):
+    """Download URL to FILEPATH.
+
+    Every chunk of data is fed to HASHER (an upt.checksum.Hasher) as soon as
+    it is received, so that checksums are available as soon as the download
+    is over, without reading the file again.
+
+    HTTP(S) downloads use SESSION, or the shared session returned by
+    get_session(). HEADERS are sent along with the request: when they make it
+    conditional (see conditional_headers()), NotModified is raised if the
+    server says the file did not change, and FILEPATH is left untouched.
+
+    If the connection drops, the download is resumed (at most MAX_RETRIES
+    times) from where it stopped, using an HTTP Range request. The data that
+    was already received is neither downloaded nor hashed again.
+
+    If given, SIZE_CALLBACK is called with the size of the file announced by
+    the server (or None if unknown) as soon as the server starts answering.
+
+    EXPECTED_SIZE (in bytes) and EXPECTED_HASHES (a dict mapping checksum
+    names to values, all of which must be computed by HASHER) are checked
+    while downloading. SizeMismatch is raised as soon as the size of the file
+    is known to be wrong, possibly before downloading anything, and
+    ChecksumMismatch is raised if a checksum does not match once the download
+    is over. In both cases, FILEPATH is not written.
+
+    The data is written to FILEPATH.part, which is atomically renamed to
+    FILEPATH once the download is complete and verified: FILEPATH never
+    contains a partial file.
+
+    Files whose size is announced by the server and is no bigger than
+    SPOOL_MAX_SIZE bytes are kept in memory: FILEPATH is not written and the
+    data is returned in DownloadResult.data. FILEPATH may also be a function
+    returning the path, which is only called if the file is written to disk.
+
+    Return a DownloadResult.
+    """
+    session = session or get_session()
+    response = _open(url, session, headers)
+    partpath = None
+    try:
+        validators = _validators(response.headers)
+        content_length = _content_length(response)
+        if size_callback is not None:
+            size_callback(content_length)
+        if content_length is not None:
+            _check_size(url, expected_size, content_length)
+        in_memory = (content_length is not None and
+                     content_length <= spool_max_size)
+        if not in_memory:
+            if callable(filepath):
+                filepath = filepath()
+            partpath = f'{filepath}.part'
+        size = 0
+        retries = 0
+        with (io.BytesIO() if in_memory else open(partpath, 'wb')) as f:
+            while True:
+                try:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk and content_length is not None and \
+                            size < content_length:
+                        # http.client does not complain about truncated
+                        # responses.
+                        raise http.client.IncompleteRead(b'', content_length)
+                except _TRANSIENT_ERRORS:
+                    if not _is_http(url) or retries == max_retries:
+                        raise
+                    retries += 1
+                    response.close()
+                    response = _resume(url, session, size, validators)
+                    if response.status == 200:
+                        # Start over.
+                        f.seek(0)
+                        f.truncate()
+                        if hasher is not None:
+                            hasher.reset()
+                        size = 0
+                        validators = _validators(response.headers)
+                        content_length = _content_length(response)
+                    elif content_length is None:
+                        remaining_size = _content_length(response)
+                        if remaining_size is not None:
+                            content_length = size + remaining_size
+                    continue
+                if not chunk:
+                    break
+                size += len(chunk)
+                if expected_size is not None and size > expected_size:
+                    raise SizeMismatch(url, expected_size, size)
+                f.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+            data = f.getvalue() if in_memory else None
+        _check_size(url, expected_size, size)
+        _check_hashes(url, expected_hashes, hasher)
+        if not in_memory:
+            # FILEPATH may be a hard link to an archive in the cache: it is
+            # replaced, not overwritten.
+            os.replace(partpath, filepath)
+    except BaseException:
+        if partpath is not None:
+            _remove(partpath)
+        raise
+    finally:
+        response.close()
+    return DownloadResult(size, validators, data)
@@ -8,715 +8,738 @@
 # - https://www.gnu.org/licenses/license-list.en.html#GPLCompatibleLicenses
 # - https://wiki.debian.org/DFSGLicenses
 # - https://spdx.org/licenses/
-import spdx_lookup
+import concurrent.futures
+import hashlib
+import heapq
+import os
+import re
+import sqlite3
+import threading
+
+import upt.cache
+
+
+# Maps lower-cased SPDX identifiers to License subclasses. Filled when the
+# subclasses are defined, so that lookups never have to walk the class
+# hierarchy.
+_registry = {}
+
+
+# Flags describing the nature of a license, see License.flags.
+OSI_APPROVED = 1
+GPL_COMPATIBLE = 2
+DFSG_COMPATIBLE = 4
+
+# Maps License subclasses to their only instance.
+_instances = {}
 
 
 class License(object):
+    """A software license.
+
+    Licenses carry no state: every License subclass has a single instance,
+    returned whenever the class is instantiated, and equal licenses are
+    usually the same object.
+
+    flags: a combination of OSI_APPROVED, GPL_COMPATIBLE and DFSG_COMPATIBLE,
+           inherited from the base classes.
+    """
+    __slots__ = ()
+    flags = 0
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        flags = cls.__dict__.get('flags', 0)
+        for base in cls.__bases__:
+            flags |= getattr(base, 'flags', 0)
+        cls.flags = flags
+        # Subclasses that merely inherit an identifier are not registered.
+        if 'spdx_identifier' in cls.__dict__:
+            _registry.setdefault(cls.spdx_identifier.lower(), cls)
+
+    def __new__(cls):
+        try:
+            return _instances[cls]
+        except KeyError:
+            return _instances.setdefault(cls, super().__new__(cls))
+
     def is_osi_approved(self):
-        return False
+        return bool(self.flags & OSI_APPROVED)
 
     def is_gpl_compatible(self):
-        return False
+        return bool(self.flags & GPL_COMPATIBLE)
 
     def is_dfsg_compatible(self):
-        return False
+        return bool(self.flags & DFSG_COMPATIBLE)
 
     def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, License):
+            return NotImplemented
         return self.spdx_identifier == other.spdx_identifier
 
+    def __hash__(self):
+        return hash(self.spdx_identifier)
+
 
 class OSIApprovedLicense(License):
-    def is_osi_approved(self):
-        return True
+    __slots__ = ()
+    flags = OSI_APPROVED
 
 
 class GPLCompatibleLicense(License):
-    def is_gpl_compatible(self):
-        return True
+    __slots__ = ()
+    flags = GPL_COMPATIBLE
 
 
 class DFSGCompatibleLicense(License):
-    def is_dfsg_compatible(self):
-        return True
+    __slots__ = ()
+    flags = DFSG_COMPATIBLE
 
 
 class UnknownLicense(License):
     """License returned when upt cannot guess the right license."""
+    __slots__ = ()
     name = 'Unknown license - upt could not determine what it was'
     spdx_identifier = 'unknown'
 
 
-class AcademicFreeLicenseOneDotOne(OSIApprovedLicense):
-    name = 'Academic Free License 1.1'
-    spdx_identifier = 'AFL-1.1'
-
-
-class AcademicFreeLicenseOneDotTwo(OSIApprovedLicense):
-    name = 'Academic Free License 1.2'
-    spdx_identifier = 'AFL-1.2'
-
-
-class AcademicFreeLicenseTwoDotZero(OSIApprovedLicense):
-    name = 'Academic Free License 2.0'
-    spdx_identifier = 'AFL-2.0'
-
-
-class AcademicFreeLicenseTwoDotOne(OSIApprovedLicense):
-    name = 'Academic Free License 2.1'
-    spdx_identifier = 'AFL-2.1'
-
-
-class AcademicFreeLicenseThreeDotZero(OSIApprovedLicense):
-    name = 'Academic Free License 3.0'
-    spdx_identifier = 'AFL-3.0'
-
-
-class AdaptivePublicLicense(OSIApprovedLicense):
-    name = 'Adaptive Public License'
-    spdx_identifier = 'APL-1.0'
-
-
-class AladdinFreePublicLicense(License):
-    name = 'Aladdin Free Public License'
-    spdx_identifier = 'Aladdin'
-
-
-class ApacheLicenseOneDotZero(OSIApprovedLicense):
-    name = 'Apache License 1.0'
-    spdx_identifier = 'Apache-1.0'
-
-
-class ApacheLicenseOneDotOne(OSIApprovedLicense):
-    name = 'Apache License 1.1'
-    spdx_identifier = 'Apache-1.1'
-
-
-class ApacheLicenseTwoDotZero(OSIApprovedLicense, GPLCompatibleLicense):
-    name = 'Apache License 2.0'
-    spdx_identifier = 'Apache-2.0'
-
-
-class ApplePublicSourceLicenseOneDotZero(OSIApprovedLicense):
-    name = 'Apple Public Source License 1.0'
-    spdx_identifier = 'APSL-1.0'
-
-
-class ApplePublicSourceLicenseOneDotOne(OSIApprovedLicense):
-    name = 'Apple Public Source License 1.1'
-    spdx_identifier = 'APSL-1.1'
-
-
-class ApplePublicSourceLicenseOneDotTwo(OSIApprovedLicense):
-    name = 'Apple Public Source License 1.2'
-    spdx_identifier = 'APSL-1.2'
-
-
-class ApplePublicSourceLicenseTwoDotTwo(OSIApprovedLicense):
-    name = 'Apple Public Source License'
-    spdx_identifier = 'APSL-2.0'
-
-
-class ArtisticLicenseOneDotZero(DFSGCompatibleLicense,
-                                OSIApprovedLicense):
-    name = 'Artistic License 1.0'
-    spdx_identifier = 'Artistic-1.0'
-
-
-class ArtisticLicenseTwoDotZero(DFSGCompatibleLicense,
-                                GPLCompatibleLicense,
-                                OSIApprovedLicense):
-    name = 'Artistic License 2.0'
-    spdx_identifier = 'Artistic-2.0'
-
-
-class AttributionAssuranceLicense(OSIApprovedLicense):
-    name = 'Attribution Assurance License'
-    spdx_identifier = 'AAL'
-
-
-class BoostSoftwareLicense(OSIApprovedLicense, GPLCompatibleLicense):
-    name = 'Boost Software License'
-    spdx_identifier = 'BSL-1.0'
-
-
-class BSDTwoClauseLicense(OSIApprovedLicense, GPLCompatibleLicense):
-    name = '2-clause BSD License'
-    spdx_identifier = 'BSD-2-Clause'
-
-
-class BSDTwoClausePatent(DFSGCompatibleLicense,
-                         OSIApprovedLicense):
-    name = 'BSD+Patent'
-    spdx_identifier = 'BSD-2-Clause-Patent'
-
-
-class BSDThreeClauseLicense(OSIApprovedLicense, GPLCompatibleLicense):
-    name = '3-clause BSD License'
-    spdx_identifier = 'BSD-3-Clause'
-
-
-class CC0LicenceOneDotZero(GPLCompatibleLicense):
-    name = 'Creative Commons Zero v1.0 Universal'
-    spdx_identifier = 'CC0-1.0'
-
-
-class CCBYSAFourDotZero(DFSGCompatibleLicense, GPLCompatibleLicense):
-    name = 'Creative Commons Attribution Share Alike 4.0 International'
-    spdx_identifier = 'CC-BY-SA-4.0'
-
-
-class CeCILLBLicense(License):
-    name = 'CeCILL-B'
-    spdx_identifier = 'CECILL-B'
-
-
-class CeCILLCLicense(License):
-    name = 'CeCILL-C'
-    spdx_identifier = 'CECILL-C'
-
-
-class CeCILLTwoDotZero(GPLCompatibleLicense):
-    name = 'CeCILL License 2.0'
-    spdx_identifier = 'CECILL-2.0'
-
-
-class CeCILLTwoDotOne(OSIApprovedLicense, GPLCompatibleLicense):
-    name = 'CeCILL License 2.1'
-    spdx_identifier = 'CECILL-2.1'
-
-
-class ClarifiedArtisticLicence(GPLCompatibleLicense):
-    name = 'Clarified Artistic License'
-    spdx_identifier = 'ClArtistic'
-
-
-class CNRIPythonLicense(OSIApprovedLicense):
-    name = 'CNRI Python License'
-    spdx_identifier = 'CNRI-Python'
-
-
-class CommonDevelopmentAndDistributionLicenseOneDotZero(OSIApprovedLicense):
-    name = 'Common Development and Distribution License 1.0'
-    spdx_identifier = 'CDDL-1.0'
-
-
-class CommonPublicLicenseOneDotZero(DFSGCompatibleLicense,
-                                    OSIApprovedLicense):
-    name = 'Common Public License'
-    spdx_identifier = 'CPL-1.0'
-
-
-class CommonPublicAttributionLicenseOneDotZero(OSIApprovedLicense):
-    name = 'Common Public Attribution License 1.0'
-    spdx_identifier = 'CPAL-1.0'
-
-
-class ComputerAssociatesTrustedOpenSourceLicenseOneDotOne(OSIApprovedLicense):
-    name = 'Computer Associates Trusted Open Source License 1.1'
-    spdx_identifier = 'CATOSL-1.1'
-
-
-class CUAOfficePublicLicenseOneDotZero(OSIApprovedLicense):
-    name = 'CUA Office Public License Version 1.0'
-    spdx_identifier = 'CUA-OPL-1.0'
-
-
-class EUDataGridSoftwareLicense(OSIApprovedLicense, GPLCompatibleLicense):
-    name = 'EU DataGrid Software License'
-    spdx_identifier = 'EUDatagrid'
-
-
-class EclipsePublicLicenseOneDotZero(DFSGCompatibleLicense,
-                                     OSIApprovedLicense):
-    name = 'Eclipse Public License 1.0'
-    spdx_identifier = 'EPL-1.0'
-
-
-class EclipsePublicLicenseTwoDotZero(OSIApprovedLicense):
-    name = 'Eclipse Public License 2.0'
-    spdx_identifier = 'EPL-2.0'
-
-
-class ECosLicenseTwoDotZero(OSIApprovedLicense, GPLCompatibleLicense):
-    name = 'eCos License version 2.0'
-    spdx_identifier = 'eCos-2.0'
-
-
-class EducationalCommunityLicenseTwoDotZero(OSIApprovedLicense,
-                                            GPLCompatibleLicense):
-    name = 'Educational Community License, Version 2.0'
-    spdx_identifier = 'ECL-2.0'
-
-
-class EiffelForumLicenseTwoDotZero(OSIApprovedLicense, GPLCompatibleLicense):
-    name = 'Eiffel Forum License V2.0'
-    spdx_identifier = 'EFL-2.0'
-
-
-class EntessaPublicLicense(OSIApprovedLicense):
-    name = 'Entessa Public License'
-    spdx_identifier = 'Entessa'
-
-
-class EuropeanUnionPublicLicenseOneDotZero(License):
-    name = 'European Union Public License, Version 1.0'
-    spdx_identifier = 'EUPL-1.0'
-
-
-class EuropeanUnionPublicLicenseOneDotOne(OSIApprovedLicense):
-    name = 'European Union Public License, Version 1.1'
-    spdx_identifier = 'EUPL-1.1'
-
-
-class EuropeanUnionPublicLicenseOneDotTwo(OSIApprovedLicense):
-    name = 'European Union Public License, Version 1.2'
-    spdx_identifier = 'EUPL-1.2'
-
-
-class FairLicense(OSIApprovedLicense):
-    name = 'Fair License'
-    spdx_identifier = 'Fair'
-
-
-class FrameworxLicenseOneDotZero(OSIApprovedLicense):
-    name = 'Frameworx Open License 1.0'
-    spdx_identifier = 'Frameworx-1.0'
-
-
-class FreePublicLicense(OSIApprovedLicense):
-    name = 'Free Public License 1.0.0'
-    spdx_identifier = '0BSD'
-
-
-class GNUAfferoGeneralPublicLicenseThreeDotZero(DFSGCompatibleLicense,
-                                                GPLCompatibleLicense,
-                                                OSIApprovedLicense):
-    name = 'GNU Affero General Public License version v3.0 only'
-    spdx_identifier = 'AGPL-3.0-only'
-
-
-class GNUAfferoGeneralPublicLicenseThreeDotZeroPlus(DFSGCompatibleLicense,
-                                                    GPLCompatibleLicense,
-                                                    OSIApprovedLicense):
-    name = 'GNU Affero General Public License version v3.0 or later'
-    spdx_identifier = 'AGPL-3.0-or-later'
-
-
-class GNUFreeDocumentationLicenseOneDotOne(License):
-    name = 'GNU Free Documentation License v1.1'
-    spdx_identifier = 'GFDL-1.1'
-
-
-class GNUFreeDocumentationLicenseOneDotTwo(License):
-    name = 'GNU Free Documentation License v1.2'
-    spdx_identifier = 'GFDL-1.2'
-
-
-class GNUFreeDocumentationLicenseOneDotThree(License):
-    name = 'GNU Free Documentation License v1.3'
-    spdx_identifier = 'GFDL-1.3'
-
-
-class GNUGeneralPublicLicenseTwo(DFSGCompatibleLicense,
-                                 GPLCompatibleLicense,
-                                 OSIApprovedLicense):
-    name = 'GNU General Public License v2.0 only'
-    spdx_identifier = 'GPL-2.0-only'
-
-
-class GNUGeneralPublicLicenseTwoPlus(DFSGCompatibleLicense,
-                                     GPLCompatibleLicense,
-                                     OSIApprovedLicense):
-    name = 'GNU General Public License version v2.0 or later'
-    spdx_identifier = 'GPL-2.0-or-later'
-
-
-class GNUGeneralPublicLicenseThree(DFSGCompatibleLicense,
-                                   GPLCompatibleLicense,
-                                   OSIApprovedLicense):
-    name = 'GNU General Public License v3.0'
-    spdx_identifier = 'GPL-3.0'
-
-
-class GNUGeneralPublicLicenseThreePlus(DFSGCompatibleLicense,
-                                       GPLCompatibleLicense,
-                                       OSIApprovedLicense):
-    name = 'GNU General Public License v3.0 or later'
-    spdx_identifier = 'GPL-3.0-or-later'
-
-
-class GNULesserGeneralPublicLicenseTwoDotZero(DFSGCompatibleLicense,
-                                              GPLCompatibleLicense,
-                                              OSIApprovedLicense):
-    name = 'GNU Lesser General Public License v2 only'
-    spdx_identifier = 'LGPL-2.0-only'
-
-
-class GNULesserGeneralPublicLicenseTwoDotZeroPlus(DFSGCompatibleLicense,
-                                                  GPLCompatibleLicense,
-                                                  OSIApprovedLicense):
-    name = 'GNU Lesser General Public License v2 or later'
-    spdx_identifier = 'LGPL-2.0-or-later'
-
-
-class GNULesserGeneralPublicLicenseTwoDotOne(DFSGCompatibleLicense,
-                                             GPLCompatibleLicense,
-                                             OSIApprovedLicense):
-    name = 'GNU Lesser General Public License v2.1 only'
-    spdx_identifier = 'LGPL-2.1-only'
-
-
-class GNULesserGeneralPublicLicenseTwoDotOnePlus(DFSGCompatibleLicense,
-                                                 GPLCompatibleLicense,
-                                                 OSIApprovedLicense):
-    name = 'GNU Lesser General Public License v2.1 or later'
-    spdx_identifier = 'LGPL-2.1-or-later'
-
-
-class GNULesserGeneralPublicLicenseThreeDotZero(DFSGCompatibleLicense,
-                                                GPLCompatibleLicense,
-                                                OSIApprovedLicense):
-    name = 'GNU Lesser General Public License v3.0 only'
-    spdx_identifier = 'LGPL-3.0-only'
-
-
-class GNULesserGeneralPublicLicenseThreeDotZeroPlus(DFSGCompatibleLicense,
-                                                    GPLCompatibleLicense,
-                                                    OSIApprovedLicense):
-    name = 'GNU Lesser General Public License v3.0 or later'
-    spdx_identifier = 'LGPL-3.0-or-later'
-
-
-class HistoricalPermissionNoticeAndDisclaimerLicense(OSIApprovedLicense,
-                                                     GPLCompatibleLicense):
-    name = 'Historical Permission Notice and Disclaimer'
-    spdx_identifier = 'HPND'
-
-
-class IBMPublicLicense(DFSGCompatibleLicense,
-                       OSIApprovedLicense):
-    name = 'IBM Public License 1.0'
-    spdx_identifier = 'IPL-1.0'
-
-
-class IntelOpenSourceLicense(OSIApprovedLicense, GPLCompatibleLicense):
-    name = 'Intel Open Source License'
-    spdx_identifier = 'Intel'
-
-
-class IPAFontLicense(OSIApprovedLicense):
-    name = 'IPA Font License'
-    spdx_identifier = 'IPA'
-
-
-class ISCLicense(DFSGCompatibleLicense,
-                 GPLCompatibleLicense,
-                 OSIApprovedLicense):
-    name = 'ISC License'
-    spdx_identifier = 'ISC'
-
-
-class LaTeXProjectPublicLicenseOneDotThreeC(OSIApprovedLicense):
-    name = 'LaTeX Project Public License 1.3c'
-    spdx_identifier = 'LPPL-1.3c'
-
-
-class LiLiQPLicenseOneDotOne(OSIApprovedLicense):
-    name = 'Licence Libre du Québec – Permissive version 1.1'
-    spdx_identifier = 'LiLiQ-P-1.1'
-
-
-class LiLiQRLicenseOneDotOne(OSIApprovedLicense):
-    name = 'Licence Libre du Québec – Réciprocité version 1.1'
-    spdx_identifier = 'LiLiQ-R-version 1.'
-
-
-class LiLiQRPlusLicenseOneDotOne(OSIApprovedLicense):
-    name = 'Licence Libre du Québec – Réciprocité forte version 1.1'
-    spdx_identifier = 'LiLiQ-Rplus-1.1'
-
-
-class LucentPublicLicenseOneDotZeroTwo(OSIApprovedLicense):
-    name = 'Lucent Public License Version 1.02'
-    spdx_identifier = 'LPL-1.02'
-
-
-class MirOSLicense(DFSGCompatibleLicense,
-                   OSIApprovedLicense):
-    name = 'MirOS Licence'
-    spdx_identifier = 'MirOS'
-
-
-class MicrosoftPublicLicense(OSIApprovedLicense):
-    name = 'Microsoft Public License'
-    spdx_identifier = 'MS-PL'
-
-
-class MicrosoftReciprocalLicense(OSIApprovedLicense):
-    name = 'Microsoft Reciprocal License'
-    spdx_identifier = 'MS-RL'
-
-
-class MITLicense(DFSGCompatibleLicense,
-                 GPLCompatibleLicense,
-                 OSIApprovedLicense):
-    name = 'MIT License'
-    spdx_identifier = 'MIT'
-
-
-class MotosotoLicense(OSIApprovedLicense):
-    name = 'Motosoto License'
-    spdx_identifier = 'Motosoto'
-
-
-class MozillaPublicLicenseOneDotZero(DFSGCompatibleLicense,
-                                     OSIApprovedLicense):
-    name = 'Mozilla Public License 1.0'
-    spdx_identifier = 'MPL-1.0'
-
-
-class MozillaPublicLicenseOneDotOne(DFSGCompatibleLicense,
-                                    OSIApprovedLicense):
-    name = 'Mozilla Public License 1.1'
-    spdx_identifier = 'MPL-1.1'
-
-
-class MozillaPublicLicenseTwoDotZero(DFSGCompatibleLicense,
-                                     GPLCompatibleLicense,
-                                     OSIApprovedLicense):
-    name = 'Mozilla Public License 2.0'
-    spdx_identifier = 'MPL-2.0'
-
-
-class MulticsLicense(OSIApprovedLicense):
-    name = 'Multics License'
-    spdx_identifier = 'Multics'
-
-
-class NASAOpenSourceArgreementOneDotThree(OSIApprovedLicense):
-    name = 'NASA Open Source Agreement 1.3'
-    spdx_identifier = 'NASA-1.3'
-
-
-class NTPLicense(OSIApprovedLicense):
-    name = 'NTP License'
-    spdx_identifier = 'NTP'
-
-
-class NaumenPublicLicense(OSIApprovedLicense):
-    name = 'Naumen Public License'
-    spdx_identifier = 'Naumen'
-
-
-class NethackGeneralPublicLicense(OSIApprovedLicense):
-    name = 'Nethack General Public License'
-    spdx_identifier = 'NGPL'
-
-
-class NetscapePublicLicenseOneDotZero(License):
+# The catalog of licenses known to upt: (class name, SPDX identifier, name,
+# flags). A License subclass is created for each of them, so that they can be
+# used as upt.licenses.<class name>().
+_CATALOG = (
+    ('AcademicFreeLicenseOneDotOne', 'AFL-1.1',
+     'Academic Free License 1.1', OSI_APPROVED),
+    ('AcademicFreeLicenseOneDotTwo', 'AFL-1.2',
+     'Academic Free License 1.2', OSI_APPROVED),
+    ('AcademicFreeLicenseTwoDotZero', 'AFL-2.0',
+     'Academic Free License 2.0', OSI_APPROVED),
+    ('AcademicFreeLicenseTwoDotOne', 'AFL-2.1',
+     'Academic Free License 2.1', OSI_APPROVED),
+    ('AcademicFreeLicenseThreeDotZero', 'AFL-3.0',
+     'Academic Free License 3.0', OSI_APPROVED),
+    ('AdaptivePublicLicense', 'APL-1.0',
+     'Adaptive Public License', OSI_APPROVED),
+    ('AladdinFreePublicLicense', 'Aladdin', 'Aladdin Free Public License', 0),
+    ('ApacheLicenseOneDotZero', 'Apache-1.0',
+     'Apache License 1.0', OSI_APPROVED),
+    ('ApacheLicenseOneDotOne', 'Apache-1.1',
+     'Apache License 1.1', OSI_APPROVED),
+    ('ApacheLicenseTwoDotZero', 'Apache-2.0',
+     'Apache License 2.0', GPL_COMPATIBLE | OSI_APPROVED),
+    ('ApplePublicSourceLicenseOneDotZero', 'APSL-1.0',
+     'Apple Public Source License 1.0', OSI_APPROVED),
+    ('ApplePublicSourceLicenseOneDotOne', 'APSL-1.1',
+     'Apple Public Source License 1.1', OSI_APPROVED),
+    ('ApplePublicSourceLicenseOneDotTwo', 'APSL-1.2',
+     'Apple Public Source License 1.2', OSI_APPROVED),
+    ('ApplePublicSourceLicenseTwoDotTwo', 'APSL-2.0',
+     'Apple Public Source License', OSI_APPROVED),
+    ('ArtisticLicenseOneDotZero', 'Artistic-1.0',
+     'Artistic License 1.0', DFSG_COMPATIBLE | OSI_APPROVED),
+    ('ArtisticLicenseTwoDotZero', 'Artistic-2.0',
+     'Artistic License 2.0', DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('AttributionAssuranceLicense', 'AAL',
+     'Attribution Assurance License', OSI_APPROVED),
+    ('BoostSoftwareLicense', 'BSL-1.0',
+     'Boost Software License', GPL_COMPATIBLE | OSI_APPROVED),
+    ('BSDTwoClauseLicense', 'BSD-2-Clause',
+     '2-clause BSD License', GPL_COMPATIBLE | OSI_APPROVED),
+    ('BSDTwoClausePatent', 'BSD-2-Clause-Patent',
+     'BSD+Patent', DFSG_COMPATIBLE | OSI_APPROVED),
+    ('BSDThreeClauseLicense', 'BSD-3-Clause',
+     '3-clause BSD License', GPL_COMPATIBLE | OSI_APPROVED),
+    ('CC0LicenceOneDotZero', 'CC0-1.0',
+     'Creative Commons Zero v1.0 Universal', GPL_COMPATIBLE),
+    ('CCBYSAFourDotZero', 'CC-BY-SA-4.0',
+     'Creative Commons Attribution Share Alike 4.0 International',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE),
+    ('CeCILLBLicense', 'CECILL-B', 'CeCILL-B', 0),
+    ('CeCILLCLicense', 'CECILL-C', 'CeCILL-C', 0),
+    ('CeCILLTwoDotZero', 'CECILL-2.0', 'CeCILL License 2.0', GPL_COMPATIBLE),
+    ('CeCILLTwoDotOne', 'CECILL-2.1',
+     'CeCILL License 2.1', GPL_COMPATIBLE | OSI_APPROVED),
+    ('ClarifiedArtisticLicence', 'ClArtistic',
+     'Clarified Artistic License', GPL_COMPATIBLE),
+    ('CNRIPythonLicense', 'CNRI-Python', 'CNRI Python License', OSI_APPROVED),
+    ('CommonDevelopmentAndDistributionLicenseOneDotZero', 'CDDL-1.0',
+     'Common Development and Distribution License 1.0', OSI_APPROVED),
+    ('CommonPublicLicenseOneDotZero', 'CPL-1.0',
+     'Common Public License', DFSG_COMPATIBLE | OSI_APPROVED),
+    ('CommonPublicAttributionLicenseOneDotZero', 'CPAL-1.0',
+     'Common Public Attribution License 1.0', OSI_APPROVED),
+    ('ComputerAssociatesTrustedOpenSourceLicenseOneDotOne', 'CATOSL-1.1',
+     'Computer Associates Trusted Open Source License 1.1', OSI_APPROVED),
+    ('CUAOfficePublicLicenseOneDotZero', 'CUA-OPL-1.0',
+     'CUA Office Public License Version 1.0', OSI_APPROVED),
+    ('EUDataGridSoftwareLicense', 'EUDatagrid',
+     'EU DataGrid Software License', GPL_COMPATIBLE | OSI_APPROVED),
+    ('EclipsePublicLicenseOneDotZero', 'EPL-1.0',
+     'Eclipse Public License 1.0', DFSG_COMPATIBLE | OSI_APPROVED),
+    ('EclipsePublicLicenseTwoDotZero', 'EPL-2.0',
+     'Eclipse Public License 2.0', OSI_APPROVED),
+    ('ECosLicenseTwoDotZero', 'eCos-2.0',
+     'eCos License version 2.0', GPL_COMPATIBLE | OSI_APPROVED),
+    ('EducationalCommunityLicenseTwoDotZero', 'ECL-2.0',
+     'Educational Community License, Version 2.0',
+     GPL_COMPATIBLE | OSI_APPROVED),
+    ('EiffelForumLicenseTwoDotZero', 'EFL-2.0',
+     'Eiffel Forum License V2.0', GPL_COMPATIBLE | OSI_APPROVED),
+    ('EntessaPublicLicense', 'Entessa',
+     'Entessa Public License', OSI_APPROVED),
+    ('EuropeanUnionPublicLicenseOneDotZero', 'EUPL-1.0',
+     'European Union Public License, Version 1.0', 0),
+    ('EuropeanUnionPublicLicenseOneDotOne', 'EUPL-1.1',
+     'European Union Public License, Version 1.1', OSI_APPROVED),
+    ('EuropeanUnionPublicLicenseOneDotTwo', 'EUPL-1.2',
+     'European Union Public License, Version 1.2', OSI_APPROVED),
+    ('FairLicense', 'Fair', 'Fair License', OSI_APPROVED),
+    ('FrameworxLicenseOneDotZero', 'Frameworx-1.0',
+     'Frameworx Open License 1.0', OSI_APPROVED),
+    ('FreePublicLicense', '0BSD', 'Free Public License 1.0.0', OSI_APPROVED),
+    ('GNUAfferoGeneralPublicLicenseThreeDotZero', 'AGPL-3.0-only',
+     'GNU Affero General Public License version v3.0 only',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('GNUAfferoGeneralPublicLicenseThreeDotZeroPlus', 'AGPL-3.0-or-later',
+     'GNU Affero General Public License version v3.0 or later',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('GNUFreeDocumentationLicenseOneDotOne', 'GFDL-1.1',
+     'GNU Free Documentation License v1.1', 0),
+    ('GNUFreeDocumentationLicenseOneDotTwo', 'GFDL-1.2',
+     'GNU Free Documentation License v1.2', 0),
+    ('GNUFreeDocumentationLicenseOneDotThree', 'GFDL-1.3',
+     'GNU Free Documentation License v1.3', 0),
+    ('GNUGeneralPublicLicenseTwo', 'GPL-2.0-only',
+     'GNU General Public License v2.0 only',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('GNUGeneralPublicLicenseTwoPlus', 'GPL-2.0-or-later',
+     'GNU General Public License version v2.0 or later',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('GNUGeneralPublicLicenseThree', 'GPL-3.0',
+     'GNU General Public License v3.0',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('GNUGeneralPublicLicenseThreePlus', 'GPL-3.0-or-later',
+     'GNU General Public License v3.0 or later',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('GNULesserGeneralPublicLicenseTwoDotZero', 'LGPL-2.0-only',
+     'GNU Lesser General Public License v2 only',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('GNULesserGeneralPublicLicenseTwoDotZeroPlus', 'LGPL-2.0-or-later',
+     'GNU Lesser General Public License v2 or later',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('GNULesserGeneralPublicLicenseTwoDotOne', 'LGPL-2.1-only',
+     'GNU Lesser General Public License v2.1 only',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('GNULesserGeneralPublicLicenseTwoDotOnePlus', 'LGPL-2.1-or-later',
+     'GNU Lesser General Public License v2.1 or later',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('GNULesserGeneralPublicLicenseThreeDotZero', 'LGPL-3.0-only',
+     'GNU Lesser General Public License v3.0 only',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('GNULesserGeneralPublicLicenseThreeDotZeroPlus', 'LGPL-3.0-or-later',
+     'GNU Lesser General Public License v3.0 or later',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('HistoricalPermissionNoticeAndDisclaimerLicense', 'HPND',
+     'Historical Permission Notice and Disclaimer',
+     GPL_COMPATIBLE | OSI_APPROVED),
+    ('IBMPublicLicense', 'IPL-1.0',
+     'IBM Public License 1.0', DFSG_COMPATIBLE | OSI_APPROVED),
+    ('IntelOpenSourceLicense', 'Intel',
+     'Intel Open Source License', GPL_COMPATIBLE | OSI_APPROVED),
+    ('IPAFontLicense', 'IPA', 'IPA Font License', OSI_APPROVED),
+    ('ISCLicense', 'ISC',
+     'ISC License', DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('LaTeXProjectPublicLicenseOneDotThreeC', 'LPPL-1.3c',
+     'LaTeX Project Public License 1.3c', OSI_APPROVED),
+    ('LiLiQPLicenseOneDotOne', 'LiLiQ-P-1.1',
+     'Licence Libre du Québec – Permissive version 1.1', OSI_APPROVED),
+    ('LiLiQRLicenseOneDotOne', 'LiLiQ-R-version 1.',
+     'Licence Libre du Québec – Réciprocité version 1.1', OSI_APPROVED),
+    ('LiLiQRPlusLicenseOneDotOne', 'LiLiQ-Rplus-1.1',
+     'Licence Libre du Québec – Réciprocité forte version 1.1', OSI_APPROVED),
+    ('LucentPublicLicenseOneDotZeroTwo', 'LPL-1.02',
+     'Lucent Public License Version 1.02', OSI_APPROVED),
+    ('MirOSLicense', 'MirOS', 'MirOS Licence', DFSG_COMPATIBLE | OSI_APPROVED),
+    ('MicrosoftPublicLicense', 'MS-PL',
+     'Microsoft Public License', OSI_APPROVED),
+    ('MicrosoftReciprocalLicense', 'MS-RL',
+     'Microsoft Reciprocal License', OSI_APPROVED),
+    ('MITLicense', 'MIT',
+     'MIT License', DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('MotosotoLicense', 'Motosoto', 'Motosoto License', OSI_APPROVED),
+    ('MozillaPublicLicenseOneDotZero', 'MPL-1.0',
+     'Mozilla Public License 1.0', DFSG_COMPATIBLE | OSI_APPROVED),
+    ('MozillaPublicLicenseOneDotOne', 'MPL-1.1',
+     'Mozilla Public License 1.1', DFSG_COMPATIBLE | OSI_APPROVED),
+    ('MozillaPublicLicenseTwoDotZero', 'MPL-2.0',
+     'Mozilla Public License 2.0',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('MulticsLicense', 'Multics', 'Multics License', OSI_APPROVED),
+    ('NASAOpenSourceArgreementOneDotThree', 'NASA-1.3',
+     'NASA Open Source Agreement 1.3', OSI_APPROVED),
+    ('NTPLicense', 'NTP', 'NTP License', OSI_APPROVED),
+    ('NaumenPublicLicense', 'Naumen', 'Naumen Public License', OSI_APPROVED),
+    ('NethackGeneralPublicLicense', 'NGPL',
+     'Nethack General Public License', OSI_APPROVED),
     # See https://en.wikipedia.org/wiki/Netscape_Public_License
-    name = 'Netscape Public License 1.0'
-    spdx_identifier = 'NPL-1.0'
-
-
-class NetscapePublicLicenseOneDotOne(License):
+    ('NetscapePublicLicenseOneDotZero', 'NPL-1.0',
+     'Netscape Public License 1.0', 0),
     # See https://en.wikipedia.org/wiki/Netscape_Public_License
-    name = 'Netscape Public License 1.1'
-    spdx_identifier = 'NPL-1.1'
-
-
-class NokiaOpenSourceLicense(OSIApprovedLicense):
-    name = 'Nokia Open Source License'
-    spdx_identifier = 'Nokia'
-
-
-class NonProfitOpenSoftwareLicenseThreeDotZero(OSIApprovedLicense):
-    name = 'Non-Profit Open Software License 3.0'
-    spdx_identifier = 'NPOSL-3.0'
-
-
-class OCLCResearchPublicLicenseTwoDotZero(OSIApprovedLicense):
-    name = 'OCLC Research Public License 2.0'
-    spdx_identifier = 'OCLC-2.0'
-
-
-class OpenGroupTestSuiteLicense(OSIApprovedLicense):
-    name = 'Open Group Test Suite License'
-    spdx_identifier = 'OGTSL'
-
-
-class OpenSoftwareLicense(OSIApprovedLicense):
-    name = 'Open Software License 3.0'
-    spdx_identifier = 'OSL-3.0'
-
-
-class OpenSSLLicense(DFSGCompatibleLicense):
-    name = 'OpenSSL License'
-    spdx_identifier = 'OpenSSL'
-
-
-class OSETPublicLicenseVersionTwoDotOne(OSIApprovedLicense):
-    name = 'OSET Public License version 2.1'
-    spdx_identifier = 'OSET-PL-2.1'
-
-
-class PerlLicense(DFSGCompatibleLicense,
-                  GPLCompatibleLicense,
-                  OSIApprovedLicense):
-    name = 'Perl'
-    spdx_identifier = 'Artistic-1.0-Perl'
-
-
-class PHPLicenseThreeDotZero(OSIApprovedLicense):
-    name = 'PHP License 3.0'
-    spdx_identifier = 'PHP-3.0'
-
-
-class PostgreSQLLicense(OSIApprovedLicense):
-    name = 'The PostgreSQL License'
-    spdx_identifier = 'PostgreSQL'
-
-
-class PythonLicenseTwoDotZero(OSIApprovedLicense):
-    name = 'Python License 2.0'
-    spdx_identifier = 'Python-2.0'
-
-
-class QPublicLicenseOneDotZero(OSIApprovedLicense):
-    # Maybe DFSGCompatibleLicense (see https://wiki.debian.org/DFSGLicenses).
-    name = 'Q Public License'
-    spdx_identifier = 'QPL-1.0'
-
-
-class RealNetworksPublicSourceLicenseVOneDotZero(OSIApprovedLicense):
-    name = 'RealNetworks Public Source License V1.0'
-    spdx_identifier = 'RPSL-1.0'
-
-
-class ReciprocalPublicLicenseOneDotFive(OSIApprovedLicense):
-    name = 'Reciprocal Public License 1.5'
-    spdx_identifier = 'RPL-1.5'
-
-
-class RicohSourceCodePublicLicense(OSIApprovedLicense):
-    name = 'Ricoh Source Code Public License'
-    spdx_identifier = 'RSCPL'
-
-
-class RubyLicense(DFSGCompatibleLicense,
-                  GPLCompatibleLicense):
-    name = 'Ruby License'
-    spdx_identifier = 'Ruby'
-
-
-class SILOpenFrontLicenseOneDotOne(DFSGCompatibleLicense,
-                                   OSIApprovedLicense):
-    name = 'SIL Open Font License 1.1'
-    spdx_identifier = 'OFL-1.1'
-
-
-class SimplePublicLicenseTwoDotZero(OSIApprovedLicense):
-    name = 'Simple Public License 2.0'
-    spdx_identifier = 'SimPL-2.0'
-
-
-class SleepycatLicense(OSIApprovedLicense, GPLCompatibleLicense):
-    name = 'Sleepycat License'
-    spdx_identifier = 'Sleepycat'
-
-
-class SunIndustryStandardsSourceLicenceOneDotOne(OSIApprovedLicense):
-    name = 'Sun Industry Standards Source License v1.1'
-    spdx_identifier = 'SISSL'
-
-
-class SunPublicLicense(OSIApprovedLicense):
-    name = 'Sun Public License 1.0'
-    spdx_identifier = 'SPL-1.0'
-
-
-class SybaseOpenWatcomPublicLicense(OSIApprovedLicense):
-    name = 'Sybase Open Watcom Public License 1.0'
-    spdx_identifier = 'Watcom-1.0'
-
-
-class NCSALicense(OSIApprovedLicense, GPLCompatibleLicense):
-    name = 'University of Illinois/NCSA Open Source License'
-    spdx_identifier = 'NCSA'
-
-
-class UniversalPermissiveLicense(OSIApprovedLicense, GPLCompatibleLicense):
-    name = 'Universal Permissive License'
-    spdx_identifier = 'UPL'
-
-
-class VovidaSoftwareLicenseVOneDotZero(OSIApprovedLicense):
-    name = 'Vovida Software License v. 1.0'
-    spdx_identifier = 'VSL-1.0'
-
-
-class W3CLicense(OSIApprovedLicense, GPLCompatibleLicense):
-    name = 'W3C License'
-    spdx_identifier = 'W3C'
-
-
-class WTFPLicense(DFSGCompatibleLicense, GPLCompatibleLicense):
-    name = 'Do What The F*ck You Want To Public License'
-    spdx_identifier = 'WTFPL'
-
-
-class WxWindowsLibraryLicense(OSIApprovedLicense, GPLCompatibleLicense):
-    name = 'wxWindows Library License'
-    spdx_identifier = 'wxWindows'
-
-
-class XNetLicense(OSIApprovedLicense):
-    name = 'X.Net License'
-    spdx_identifier = 'Xnet'
-
+    ('NetscapePublicLicenseOneDotOne', 'NPL-1.1',
+     'Netscape Public License 1.1', 0),
+    ('NokiaOpenSourceLicense', 'Nokia',
+     'Nokia Open Source License', OSI_APPROVED),
+    ('NonProfitOpenSoftwareLicenseThreeDotZero', 'NPOSL-3.0',
+     'Non-Profit Open Software License 3.0', OSI_APPROVED),
+    ('OCLCResearchPublicLicenseTwoDotZero', 'OCLC-2.0',
+     'OCLC Research Public License 2.0', OSI_APPROVED),
+    ('OpenGroupTestSuiteLicense', 'OGTSL',
+     'Open Group Test Suite License', OSI_APPROVED),
+    ('OpenSoftwareLicense', 'OSL-3.0',
+     'Open Software License 3.0', OSI_APPROVED),
+    ('OpenSSLLicense', 'OpenSSL', 'OpenSSL License', DFSG_COMPATIBLE),
+    ('OSETPublicLicenseVersionTwoDotOne', 'OSET-PL-2.1',
+     'OSET Public License version 2.1', OSI_APPROVED),
+    ('PerlLicense', 'Artistic-1.0-Perl',
+     'Perl', DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('PHPLicenseThreeDotZero', 'PHP-3.0', 'PHP License 3.0', OSI_APPROVED),
+    ('PostgreSQLLicense', 'PostgreSQL',
+     'The PostgreSQL License', OSI_APPROVED),
+    ('PythonLicenseTwoDotZero', 'Python-2.0',
+     'Python License 2.0', OSI_APPROVED),
+    # Maybe DFSG compatible (see https://wiki.debian.org/DFSGLicenses).
+    ('QPublicLicenseOneDotZero', 'QPL-1.0', 'Q Public License', OSI_APPROVED),
+    ('RealNetworksPublicSourceLicenseVOneDotZero', 'RPSL-1.0',
+     'RealNetworks Public Source License V1.0', OSI_APPROVED),
+    ('ReciprocalPublicLicenseOneDotFive', 'RPL-1.5',
+     'Reciprocal Public License 1.5', OSI_APPROVED),
+    ('RicohSourceCodePublicLicense', 'RSCPL',
+     'Ricoh Source Code Public License', OSI_APPROVED),
+    ('RubyLicense', 'Ruby', 'Ruby License', DFSG_COMPATIBLE | GPL_COMPATIBLE),
+    ('SILOpenFrontLicenseOneDotOne', 'OFL-1.1',
+     'SIL Open Font License 1.1', DFSG_COMPATIBLE | OSI_APPROVED),
+    ('SimplePublicLicenseTwoDotZero', 'SimPL-2.0',
+     'Simple Public License 2.0', OSI_APPROVED),
+    ('SleepycatLicense', 'Sleepycat',
+     'Sleepycat License', GPL_COMPATIBLE | OSI_APPROVED),
+    ('SunIndustryStandardsSourceLicenceOneDotOne', 'SISSL',
+     'Sun Industry Standards Source License v1.1', OSI_APPROVED),
+    ('SunPublicLicense', 'SPL-1.0', 'Sun Public License 1.0', OSI_APPROVED),
+    ('SybaseOpenWatcomPublicLicense', 'Watcom-1.0',
+     'Sybase Open Watcom Public License 1.0', OSI_APPROVED),
+    ('NCSALicense', 'NCSA',
+     'University of Illinois/NCSA Open Source License',
+     GPL_COMPATIBLE | OSI_APPROVED),
+    ('UniversalPermissiveLicense', 'UPL',
+     'Universal Permissive License', GPL_COMPATIBLE | OSI_APPROVED),
+    ('VovidaSoftwareLicenseVOneDotZero', 'VSL-1.0',
+     'Vovida Software License v. 1.0', OSI_APPROVED),
+    ('W3CLicense', 'W3C', 'W3C License', GPL_COMPATIBLE | OSI_APPROVED),
+    ('WTFPLicense', 'WTFPL',
+     'Do What The F*ck You Want To Public License',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE),
+    ('WxWindowsLibraryLicense', 'wxWindows',
+     'wxWindows Library License', GPL_COMPATIBLE | OSI_APPROVED),
+    ('XNetLicense', 'Xnet', 'X.Net License', OSI_APPROVED),
+    ('ZopePublicLicenseTwoDotZero', 'ZPL-2.0',
+     'Zope Public License 2.0', GPL_COMPATIBLE | OSI_APPROVED),
+    ('ZopePublicLicenseTwoDotOne', 'ZPL-2.1',
+     'Zope Public License 2.1', GPL_COMPATIBLE),
+    ('ZlibLicense', 'zlib',
+     'zlib License', DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+    ('ZlibLibpngLicense', 'zlib-acknowledgement',
+     'zlib/libpng License with Acknowledgement',
+     DFSG_COMPATIBLE | GPL_COMPATIBLE | OSI_APPROVED),
+)
+
+
+def _make_license_class(class_name, spdx_id, name, flags):
+    bases = tuple(base for base in (DFSGCompatibleLicense,
+                                    GPLCompatibleLicense,
+                                    OSIApprovedLicense)
+                  if flags & base.flags) or (License,)
+    return type(class_name, bases, {
+        '__slots__': (),
+        '__module__': __name__,
+        'name': name,
+        'spdx_identifier': spdx_id,
+    })
+
+
+for _class_name, _spdx_id, _name, _flags in _CATALOG:
+    globals()[_class_name] = _make_license_class(_class_name, _spdx_id, _name,
+                                                 _flags)
+del _class_name, _spdx_id, _name, _flags
+
+
+# Set, when evaluating a policy, for all licenses but UnknownLicense.
+_KNOWN = 8
+
+
+class Policy(object):
+    """A license policy, given as a boolean expression.
+
+    Expressions combine the following terms using "and", "or", "not" and
+    parentheses:
+    - osi: the license is approved by the OSI;
+    - gpl: the license is compatible with the GPL;
+    - dfsg: the license is compatible with the DFSG;
+    - known: upt knows the license (it is not an UnknownLicense).
+
+    For instance: 'dfsg and gpl', or 'known and (osi or dfsg)'.
+
+    The expression is evaluated once for every possible combination of
+    flags when the policy is created, so that checking a license is a single
+    bit test. ValueError is raised if the expression is invalid.
+    """
+    _TERMS = {
+        'osi': OSI_APPROVED,
+        'gpl': GPL_COMPATIBLE,
+        'dfsg': DFSG_COMPATIBLE,
+        'known': _KNOWN,
+    }
+
+    def __init__(self, expression):
+        self.expression = expression
+        self._tokens = re.findall(r'[()]|[^\s()]+', expression.lower())
+        self._pos = 0
+        predicate = self._parse_or()
+        if self._pos != len(self._tokens):
+            self._error()
+        # Bit N is set if licenses with the flags N are allowed.
+        self._allowed = 0
+        for flags in range(2 * _KNOWN):
+            if predicate(flags):
+                self._allowed |= 1 << flags
+
+    def __repr__(self):
+        return f'Policy({self.expression!r})'
+
+    def _error(self):
+        raise ValueError(f'Invalid license policy: "{self.expression}"')
+
+    def _next(self, *expected):
+        try:
+            token = self._tokens[self._pos]
+        except IndexError:
+            return None
+        if token in expected:
+            self._pos += 1
+            return token
+        return None
+
+    def _parse_or(self):
+        operands = [self._parse_and()]
+        while self._next('or'):
+            operands.append(self._parse_and())
+        return lambda flags: any(operand(flags) for operand in operands)
+
+    def _parse_and(self):
+        operands = [self._parse_not()]
+        while self._next('and'):
+            operands.append(self._parse_not())
+        return lambda flags: all(operand(flags) for operand in operands)
+
+    def _parse_not(self):
+        if self._next('not'):
+            operand = self._parse_not()
+            return lambda flags: not operand(flags)
+        if self._next('('):
+            operand = self._parse_or()
+            if not self._next(')'):
+                self._error()
+            return operand
+        term = self._next(*self._TERMS)
+        if term is None:
+            self._error()
+        bit = self._TERMS[term]
+        return lambda flags: bool(flags & bit)
+
+    def allows(self, license):
+        """Return whether LICENSE complies with the policy."""
+        flags = license.flags
+        if not isinstance(license, UnknownLicense):
+            flags |= _KNOWN
+        return bool(self._allowed >> flags & 1)
+
+    def violations(self, licenses):
+        """Return the licenses in LICENSES that do not comply with the policy.
+
+        An empty list of licenses is considered as an unknown license.
+        """
+        return [license for license in licenses or [UnknownLicense()]
+                if not self.allows(license)]
+
+
+# Deprecated SPDX identifiers, and other common ways of naming licenses.
+# Keys are aliases, values are the SPDX identifiers used by upt.
+_ALIASES = {alias.lower(): spdx_id.lower() for alias, spdx_id in {
+    'AGPL-3.0': 'AGPL-3.0-only',
+    'AGPL-3.0+': 'AGPL-3.0-or-later',
+    'AGPLv3': 'AGPL-3.0-only',
+    'AGPLv3+': 'AGPL-3.0-or-later',
+    'Apache 2.0': 'Apache-2.0',
+    'Apache-2': 'Apache-2.0',
+    'Apache2': 'Apache-2.0',
+    'ASL 2.0': 'Apache-2.0',
+    'Expat': 'MIT',
+    'GPL-2.0': 'GPL-2.0-only',
+    'GPL-2.0+': 'GPL-2.0-or-later',
+    'GPLv2': 'GPL-2.0-only',
+    'GPLv2+': 'GPL-2.0-or-later',
+    'GPL-3.0-only': 'GPL-3.0',
+    'GPL-3.0+': 'GPL-3.0-or-later',
+    'GPLv3': 'GPL-3.0',
+    'GPLv3+': 'GPL-3.0-or-later',
+    'LGPL-2.0': 'LGPL-2.0-only',
+    'LGPL-2.0+': 'LGPL-2.0-or-later',
+    'LGPLv2': 'LGPL-2.0-only',
+    'LGPLv2+': 'LGPL-2.0-or-later',
+    'LGPL-2.1': 'LGPL-2.1-only',
+    'LGPL-2.1+': 'LGPL-2.1-or-later',
+    'LGPLv2.1': 'LGPL-2.1-only',
+    'LGPLv2.1+': 'LGPL-2.1-or-later',
+    'LGPL-3.0': 'LGPL-3.0-only',
+    'LGPL-3.0+': 'LGPL-3.0-or-later',
+    'LGPLv3': 'LGPL-3.0-only',
+    'LGPLv3+': 'LGPL-3.0-or-later',
+    'LiLiQ-R-1.1': 'LiLiQ-R-version 1.',
+    'MPLv2': 'MPL-2.0',
+    'UPL-1.0': 'UPL',
+    'ZPL 2.1': 'ZPL-2.1',
+}.items()}
 
-class ZopePublicLicenseTwoDotZero(OSIApprovedLicense, GPLCompatibleLicense):
-    name = 'Zope Public License 2.0'
-    spdx_identifier = 'ZPL-2.0'
 
+def get_license_by_spdx_identifier(spdx_id):
+    """Return a License object corresponding to the given spdx id.
 
-class ZopePublicLicenseTwoDotOne(GPLCompatibleLicense):
-    name = 'Zope Public License 2.1'
-    spdx_identifier = 'ZPL-2.1'
+    The lookup is case-insensitive, and also accepts deprecated SPDX
+    identifiers and common aliases, such as 'GPLv2+'. An UnknownLicense is
+    returned if the license is unknown.
+    """
+    key = (spdx_id or '').strip().lower()
+    key = _ALIASES.get(key, key)
+    return _registry.get(key, UnknownLicense)()
 
 
-class ZlibLicense(DFSGCompatibleLicense,
-                  GPLCompatibleLicense,
-                  OSIApprovedLicense):
-    name = 'zlib License'
-    spdx_identifier = 'zlib'
+try:
+    _popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def _popcount(n):
+        return bin(n).count('1')
 
 
-class ZlibLibpngLicense(DFSGCompatibleLicense,
-                        GPLCompatibleLicense,
-                        OSIApprovedLicense):
-    name = 'zlib/libpng License with Acknowledgement'
-    spdx_identifier = 'zlib-acknowledgement'
+class _LicenseIndex(object):
+    """An index of the fingerprints of the license texts known to SPDX.
 
+    Texts are compared the way spdx_lookup compares them: using the Dice
+    coefficient of their sets of words. The fingerprint of a text is its set
+    of words, stored as a bitmask over the vocabulary of all license texts,
+    so that comparing a text with every license only takes a few integer
+    operations per license, instead of reading and tokenizing every license
+    template each time.
+    """
+    def __init__(self):
+        # Importing spdx_lookup loads its whole corpus of license texts,
+        # which is slow: only do it when a license needs to be guessed.
+        import spdx
+        import spdx_lookup
+        self._get_word_set = spdx_lookup._get_word_set
+        self._bits = {}  # Maps words to their bit in fingerprints
+        # (fingerprint, number of words, position in the corpus, SPDX id)
+        self._fingerprints = []
+        for position, record in enumerate(spdx.licenses()):
+            license = spdx.License(record)
+            if license.id in spdx_lookup._hidden:
+                continue
+            words = self._get_word_set(license.template, True)
+            self._fingerprints.append((self._fingerprint(words, True),
+                                       len(words), position, license.id))
+
+    def _fingerprint(self, words, extend_vocabulary=False):
+        fingerprint = 0
+        for word in words:
+            bit = self._bits.get(word)
+            if bit is None:
+                if not extend_vocabulary:
+                    continue  # Cannot be in common with any license
+                bit = self._bits[word] = len(self._bits)
+            fingerprint |= 1 << bit
+        return fingerprint
+
+    def candidates(self, content, n=5):
+        """Return the N licenses most similar to CONTENT.
+
+        Return a list of (similarity, SPDX identifier) tuples, most similar
+        first. Similarities are on a scale of 0 to 100.
+
+        Licenses that are equally similar to CONTENT are ranked the way
+        spdx_lookup.match() ranks them: those whose number of words is the
+        closest to that of CONTENT first, then in the order of the SPDX
+        corpus. For instance, the text of the MPL-2.0 is exactly as similar
+        to the MPL-2.0 as to the MPL-2.0-no-copyleft-exception.
+        """
+        words = self._get_word_set(content)
+        fingerprint = self._fingerprint(words)
+        scores = []
+        for license_fingerprint, size, position, spdx_id in self._fingerprints:
+            total = len(words) + size
+            if total == 0:
+                continue
+            overlap = _popcount(fingerprint & license_fingerprint)
+            # Same formula as spdx_lookup, so that ties are the same.
+            similarity = 100.0 * (overlap * 2.0 / total)
+            scores.append((similarity, -abs(len(words) - size), -position,
+                           spdx_id))
+        return [(similarity, spdx_id) for similarity, _, _, spdx_id
+                in heapq.nlargest(n, scores)]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = _LicenseIndex()
+        return _index
+
+
+def _corpus_version():
+    import spdx
+    return spdx.__version__
+
+
+class GuessCache(object):
+    """A persistent cache of license guesses.
+
+    Guesses are indexed by the sha256 checksum of the license text, and are
+    only used as long as the version of the SPDX corpus is unchanged.
+
+    path: the path of the database; defaults to a file in
+          upt.cache.cache_dir().
+    """
+    def __init__(self, path=None):
+        self.path = path or os.path.join(upt.cache.cache_dir(),
+                                         'licenses.db')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False,
+                                   timeout=30)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS guesses ('
+                             'digest TEXT PRIMARY KEY, '
+                             'corpus TEXT NOT NULL, '
+                             'confidence REAL NOT NULL, '
+                             'spdx_id TEXT NOT NULL)')
+
+    def lookup(self, digest):
+        """Return the (confidence, SPDX id) guessed for DIGEST, or None."""
+        with self._lock:
+            row = self._db.execute('SELECT corpus, confidence, spdx_id '
+                                   'FROM guesses WHERE digest = ?',
+                                   (digest,)).fetchone()
+        if row is None or row[0] != _corpus_version():
+            return None
+        return row[1], row[2]
+
+    def store(self, digest, guess):
+        """Remember GUESS, a (confidence, SPDX id) tuple, for DIGEST."""
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO guesses '
+                             '(digest, corpus, confidence, spdx_id) '
+                             'VALUES (?, ?, ?, ?)',
+                             (digest, _corpus_version(), *guess))
+
+    def stats(self):
+        """Return a dict describing the contents of the cache."""
+        with self._lock:
+            guesses, = self._db.execute('SELECT COUNT(*) '
+                                        'FROM guesses').fetchone()
+        return {'path': self.path, 'guesses': guesses}
+
+    def clear(self):
+        """Remove all guesses from the cache, and return their number."""
+        with self._lock, self._db:
+            return self._db.execute('DELETE FROM guesses').rowcount
+
+    def close(self):
+        self._db.close()
+
+
+_guess_cache = None
+
+
+def get_guess_cache():
+    """Return the GuessCache used to guess licenses, or None."""
+    return _guess_cache
+
+
+def set_guess_cache(cache):
+    """Make upt use CACHE (a GuessCache, or None) to guess licenses."""
+    global _guess_cache
+    _guess_cache = cache
+
+
+# Maps the sha256 checksums of license texts to the (confidence, SPDX id) of
+# the license that was guessed, for the lifetime of the process.
+_memo = {}
+
+
+def _digest(content):
+    return hashlib.sha256(content.encode('utf-8',
+                                         'surrogateescape')).hexdigest()
+
+
+def _cached_guess(digest):
+    try:
+        return _memo[digest]
+    except KeyError:
+        pass
+    cache = get_guess_cache()
+    if cache is not None:
+        guess = cache.lookup(digest)
+        if guess is not None:
+            _memo[digest] = guess
+            return guess
+    return None
+
+
+def _remember_guess(digest, guess):
+    _memo[digest] = guess
+    cache = get_guess_cache()
+    if cache is not None:
+        cache.store(digest, guess)
+
+
+def _compute_guess(content):
+    return _get_index().candidates(content, 1)[0]
+
+
+def _guess(content):
+    """Return the (confidence, SPDX id) of the license closest to CONTENT."""
+    digest = _digest(content)
+    guess = _cached_guess(digest)
+    if guess is None:
+        guess = _compute_guess(content)
+        _remember_guess(digest, guess)
+    return guess
 
-def get_license_by_spdx_identifier(spdx_id):
-    """Return a License object corresponding to the given spdx id."""
-    # Keys are spdx identifiers.
-    # Values are License classes.
-    spdx_ids_to_license = {}
 
-    def get_all_subclasses(cls):
-        for subclass in cls.__subclasses__():
-            yield subclass
-            yield from get_all_subclasses(subclass)
+def _check_min_confidence(min_confidence):
+    if not 0 <= min_confidence <= 100:
+        raise ValueError('min_confidence must be in [0; 100]')
 
-    for cls in set(get_all_subclasses(License)):
-        try:
-            spdx_ids_to_license[cls.spdx_identifier] = cls
-        except AttributeError:  # No spdx_identifier on the base classes
-            pass
 
-    return spdx_ids_to_license.get(spdx_id, UnknownLicense)()
+def _license_from_guess(guess, min_confidence):
+    confidence, spdx_id = guess
+    # spdx_lookup never matched licenses whose similarity was below 90.
+    if confidence < max(min_confidence, 90):
+        return UnknownLicense()
+    return get_license_by_spdx_identifier(spdx_id)
 
 
 def guess_from_file(license_file, min_confidence=95):
@@ -730,13 +753,46 @@ def guess_from_file(license_file, min_confidence=95):
     Return an instance of a subclass of License if a license could be guessed,
     None otherwise.
     """
-    if not 0 <= min_confidence <= 100:
-        raise ValueError('min_confidence must be in [0; 100]')
-
+    _check_min_confidence(min_confidence)
     with open(license_file) as f:
-        match = spdx_lookup.match(f.read())
-        if match is None:
-            return UnknownLicense()
-        if match.confidence < min_confidence:
-            return UnknownLicense()
-        return get_license_by_spdx_identifier(match.license.id)
+        return _license_from_guess(_guess(f.read()), min_confidence)
+
+
+def guess_many(license_files, min_confidence=95, workers=None):
+    """Guess the licenses of several license files at once.
+
+    license_files: an iterable of paths to license files.
+    min_confidence: see guess_from_file().
+    workers: the maximal number of processes used to guess licenses;
+             defaults to the number of processors.
+
+    Files with the same content are only matched once, and guesses are
+    remembered across calls (and across runs, when a GuessCache is set).
+    The remaining texts are matched in parallel, using a pool of processes,
+    unless other threads are running: forking a multi-threaded process may
+    deadlock the child processes, so they are then matched in this process.
+
+    Return a dict mapping every path to an instance of a subclass of License.
+    """
+    _check_min_confidence(min_confidence)
+    digests = {}
+    missing = {}  # Maps digests to the content of license files
+    for license_file in license_files:
+        with open(license_file) as f:
+            content = f.read()
+        digest = digests[license_file] = _digest(content)
+        if _cached_guess(digest) is None:
+            missing[digest] = content
+
+    if len(missing) > 1 and workers != 1 and threading.active_count() == 1:
+        workers = min(workers or os.cpu_count() or 1, len(missing))
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            guesses = executor.map(_compute_guess, missing.values())
+            for digest, guess in zip(missing.keys(), guesses):
+                _remember_guess(digest, guess)
+    else:
+        for digest, content in missing.items():
+            _remember_guess(digest, _compute_guess(content))
+
+    return {license_file: _license_from_guess(_memo[digest], min_confidence)
+            for license_file, digest in digests.items()}
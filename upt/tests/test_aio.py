@@ -0,0 +1,111 @@
+# Copyright 2021      Cyril Roelandt
+#
+# Licensed under the 3-clause BSD license. See the LICENSE file.
+import asyncio
+import threading
+import time
+import unittest
+import urllib.error
+from unittest import mock
+
+from upt import aio
+from upt import download
+
+
+class SyncPlugin(object):
+    def parse(self, name):
+        return name, threading.current_thread()
+
+
+class AsyncPlugin(SyncPlugin):
+    async def parse_async(self, name):
+        return name, 'async'
+
+
+class TestHooks(unittest.TestCase):
+    def test_get_hook(self):
+        plugin = AsyncPlugin()
+        self.assertEqual(aio.get_hook(plugin, 'parse'), plugin.parse_async)
+        self.assertIsNone(aio.get_hook(SyncPlugin(), 'parse'))
+        self.assertIsNone(aio.get_hook(mock.Mock(), 'parse'))
+
+        class NotACoroutine(object):
+            def parse_async(self, name):
+                pass
+        self.assertIsNone(aio.get_hook(NotACoroutine(), 'parse'))
+
+    def test_call(self):
+        self.assertEqual(aio.run(aio.call(AsyncPlugin(), 'parse', 'foo')),
+                         ('foo', 'async'))
+        name, thread = aio.run(aio.call(SyncPlugin(), 'parse', 'foo'))
+        self.assertEqual(name, 'foo')
+        self.assertIsNot(thread, threading.current_thread())
+
+    def test_call_sync(self):
+        self.assertEqual(aio.call_sync(AsyncPlugin(), 'parse', 'foo'),
+                         ('foo', 'async'))
+        self.assertEqual(aio.call_sync(SyncPlugin(), 'parse', 'foo'),
+                         ('foo', threading.current_thread()))
+
+    def test_run(self):
+        with mock.patch('concurrent.futures.ThreadPoolExecutor.shutdown',
+                        autospec=True) as shutdown_fn:
+            self.assertEqual(aio.run(asyncio.sleep(0, 'foo'), 3), 'foo')
+        executor = shutdown_fn.call_args_list[0][0][0]
+        self.assertEqual(executor._max_workers, 3)
+        shutdown_fn.assert_any_call(executor, wait=True)
+
+
+class TestFetch(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('upt.download._session',
+                             download.Session(max_connections_per_host=2))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_host_semaphore(self):
+        async def semaphores():
+            return (aio.host_semaphore('https://example.com/foo'),
+                    aio.host_semaphore('https://example.com/bar'),
+                    aio.host_semaphore('https://example.org/foo'))
+        foo, bar, other_host = aio.run(semaphores())
+        self.assertIs(foo, bar)
+        self.assertIsNot(foo, other_host)
+        # Each event loop has its own semaphores.
+        self.assertIsNot(aio.run(semaphores())[0], foo)
+
+    def test_fetch(self):
+        running = {'example.com': 0, 'example.org': 0}
+        max_running = dict(running)
+        lock = threading.Lock()
+
+        def fetch(url, headers):
+            host = url.split('/')[2]
+            with lock:
+                running[host] += 1
+                max_running[host] = max(max_running[host], running[host])
+            time.sleep(0.05)
+            with lock:
+                running[host] -= 1
+            return url.encode()
+
+        async def fetch_all():
+            urls = [f'https://example.{tld}/{i}'
+                    for i in range(5) for tld in ('com', 'org')]
+            return await asyncio.gather(*(aio.fetch(url) for url in urls))
+
+        with mock.patch('upt.aio._fetch', side_effect=fetch):
+            bodies = aio.run(fetch_all())
+        self.assertEqual(len(bodies), 10)
+        self.assertEqual(bodies[:2], [b'https://example.com/0',
+                                      b'https://example.org/0'])
+        self.assertEqual(max_running, {'example.com': 2, 'example.org': 2})
+
+    @mock.patch('upt.download.Session.get')
+    def test_fetch_error(self, get_fn):
+        response = get_fn.return_value.__enter__.return_value
+        response.raise_for_status.side_effect = urllib.error.HTTPError(
+            'https://example.com', 404, 'Not Found', {}, None)
+        with self.assertRaises(urllib.error.HTTPError):
+            aio.run(aio.fetch('https://example.com'))
+        get_fn.assert_called_once_with('https://example.com', None)
@@ -0,0 +1,229 @@
+# Copyright 2021      Cyril Roelandt
+#
+# Licensed under the 3-clause BSD license. See the LICENSE file.
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from upt import cache
+
+
+class TestCacheDir(unittest.TestCase):
+    @mock.patch.dict(os.environ, {'UPT_CACHE_DIR': '/upt-cache'})
+    def test_upt_cache_dir(self):
+        self.assertEqual(cache.cache_dir(), '/upt-cache')
+
+    @mock.patch.dict(os.environ, {'XDG_CACHE_HOME': '/xdg-cache'})
+    def test_xdg_cache_home(self):
+        os.environ.pop('UPT_CACHE_DIR', None)
+        self.assertEqual(cache.cache_dir(), '/xdg-cache/upt')
+
+
+class TestParseSize(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(cache.parse_size('1234'), 1234)
+        self.assertEqual(cache.parse_size('2K'), 2048)
+        self.assertEqual(cache.parse_size('1.5M'), 1572864)
+        self.assertEqual(cache.parse_size('1GB'), 1024 ** 3)
+        with self.assertRaises(ValueError):
+            cache.parse_size('huge')
+
+
+class TestParseDuration(unittest.TestCase):
+    def test_parse_duration(self):
+        self.assertEqual(cache.parse_duration('60'), 60)
+        self.assertEqual(cache.parse_duration('30s'), 30)
+        self.assertEqual(cache.parse_duration('1.5m'), 90)
+        self.assertEqual(cache.parse_duration('6h'), 6 * 3600)
+        self.assertEqual(cache.parse_duration('2D'), 2 * 86400)
+        with self.assertRaises(ValueError):
+            cache.parse_duration('forever')
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cache = cache.MetadataCache(os.path.join(tmpdir.name, 'db'),
+                                         ttl=60)
+        self.addCleanup(self.cache.close)
+        self.metadata = {'name': 'foo', 'requirements': [['bar', '>=1.0']]}
+
+    def test_store_lookup(self):
+        self.assertIsNone(self.cache.lookup('pypi', 'foo', '1.0'))
+        self.cache.store('pypi', 'foo', '1.0', self.metadata)
+        self.assertEqual(self.cache.lookup('pypi', 'foo', '1.0'),
+                         self.metadata)
+        self.assertIsNone(self.cache.lookup('pypi', 'foo', None))
+        self.assertIsNone(self.cache.lookup('cpan', 'foo', '1.0'))
+        self.assertEqual(self.cache.stats()['packages'], 1)
+
+    @mock.patch('time.time')
+    def test_ttl(self, time_fn):
+        time_fn.return_value = 1000
+        self.cache.store('pypi', 'foo', None, self.metadata)
+        self.cache.store('pypi', 'foo', '1.0', self.metadata)
+        time_fn.return_value = 1059
+        self.assertEqual(self.cache.lookup('pypi', 'foo', None),
+                         self.metadata)
+        self.assertEqual(self.cache.prune(), 0)
+
+        # Pinned versions never expire.
+        time_fn.return_value = 1060
+        self.assertIsNone(self.cache.lookup('pypi', 'foo', None))
+        self.assertEqual(self.cache.lookup('pypi', 'foo', '1.0'),
+                         self.metadata)
+        self.assertEqual(self.cache.prune(), 1)
+        self.assertEqual(self.cache.stats()['packages'], 1)
+
+    def test_clear(self):
+        self.cache.store('pypi', 'foo', None, self.metadata)
+        self.cache.store('pypi', 'foo', '1.0', self.metadata)
+        self.assertEqual(self.cache.clear(), 2)
+        self.assertIsNone(self.cache.lookup('pypi', 'foo', '1.0'))
+
+    def test_compressed(self):
+        self.metadata['description'] = 'foo' * 1000
+        self.cache.store('pypi', 'foo', '1.0', self.metadata)
+        with sqlite3.connect(self.cache.path) as db:
+            data, = db.execute('SELECT data FROM metadata').fetchone()
+        self.assertLess(len(data), 200)
+
+
+class TestArchiveCache(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.cache = cache.ArchiveCache(os.path.join(self.tmpdir, 'cache'),
+                                        max_size=10)
+        self.addCleanup(self.cache.close)
+
+    def _make_file(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_store_lookup(self):
+        self.assertIsNone(self.cache.lookup('http://example.com/a'))
+        path = self._make_file('a', b'foo')
+        self.cache.store('http://example.com/a', path, {'sha256': 'aaaa'})
+        entry = self.cache.lookup('http://example.com/a')
+        self.assertEqual(entry.size, 3)
+        self.assertEqual(entry.hashes, {'sha256': 'aaaa'})
+        with open(entry.path, 'rb') as f:
+            self.assertEqual(f.read(), b'foo')
+
+    def test_add_hashes(self):
+        self.cache.store('http://example.com/a', None, {'sha256': 'aaaa'},
+                         data=b'foo')
+        self.cache.add_hashes('http://example.com/a', {'md5': 'md5'})
+        self.cache.add_hashes('http://example.com/a', {'sha256': 'bbbb',
+                                                       'sha512': 'sha512'})
+        self.cache.add_hashes('http://example.com/b', {'md5': 'md5'})
+        entry = self.cache.lookup('http://example.com/a')
+        self.assertEqual(entry.hashes, {'sha256': 'aaaa', 'md5': 'md5'})
+
+    def test_store_data(self):
+        self.cache.store('http://example.com/a', None, {'sha256': 'aaaa'},
+                         data=b'foo')
+        entry = self.cache.lookup('http://example.com/a')
+        self.assertEqual(entry.size, 3)
+        with open(entry.path, 'rb') as f:
+            self.assertEqual(f.read(), b'foo')
+
+    def test_lookup_known_hashes(self):
+        path = self._make_file('a', b'foo')
+        self.cache.store('http://example.com/a', path,
+                         {'sha256': 'aaaa', 'md5': 'bbbb'})
+        self.assertIsNone(self.cache.lookup('http://example.com/a',
+                                            {'md5': 'cccc'}))
+        self.assertIsNotNone(self.cache.lookup('http://example.com/a',
+                                               {'md5': 'bbbb',
+                                                'sha512': 'dddd'}))
+
+    def test_validators(self):
+        path = self._make_file('a', b'foo')
+        self.cache.store('http://example.com/a', path, {'sha256': 'aaaa'})
+        entry = self.cache.lookup('http://example.com/a')
+        self.assertEqual(entry.validators, {})
+        self.cache.store('http://example.com/a', path, {'sha256': 'aaaa'},
+                         {'etag': '"1234"', 'last_modified': 'yesterday'})
+        entry = self.cache.lookup('http://example.com/a')
+        self.assertEqual(entry.validators,
+                         {'etag': '"1234"', 'last_modified': 'yesterday'})
+
+    def test_old_index(self):
+        directory = os.path.join(self.tmpdir, 'old-cache')
+        os.makedirs(directory)
+        db = sqlite3.connect(os.path.join(directory, 'index.db'))
+        db.execute('CREATE TABLE archives (url TEXT PRIMARY KEY, '
+                   'sha256 TEXT NOT NULL, size INTEGER NOT NULL, '
+                   'hashes TEXT NOT NULL, last_used REAL NOT NULL)')
+        db.close()
+        old_cache = cache.ArchiveCache(directory)
+        self.addCleanup(old_cache.close)
+        path = self._make_file('a', b'foo')
+        old_cache.store('http://example.com/a', path, {'sha256': 'aaaa'},
+                        {'etag': '"1234"'})
+        self.assertEqual(old_cache.lookup('http://example.com/a').validators,
+                         {'etag': '"1234"'})
+
+    def test_link_or_copy(self):
+        src = self._make_file('a', b'foo')
+        dst = self._make_file('b', b'bar')
+        cache.link_or_copy(src, dst)
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), b'foo')
+        os.remove(dst)
+        with mock.patch('os.link', side_effect=OSError):
+            cache.link_or_copy(src, dst)
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), b'foo')
+
+    def test_blob_removed(self):
+        path = self._make_file('a', b'foo')
+        self.cache.store('http://example.com/a', path, {'sha256': 'aaaa'})
+        os.remove(self.cache.lookup('http://example.com/a').path)
+        self.assertIsNone(self.cache.lookup('http://example.com/a'))
+
+    def test_same_content(self):
+        path = self._make_file('a', b'foo')
+        self.cache.store('http://example.com/a', path, {'sha256': 'aaaa'})
+        self.cache.store('http://mirror.example.com/a', path,
+                         {'sha256': 'aaaa'})
+        stats = self.cache.stats()
+        self.assertEqual(stats['urls'], 2)
+        self.assertEqual(stats['archives'], 1)
+        self.assertEqual(stats['size'], 3)
+
+    @mock.patch('time.time')
+    def test_lru_eviction(self, time_fn):
+        time_fn.return_value = 1
+        self.cache.store('http://example.com/a',
+                         self._make_file('a', b'aaaa'), {'sha256': 'aaaa'})
+        time_fn.return_value = 2
+        self.cache.store('http://example.com/b',
+                         self._make_file('b', b'bbbb'), {'sha256': 'bbbb'})
+        time_fn.return_value = 3
+        self.cache.lookup('http://example.com/a')
+        time_fn.return_value = 4
+        # 12 bytes > max_size: the least recently used archive is evicted.
+        self.cache.store('http://example.com/c',
+                         self._make_file('c', b'cccc'), {'sha256': 'cccc'})
+        self.assertIsNotNone(self.cache.lookup('http://example.com/a'))
+        self.assertIsNone(self.cache.lookup('http://example.com/b'))
+        self.assertIsNotNone(self.cache.lookup('http://example.com/c'))
+
+    def test_prune_clear(self):
+        self.cache.store('http://example.com/a',
+                         self._make_file('a', b'aaaa'), {'sha256': 'aaaa'})
+        self.cache.store('http://example.com/b',
+                         self._make_file('b', b'bbbb'), {'sha256': 'bbbb'})
+        self.assertEqual(self.cache.prune(4), 1)
+        self.assertEqual(self.cache.stats()['archives'], 1)
+        self.assertEqual(self.cache.clear(), 1)
+        self.assertEqual(self.cache.stats()['archives'], 0)
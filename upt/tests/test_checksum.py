@@ -1,13 +1,15 @@
 # Copyright 2018      Cyril Roelandt
 #
 # Licensed under the 3-clause BSD license. See the LICENSE file.
+import concurrent.futures
+import os
+import tempfile
 import unittest
 from unittest import mock
 
 from upt import checksum
 
 
-@mock.patch('builtins.open', new_callable=mock.mock_open, read_data=b'foobar')
 class TestChecksum(unittest.TestCase):
     MD5 = '3858f62230ac3c915f300c664312c63f'
     SHA256 = 'c3ab8ff13720e8ad9047dd39466b3c8974e592c2fa383d4a3960714caef0c4f2'
@@ -15,33 +17,280 @@ class TestChecksum(unittest.TestCase):
     SHA512 = '0a50261ebd1a390fed2bf326f2673c145582a6342d523204973d0219337f81616a8069b012587cf5635f6925f1b56c360230c19b273500ee013e030601bf2425' # noqa
 
     def setUp(self):
-        self.path = '/fake/path'
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'foo')
+        with open(self.path, 'wb') as f:
+            f.write(b'foobar')
 
-    def test_md5_checksum(self, open_fn):
-        self.assertEqual(checksum._compute_md5_checksum(self.path), self.MD5)
+    def test_md5_checksum(self):
+        self.assertEqual(checksum.compute_checksum(self.path, 'md5'),
+                         self.MD5)
 
-    def test_sha256_checksum(self, open_fn):
-        self.assertEqual(checksum._compute_sha256_checksum(self.path),
+    def test_sha256_checksum(self):
+        self.assertEqual(checksum.compute_checksum(self.path, 'sha256'),
                          self.SHA256)
 
-    def test_sha256_base64_checksum(self, open_fn):
-        self.assertEqual(checksum._compute_sha256_base64_checksum(self.path),
+    def test_sha256_base64_checksum(self):
+        self.assertEqual(checksum.compute_checksum(self.path,
+                                                   'sha256_base64'),
                          self.SHA256_BASE64)
 
-    def test_sha512_checksum(self, open_fn):
-        self.assertEqual(checksum._compute_sha512_checksum(self.path),
+    def test_sha512_checksum(self):
+        self.assertEqual(checksum.compute_checksum(self.path, 'sha512'),
                          self.SHA512)
 
-    def test_compute_checksum(self, open_fn):
+    def test_compute_checksum(self):
         self.assertEqual(checksum.compute_checksum(self.path, 'md5'), self.MD5)
 
-    def test_compute_checksum_invalid_hash(self, open_fn):
+    def test_compute_checksum_invalid_hash(self):
         error = 'Unknown hash "fake-hash"'
         with self.assertRaisesRegex(checksum.HashUnknown, error):
             checksum.compute_checksum(self.path, 'fake-hash')
 
     @mock.patch('hashlib.new', side_effect=ValueError)
-    def test_compute_checksum_unavailable_hash(self, hash_fn, open_fn):
+    def test_compute_checksum_unavailable_hash(self, hash_fn):
         error = 'Hash "rmd160" is not available on your system'
         with self.assertRaisesRegex(checksum.HashUnavailable, error):
             checksum.compute_checksum(self.path, 'rmd160')
+
+
+class TestComputeChecksums(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'foo')
+        with open(self.path, 'wb') as f:
+            f.write(b'foobar')
+
+    def test_compute_checksums(self):
+        with mock.patch('upt.checksum._hash_file',
+                        wraps=checksum._hash_file) as hash_file_fn:
+            hashes = checksum.compute_checksums(self.path,
+                                                ['md5', 'sha256_base64'])
+        hash_file_fn.assert_called_once()
+        self.assertDictEqual(hashes, {
+            'md5': TestChecksum.MD5,
+            'sha256': TestChecksum.SHA256,
+            'sha256_base64': TestChecksum.SHA256_BASE64,
+        })
+
+    @mock.patch('upt.checksum._hash_file')
+    def test_known_hashes(self, hash_file_fn):
+        hashes = checksum.compute_checksums(
+            self.path, ['sha256', 'sha256_base64'],
+            {'md5': TestChecksum.MD5, 'sha256': TestChecksum.SHA256})
+        hash_file_fn.assert_not_called()
+        self.assertDictEqual(hashes, {
+            'sha256': TestChecksum.SHA256,
+            'sha256_base64': TestChecksum.SHA256_BASE64,
+        })
+
+    def test_invalid_hash(self):
+        with self.assertRaises(checksum.HashUnknown):
+            checksum.compute_checksums(self.path, ['md5', 'fake-hash'])
+
+
+class TestComputeMany(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.paths = []
+        for i in range(4):
+            path = os.path.join(tmpdir.name, str(i))
+            with open(path, 'wb') as f:
+                f.write(b'foobar')
+            self.paths.append(path)
+
+    def test_compute_many(self):
+        with mock.patch('concurrent.futures.ThreadPoolExecutor',
+                        wraps=concurrent.futures.ThreadPoolExecutor) as pool:
+            results = checksum.compute_many(self.paths, ['md5'], workers=2)
+        pool.assert_called_once_with(2)
+        self.assertEqual(results, {path: {'md5': TestChecksum.MD5}
+                                   for path in self.paths})
+
+    def test_known_hashes(self):
+        results = checksum.compute_many(self.paths[:2], ['md5'],
+                                        known_hashes={self.paths[0]:
+                                                      {'md5': 'md5'}})
+        self.assertEqual(results, {
+            self.paths[0]: {'md5': 'md5'},
+            self.paths[1]: {'md5': TestChecksum.MD5},
+        })
+
+    @mock.patch('concurrent.futures.ThreadPoolExecutor')
+    def test_single_file(self, pool):
+        results = checksum.compute_many(self.paths[:1], ['md5'])
+        pool.assert_not_called()
+        self.assertEqual(results, {self.paths[0]: {'md5': TestChecksum.MD5}})
+
+    def test_error(self):
+        with self.assertRaises(FileNotFoundError):
+            checksum.compute_many(self.paths + ['/does/not/exist'], ['md5'])
+
+
+class TestChecksumCache(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cache = checksum.ChecksumCache(os.path.join(tmpdir.name, 'db'))
+        self.addCleanup(self.cache.close)
+        self.path = os.path.join(tmpdir.name, 'foo')
+        with open(self.path, 'wb') as f:
+            f.write(b'foobar')
+
+    def test_store_lookup(self):
+        self.assertEqual(self.cache.lookup(self.path), {})
+        self.cache.store(self.path, {'md5': 'md5'})
+        self.cache.store(self.path, {'sha256': 'sha256'})
+        self.assertEqual(self.cache.lookup(self.path),
+                         {'md5': 'md5', 'sha256': 'sha256'})
+        self.assertEqual(self.cache.stats()['files'], 1)
+
+    def test_modified_file(self):
+        self.cache.store(self.path, {'md5': 'md5'})
+        st = os.stat(self.path)
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        self.assertEqual(self.cache.lookup(self.path), {})
+        self.assertEqual(self.cache.prune(), 1)
+        self.assertEqual(self.cache.stats()['files'], 0)
+
+    def test_prune_removed_file(self):
+        self.cache.store(self.path, {'md5': 'md5'})
+        self.assertEqual(self.cache.prune(), 0)
+        os.remove(self.path)
+        self.assertEqual(self.cache.prune(), 1)
+
+    def test_clear(self):
+        self.cache.store(self.path, {'md5': 'md5'})
+        self.assertEqual(self.cache.clear(), 1)
+        self.assertEqual(self.cache.lookup(self.path), {})
+
+    def test_compute_checksums(self):
+        checksum.set_checksum_cache(self.cache)
+        self.addCleanup(checksum.set_checksum_cache, None)
+        self.assertEqual(checksum.compute_checksums(self.path, ['md5']),
+                         {'md5': TestChecksum.MD5})
+        with mock.patch('upt.checksum._hash_file') as hash_file_fn:
+            self.assertEqual(checksum.compute_checksums(self.path, ['md5']),
+                             {'md5': TestChecksum.MD5})
+            hash_file_fn.assert_not_called()
+
+        # The cache is not used for short-lived files.
+        with mock.patch('upt.checksum._hash_file') as hash_file_fn:
+            checksum.compute_checksums(self.path, ['md5'], use_cache=False)
+            hash_file_fn.assert_called_once()
+        checksum.compute_checksums(self.path, ['sha512'], use_cache=False)
+        self.assertEqual(self.cache.lookup(self.path),
+                         {'md5': TestChecksum.MD5})
+
+
+class TestDeriveChecksums(unittest.TestCase):
+    def test_derive_checksums(self):
+        hashes = {'sha256': TestChecksum.SHA256}
+        self.assertDictEqual(
+            checksum.derive_checksums(hashes, ['md5', 'sha256_base64']),
+            {'sha256_base64': TestChecksum.SHA256_BASE64})
+        self.assertDictEqual(checksum.derive_checksums({}, ['sha256_base64']),
+                             {})
+
+    @mock.patch.dict('upt.checksum._DERIVED_CHECKSUMS', {
+        'sha256_upper': ('sha256', str.upper),
+        'sha256_upper_b64': ('sha256_upper',
+                             lambda value: value.lower()),
+    })
+    def test_derive_chain(self):
+        hashes = {'sha256': TestChecksum.SHA256}
+        self.assertDictEqual(
+            checksum.derive_checksums(hashes, ['sha256_upper_b64']),
+            {'sha256_upper_b64': TestChecksum.SHA256})
+
+
+class TestHashFile(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'foo')
+        self.data = bytes(range(256)) * 10
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def _hash_file(self):
+        chunks = []
+        checksum._hash_file(self.path, lambda data: chunks.append(bytes(data)))
+        return chunks
+
+    @mock.patch('upt.checksum.CHUNK_SIZE', 1000)
+    def test_read(self):
+        with mock.patch('mmap.mmap') as mmap_fn:
+            chunks = self._hash_file()
+        mmap_fn.assert_not_called()
+        self.assertEqual([len(chunk) for chunk in chunks], [1000, 1000, 560])
+        self.assertEqual(b''.join(chunks), self.data)
+
+    @mock.patch('upt.checksum.CHUNK_SIZE', 1000)
+    def test_buffer_reused(self):
+        buf = checksum._get_buffer()
+        self.assertEqual(len(buf), 1000)
+        self.assertIs(checksum._get_buffer(), buf)
+
+    @mock.patch('upt.checksum.CHUNK_SIZE', 1000)
+    @mock.patch('upt.checksum.MMAP_MIN_SIZE', 2000)
+    def test_mmap(self):
+        chunks = self._hash_file()
+        self.assertEqual([len(chunk) for chunk in chunks], [1000, 1000, 560])
+        self.assertEqual(b''.join(chunks), self.data)
+
+    @mock.patch('upt.checksum.MMAP_MIN_SIZE', 2000)
+    def test_mmap_unsupported(self):
+        with mock.patch('mmap.mmap', side_effect=OSError) as mmap_fn:
+            chunks = self._hash_file()
+        mmap_fn.assert_called_once()
+        self.assertEqual(b''.join(chunks), self.data)
+
+    def test_empty_file(self):
+        with open(self.path, 'wb'):
+            pass
+        self.assertEqual(self._hash_file(), [])
+
+
+class TestIsAvailable(unittest.TestCase):
+    def test_is_available(self):
+        self.assertTrue(checksum.is_available('sha256_base64'))
+        self.assertFalse(checksum.is_available('fake-hash'))
+        with mock.patch('hashlib.new', side_effect=ValueError):
+            self.assertFalse(checksum.is_available('rmd160'))
+
+
+class TestHasher(unittest.TestCase):
+    def test_hexdigests(self):
+        hasher = checksum.Hasher(['md5', 'sha256_base64'])
+        hasher.update(b'foo')
+        hasher.update(b'bar')
+        self.assertDictEqual(hasher.hexdigests(), {
+            'md5': TestChecksum.MD5,
+            'sha256': TestChecksum.SHA256,
+            'sha256_base64': TestChecksum.SHA256_BASE64,
+        })
+
+    def test_reset(self):
+        hasher = checksum.Hasher(['md5'])
+        hasher.update(b'garbage')
+        hasher.reset()
+        hasher.update(b'foobar')
+        self.assertEqual(hasher.hexdigests()['md5'], TestChecksum.MD5)
+
+    def test_no_hashes(self):
+        hasher = checksum.Hasher([])
+        hasher.update(b'foobar')
+        self.assertDictEqual(hasher.hexdigests(), {})
+
+    def test_invalid_hash(self):
+        with self.assertRaises(checksum.HashUnknown):
+            checksum.Hasher(['md5', 'fake-hash'])
+
+    @mock.patch('hashlib.new', side_effect=ValueError)
+    def test_unavailable_hash(self, hash_fn):
+        with self.assertRaises(checksum.HashUnavailable):
+            checksum.Hasher(['rmd160'])
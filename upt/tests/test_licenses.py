@@ -1,6 +1,11 @@
 # Copyright 2018      Cyril Roelandt
 #
 # Licensed under the 3-clause BSD license. See the LICENSE file.
+import concurrent.futures
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 from unittest import mock
 
@@ -48,9 +53,9 @@ class TestLicenses(unittest.TestCase):
         self.assertTrue(license.is_gpl_compatible())
         self.assertTrue(license.is_osi_approved())
 
-    @mock.patch('spdx_lookup.match')
+    @mock.patch('upt.licenses._guess')
     @mock.patch('builtins.open', new_callable=mock.mock_open, read_data='')
-    def test_guess_from_file(self, open_fn, match_fn):
+    def test_guess_from_file(self, open_fn, guess_fn):
         # Invalid arguments
         with self.assertRaises(ValueError):
             licenses.guess_from_file('/some/path', min_confidence=-1)
@@ -58,18 +63,18 @@ class TestLicenses(unittest.TestCase):
         with self.assertRaises(ValueError):
             licenses.guess_from_file('/some/path', min_confidence=101)
 
-        # spdx_lookup cannot find anything
-        match_fn.return_value = None
+        guess_fn.return_value = (92, 'BSD-3-Clause')
         self.assertIsInstance(licenses.guess_from_file('/some/path'),
                               licenses.UnknownLicense)
+        self.assertIsInstance(licenses.guess_from_file('/some/path', 90),
+                              licenses.BSDThreeClauseLicense)
 
-        match = mock.Mock(confidence=50, license=mock.Mock(id='BSD-3-Clause'))
-        match_fn.return_value = match
-        self.assertIsInstance(licenses.guess_from_file('/some/path'),
+        # Like spdx_lookup, never match licenses whose similarity is below 90
+        guess_fn.return_value = (50, 'BSD-3-Clause')
+        self.assertIsInstance(licenses.guess_from_file('/some/path', 50),
                               licenses.UnknownLicense)
 
-        match = mock.Mock(confidence=100, license=mock.Mock(id='BSD-3-Clause'))
-        match_fn.return_value = match
+        guess_fn.return_value = (100, 'BSD-3-Clause')
         self.assertIsInstance(licenses.guess_from_file('/some/path'),
                               licenses.BSDThreeClauseLicense)
 
@@ -79,3 +84,258 @@ class TestLicenses(unittest.TestCase):
 
         self.assertNotEqual(licenses.BSDTwoClauseLicense(),
                             licenses.BSDThreeClauseLicense())
+        self.assertNotEqual(licenses.BSDTwoClauseLicense(), 'BSD-2-Clause')
+
+    def test_singleton(self):
+        self.assertIs(licenses.MITLicense(), licenses.MITLicense())
+        self.assertIs(licenses.get_license_by_spdx_identifier('MIT'),
+                      licenses.MITLicense())
+        self.assertFalse(hasattr(licenses.MITLicense(), '__dict__'))
+        self.assertEqual(len({licenses.MITLicense(), licenses.ISCLicense(),
+                              licenses.MITLicense()}), 2)
+
+    def test_flags(self):
+        license = licenses.MITLicense()
+        self.assertEqual(license.flags, licenses.OSI_APPROVED |
+                         licenses.GPL_COMPATIBLE | licenses.DFSG_COMPATIBLE)
+        self.assertIsInstance(license, licenses.DFSGCompatibleLicense)
+        self.assertIsInstance(license, licenses.GPLCompatibleLicense)
+        self.assertIsInstance(license, licenses.OSIApprovedLicense)
+        self.assertEqual(licenses.AladdinFreePublicLicense.flags, 0)
+
+    def test_catalog(self):
+        for class_name, spdx_id, name, flags in licenses._CATALOG:
+            cls = getattr(licenses, class_name)
+            self.assertEqual(cls.__name__, class_name)
+            self.assertEqual(cls.spdx_identifier, spdx_id)
+            self.assertEqual(cls.name, name)
+            self.assertEqual(cls.flags, flags)
+            self.assertIs(licenses.get_license_by_spdx_identifier(spdx_id),
+                          cls())
+
+
+class TestPolicy(unittest.TestCase):
+    def test_allows(self):
+        policy = licenses.Policy('dfsg and gpl')
+        self.assertTrue(policy.allows(licenses.MITLicense()))
+        self.assertFalse(policy.allows(licenses.AladdinFreePublicLicense()))
+        self.assertFalse(policy.allows(licenses.UnknownLicense()))
+
+    def test_operators(self):
+        policy = licenses.Policy('NOT osi or (gpl and not dfsg)')
+        self.assertFalse(policy.allows(licenses.MITLicense()))
+        self.assertTrue(policy.allows(licenses.AladdinFreePublicLicense()))
+        self.assertTrue(policy.allows(licenses.UnknownLicense()))
+
+    def test_known(self):
+        policy = licenses.Policy('known')
+        self.assertTrue(policy.allows(licenses.AladdinFreePublicLicense()))
+        self.assertFalse(policy.allows(licenses.UnknownLicense()))
+
+    def test_violations(self):
+        policy = licenses.Policy('osi')
+        aladdin = licenses.AladdinFreePublicLicense()
+        self.assertEqual(policy.violations([licenses.MITLicense(), aladdin]),
+                         [aladdin])
+        self.assertEqual(policy.violations([]), [licenses.UnknownLicense()])
+
+    def test_invalid(self):
+        for expression in ('', 'osi and', '(osi', 'osi)', 'foo', 'osi gpl'):
+            with self.assertRaises(ValueError):
+                licenses.Policy(expression)
+
+
+class TestGetLicenseBySpdxIdentifier(unittest.TestCase):
+    def test_spdx_identifier(self):
+        self.assertIsInstance(
+            licenses.get_license_by_spdx_identifier('BSD-3-Clause'),
+            licenses.BSDThreeClauseLicense)
+
+    def test_case_insensitive(self):
+        self.assertIsInstance(
+            licenses.get_license_by_spdx_identifier('bsd-3-clause'),
+            licenses.BSDThreeClauseLicense)
+        self.assertIsInstance(
+            licenses.get_license_by_spdx_identifier(' MIT\n'),
+            licenses.MITLicense)
+
+    def test_alias(self):
+        gpl2_or_later = licenses.get_license_by_spdx_identifier(
+            'GPL-2.0-or-later')
+        for alias in ('GPLv2+', 'GPL-2.0+', 'gplv2+'):
+            self.assertEqual(licenses.get_license_by_spdx_identifier(alias),
+                             gpl2_or_later)
+
+    def test_aliases_are_registered(self):
+        for spdx_id in licenses._ALIASES.values():
+            self.assertIn(spdx_id, licenses._registry)
+
+    def test_unknown(self):
+        for spdx_id in ('not-a-license', '', None):
+            self.assertIsInstance(
+                licenses.get_license_by_spdx_identifier(spdx_id),
+                licenses.UnknownLicense)
+
+    def test_registry(self):
+        class TestLicense(licenses.BSDThreeClauseLicense):
+            pass
+        self.assertIs(licenses._registry['bsd-3-clause'],
+                      licenses.BSDThreeClauseLicense)
+        self.assertEqual(len(licenses._registry), 121)
+
+
+class TestImport(unittest.TestCase):
+    def test_spdx_lookup_not_imported(self):
+        # Importing upt must stay cheap: spdx_lookup, which loads a corpus of
+        # license texts, is only imported when guessing a license.
+        code = ('import sys, upt, upt.licenses; '
+                'upt.licenses.get_license_by_spdx_identifier("MIT"); '
+                'print("spdx_lookup" in sys.modules)')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.strip(), b'False')
+
+
+class TestLicenseIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import spdx
+        cls.templates = {record['id']: spdx.License(record).template
+                         for record in spdx.licenses()
+                         if record['id'] in ('MIT', 'Apache-2.0', 'ISC',
+                                             'MPL-2.0', 'PHP-3.0')}
+        cls.index = licenses._get_index()
+
+    def test_candidates(self):
+        for spdx_id in ('MIT', 'Apache-2.0', 'ISC'):
+            template = self.templates[spdx_id]
+            candidates = self.index.candidates(template)
+            self.assertEqual(len(candidates), 5)
+            self.assertEqual(candidates[0], (100, spdx_id))
+            similarities = [similarity for similarity, _ in candidates]
+            self.assertEqual(similarities, sorted(similarities, reverse=True))
+
+    def test_same_as_spdx_lookup(self):
+        import spdx_lookup
+        text = self.templates['MIT'].replace('MIT', '').replace('the', '')
+        similarity, spdx_id = self.index.candidates(text, 1)[0]
+        match = spdx_lookup.match(text)
+        self.assertEqual(spdx_id, match.license.id)
+        self.assertAlmostEqual(similarity, match.confidence)
+
+    def test_ties(self):
+        # Both texts are exactly as similar to other licenses: pick the same
+        # license as spdx_lookup.
+        import spdx_lookup
+        for spdx_id in ('MPL-2.0', 'PHP-3.0'):
+            candidates = self.index.candidates(self.templates[spdx_id], 2)
+            self.assertEqual(candidates[0], (100, spdx_id))
+            self.assertEqual(candidates[1][0], 100)
+            self.assertEqual(spdx_lookup.match(
+                self.templates[spdx_id]).license.id, spdx_id)
+
+    def test_no_words(self):
+        self.assertLess(self.index.candidates('')[0][0], 1)
+
+    def test_guess_from_file(self):
+        expected = {
+            'MIT': licenses.MITLicense,
+            'MPL-2.0': licenses.MozillaPublicLicenseTwoDotZero,
+        }
+        for spdx_id, cls in expected.items():
+            with tempfile.NamedTemporaryFile('w', suffix='LICENSE') as f:
+                f.write(self.templates[spdx_id])
+                f.flush()
+                with mock.patch('upt.licenses._memo', {}):
+                    self.assertIsInstance(licenses.guess_from_file(f.name),
+                                          cls)
+
+
+class TestGuessMany(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('upt.licenses._memo', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.cache = licenses.GuessCache(os.path.join(self.tmpdir, 'db'))
+        self.addCleanup(self.cache.close)
+
+    def _write(self, filename, content):
+        path = os.path.join(self.tmpdir, filename)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    @mock.patch('upt.licenses._compute_guess', return_value=(100, 'MIT'))
+    def test_memo(self, compute_guess_fn):
+        path = self._write('LICENSE', 'MIT license')
+        for _ in range(2):
+            self.assertIsInstance(licenses.guess_from_file(path),
+                                  licenses.MITLicense)
+        compute_guess_fn.assert_called_once_with('MIT license')
+
+    @mock.patch('upt.licenses._compute_guess', return_value=(100, 'MIT'))
+    def test_cache(self, compute_guess_fn):
+        licenses.set_guess_cache(self.cache)
+        self.addCleanup(licenses.set_guess_cache, None)
+        path = self._write('LICENSE', 'MIT license')
+        licenses.guess_from_file(path)
+        licenses._memo.clear()
+        self.assertIsInstance(licenses.guess_from_file(path),
+                              licenses.MITLicense)
+        compute_guess_fn.assert_called_once()
+
+        # The corpus of licenses changed
+        licenses._memo.clear()
+        with mock.patch('upt.licenses._corpus_version', return_value='0'):
+            licenses.guess_from_file(path)
+        self.assertEqual(compute_guess_fn.call_count, 2)
+
+        self.assertEqual(self.cache.clear(), 1)
+
+    @mock.patch('upt.licenses._compute_guess',
+                side_effect=[(100, 'MIT'), (92, 'ISC')])
+    def test_guess_many(self, compute_guess_fn):
+        paths = [self._write('a', 'MIT license'),
+                 self._write('b', 'ISC license'),
+                 self._write('c', 'MIT license')]
+        guesses = licenses.guess_many(paths, workers=1)
+        self.assertEqual(list(guesses.keys()), paths)
+        self.assertIsInstance(guesses[paths[0]], licenses.MITLicense)
+        self.assertIsInstance(guesses[paths[1]], licenses.UnknownLicense)
+        self.assertIsInstance(guesses[paths[2]], licenses.MITLicense)
+        self.assertEqual(compute_guess_fn.call_count, 2)
+
+        # Guesses are remembered.
+        guesses = licenses.guess_many(paths, min_confidence=90)
+        self.assertIsInstance(guesses[paths[1]], licenses.ISCLicense)
+        self.assertEqual(compute_guess_fn.call_count, 2)
+
+    def test_guess_many_processes(self):
+        import spdx
+        templates = {record['id']: spdx.License(record).template
+                     for record in spdx.licenses()
+                     if record['id'] in ('MIT', 'ISC')}
+        paths = [self._write(spdx_id, template)
+                 for spdx_id, template in templates.items()]
+        executor_cls = concurrent.futures.ProcessPoolExecutor
+        with mock.patch('concurrent.futures.ProcessPoolExecutor',
+                        wraps=executor_cls) as pool, \
+                mock.patch('threading.active_count', return_value=1):
+            guesses = licenses.guess_many(paths, workers=2)
+        pool.assert_called_once_with(2)
+        self.assertEqual({guess.spdx_identifier for guess in guesses.values()},
+                         {'MIT', 'ISC'})
+
+    @mock.patch('upt.licenses._compute_guess', return_value=(100, 'MIT'))
+    def test_guess_many_threads(self, compute_guess_fn):
+        # Multi-threaded processes are not forked.
+        paths = [self._write('a', 'MIT license'),
+                 self._write('b', 'ISC license')]
+        with mock.patch('concurrent.futures.ProcessPoolExecutor') as pool, \
+                mock.patch('threading.active_count', return_value=2):
+            guesses = licenses.guess_many(paths, workers=2)
+        pool.assert_not_called()
+        self.assertEqual(compute_guess_fn.call_count, 2)
+        self.assertIsInstance(guesses[paths[1]], licenses.MITLicense)
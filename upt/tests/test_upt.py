@@ -2,13 +2,31 @@
 #
 # Licensed under the 3-clause BSD license. See the LICENSE file.
 from io import StringIO
+import asyncio
+import datetime
+import hashlib
+import importlib
+import json
+import os
+import tempfile
 import unittest
 from unittest import mock
 import sys
+import threading
 
 import upt
 
 
+def fake_frontend_cls(name='valid-frontend'):
+    """Return a mock frontend class, whose instances are named NAME."""
+    return mock.Mock(**{
+        'return_value.name': name,
+        'return_value.parse.side_effect': (
+            lambda pkg_name, version=None: upt.Package(pkg_name,
+                                                       version or '42.0')),
+    })
+
+
 class TestPackage(unittest.TestCase):
     def test_str(self):
         pkg = upt.Package('foo', '4.2')
@@ -39,6 +57,55 @@ class TestPackage(unittest.TestCase):
             pkg.get_archive()
         self.assertEqual(pkg.get_archive(upt.ArchiveType.RUBYGEM), archives[0])
 
+    def test_prefetch_archives(self):
+        archives = [
+            upt.Archive('url1'),
+            upt.Archive('url2', archive_type=upt.ArchiveType.RUBYGEM),
+            upt.Archive('url3'),
+        ]
+        pkg = upt.Package('foo', '4.2', archives=archives)
+        with mock.patch.object(upt.Archive, 'download') as download_fn:
+            pkg.prefetch_archives(digests=['md5'])
+        self.assertEqual(download_fn.call_args_list, [mock.call(['md5'])] * 3)
+
+        downloaded = []
+        with mock.patch.object(upt.Archive, 'download', autospec=True,
+                               side_effect=lambda a, d: downloaded.append(a)):
+            pkg.prefetch_archives(types=[upt.ArchiveType.RUBYGEM])
+        self.assertEqual(downloaded, [archives[1]])
+
+    @mock.patch('upt.checksum.compute_many')
+    def test_prefetch_archives_downloaded(self, compute_many_fn):
+        archives = [upt.Archive('url1'), upt.Archive('url2', md5='md5')]
+        archives[0]._filepath = '/path1'
+        archives[1]._filepath = '/path2'
+        archives[1].wanted_hashes.add('sha512')
+        compute_many_fn.return_value = {
+            '/path1': {'md5': 'md5-1', 'sha512': 'sha512-1'},
+            '/path2': {'md5': 'md5', 'sha512': 'sha512-2'},
+        }
+        pkg = upt.Package('foo', '4.2', archives=archives)
+        with mock.patch.object(upt.Archive, 'download') as download_fn:
+            pkg.prefetch_archives(digests=['md5'], max_workers=2)
+        download_fn.assert_not_called()
+        compute_many_fn.assert_called_once_with(
+            ['/path1', '/path2'], {'md5', 'sha512'}, 2, mock.ANY,
+            use_cache=False)
+        self.assertEqual(archives[0].md5, 'md5-1')
+        self.assertEqual(archives[1].sha512, 'sha512-2')
+
+        # Nothing left to compute
+        compute_many_fn.reset_mock()
+        pkg.prefetch_archives(digests=['md5'])
+        compute_many_fn.assert_not_called()
+
+    def test_prefetch_archives_error(self):
+        pkg = upt.Package('foo', '4.2', archives=[upt.Archive('url')])
+        with mock.patch.object(upt.Archive, 'download',
+                               side_effect=OSError):
+            with self.assertRaises(OSError):
+                pkg.prefetch_archives()
+
     @mock.patch('os.remove')
     def test_clean_archive_downloaded(self, remove_fn):
         archives = [
@@ -143,15 +210,110 @@ class TestPackageDiff(unittest.TestCase):
 
 
 class TestUtils(unittest.TestCase):
-    @mock.patch('pkg_resources.iter_entry_points')
-    def test_get_installed_plugins(self, m_iter_entry_points):
-        plugin = mock.Mock()
-        plugin_cls = mock.Mock()
-        plugin_cls.name = 'fake-name'
-        plugin.load.return_value = plugin_cls
-        m_iter_entry_points.return_value = [plugin]
-        self.assertDictEqual(upt.upt._get_installed_plugins('dummy'),
-                             {'fake-name': plugin.load.return_value})
+    @mock.patch('upt.upt._get_entry_points')
+    def test_get_installed_plugins(self, m_get_entry_points):
+        m_get_entry_points.return_value = [
+            ('fake-name', 'upt.licenses:MITLicense', '1.0'),
+            ('fake-name', 'upt.licenses:ISCLicense', '2.0'),
+        ]
+        with mock.patch('importlib.import_module',
+                        wraps=importlib.import_module) as import_fn:
+            plugins = upt.upt._get_installed_plugins('dummy')
+            m_get_entry_points.assert_called_once_with('dummy')
+            self.assertEqual(list(plugins.keys()), ['fake-name'])
+            import_fn.assert_not_called()
+
+            # The plugin class is only loaded, once, when it is first used.
+            self.assertIs(plugins['fake-name'](), upt.licenses.MITLicense())
+            self.assertIs(plugins['fake-name'].load(),
+                          upt.licenses.MITLicense)
+            import_fn.assert_called_once_with('upt.licenses')
+            self.assertEqual(upt.upt._plugin_version(
+                upt.licenses.MITLicense()), '1.0')
+
+    def test_scan_entry_points(self):
+        try:
+            import importlib.metadata as metadata
+        except ImportError:  # Python < 3.8
+            metadata = None
+        if metadata is not None:
+            dist = mock.Mock(version='1.0', entry_points=[
+                metadata.EntryPoint('pypi', 'upt_pypi.upt_pypi:PyPIFrontend',
+                                    'upt.frontends'),
+                metadata.EntryPoint('pip', 'pip._internal:main',
+                                    'console_scripts'),
+            ])
+            patcher = mock.patch('importlib.metadata.distributions',
+                                 return_value=[dist])
+        else:
+            def iter_entry_points(group):
+                if group == 'upt.frontends':
+                    ep = mock.Mock(module_name='upt_pypi.upt_pypi',
+                                   attrs=('PyPIFrontend',))
+                    ep.name = 'pypi'
+                    ep.dist.version = '1.0'
+                    yield ep
+            patcher = mock.patch('pkg_resources.iter_entry_points',
+                                 side_effect=iter_entry_points)
+        with patcher:
+            groups = upt.upt._scan_entry_points(['upt.frontends',
+                                                 'upt.dummy'])
+        self.assertEqual(groups, {
+            'upt.frontends': [('pypi', 'upt_pypi.upt_pypi:PyPIFrontend',
+                               '1.0')],
+            'upt.dummy': [],
+        })
+
+    def test_get_entry_points(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        sys_path = tempfile.TemporaryDirectory()
+        self.addCleanup(sys_path.cleanup)
+        entry_points = {
+            'upt.frontends': [('pypi', 'upt_pypi.upt_pypi:PyPIFrontend',
+                               '1.0')],
+            'upt.backends': [],
+        }
+        with mock.patch.dict(os.environ, {'UPT_CACHE_DIR': cache_dir.name}), \
+                mock.patch('sys.path', [sys_path.name]), \
+                mock.patch('upt.upt._scan_entry_points',
+                           return_value=entry_points) as m_scan:
+            for _ in range(2):
+                self.assertEqual(
+                    upt.upt._get_entry_points('upt.frontends'),
+                    [('pypi', 'upt_pypi.upt_pypi:PyPIFrontend', '1.0')])
+                self.assertEqual(upt.upt._get_entry_points('upt.backends'),
+                                 [])
+            m_scan.assert_called_once()
+
+            # Installing a distribution invalidates the cache.
+            st = os.stat(sys_path.name)
+            os.utime(sys_path.name, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+            upt.upt._get_entry_points('upt.frontends')
+            self.assertEqual(m_scan.call_count, 2)
+
+            # So does changing sys.path.
+            sys.path.append(cache_dir.name)
+            upt.upt._get_entry_points('upt.frontends')
+            self.assertEqual(m_scan.call_count, 3)
+
+            # A corrupted cache is ignored.
+            path = os.path.join(cache_dir.name, 'entry_points.json')
+            with open(path, 'w') as f:
+                f.write('{')
+            upt.upt._get_entry_points('upt.frontends')
+            self.assertEqual(m_scan.call_count, 4)
+            self.assertEqual(os.listdir(cache_dir.name),
+                             ['entry_points.json'])
+
+            # So is a cache written by older versions of upt.
+            with open(path) as f:
+                index = json.load(f)
+            del index['format']
+            with open(path, 'w') as f:
+                json.dump(index, f)
+            upt.upt._get_entry_points('upt.frontends')
+            self.assertEqual(m_scan.call_count, 5)
 
     @mock.patch('upt.upt._get_installed_plugins')
     def test_get_installed_frontends_backends(self, m_get_plugins):
@@ -257,6 +419,13 @@ class TestParser(unittest.TestCase):
 class TestCommandLine(unittest.TestCase):
     def setUp(self):
         sys.argv = ['/path/to/upt']
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patcher = mock.patch.dict(os.environ,
+                                  {'UPT_CACHE_DIR': cache_dir.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmpdir = cache_dir.name
 
     @mock.patch('sys.stderr', new_callable=StringIO)
     @mock.patch('sys.stdout', new_callable=StringIO)
@@ -315,7 +484,7 @@ class TestCommandLine(unittest.TestCase):
             upt.upt.main()
 
     @mock.patch('upt.upt._get_installed_frontends',
-                return_value={'valid-frontend': mock.Mock()})
+                return_value={'valid-frontend': fake_frontend_cls()})
     @mock.patch('upt.upt._get_installed_backends',
                 return_value={'valid-backend': mock.Mock()})
     def test_package_invalid_frontend(self, m_backends, m_frontends):
@@ -325,7 +494,7 @@ class TestCommandLine(unittest.TestCase):
         self.assertEqual(exit.exception.code, 2)
 
     @mock.patch('upt.upt._get_installed_frontends',
-                return_value={'valid-frontend': mock.Mock()})
+                return_value={'valid-frontend': fake_frontend_cls()})
     @mock.patch('upt.upt._get_installed_backends',
                 return_value={'valid-backend': mock.Mock()})
     def test_package_invalid_backend(self, m_backends, m_frontends):
@@ -335,7 +504,7 @@ class TestCommandLine(unittest.TestCase):
         self.assertEqual(exit.exception.code, 2)
 
     @mock.patch('upt.upt._get_installed_frontends',
-                return_value={'valid-frontend': mock.Mock()})
+                return_value={'valid-frontend': fake_frontend_cls()})
     @mock.patch('upt.upt._get_installed_backends',
                 return_value={'valid-backend': mock.Mock()})
     def test_package_unhandled_frontend(self, m_backends, m_frontends):
@@ -346,6 +515,7 @@ class TestCommandLine(unittest.TestCase):
             raise upt.exceptions.UnhandledFrontendError('valid-backend',
                                                         'valid-frontend')
         fake_backend = mock.Mock()
+        fake_backend().current_version.return_value = '41.0'
         fake_backend().create_package.side_effect = backend_fail
         m_backends.return_value = {
             'valid-backend': fake_backend
@@ -355,7 +525,7 @@ class TestCommandLine(unittest.TestCase):
         self.assertEqual(exit.exception.code, 1)
 
     @mock.patch('upt.upt._get_installed_frontends',
-                return_value={'valid-frontend': mock.Mock()})
+                return_value={'valid-frontend': fake_frontend_cls()})
     @mock.patch('upt.upt._get_installed_backends',
                 return_value={'valid-backend': mock.Mock()})
     def test_package_invalid_pkgname(self, m_backends, m_frontends):
@@ -365,7 +535,7 @@ class TestCommandLine(unittest.TestCase):
         def frontend_fail(*args, **kwargs):
             raise upt.exceptions.InvalidPackageNameError('valid-backend',
                                                          'pkgname')
-        fake_frontend = mock.Mock()
+        fake_frontend = fake_frontend_cls()
         fake_frontend().parse.side_effect = frontend_fail
         m_frontends.return_value = {
             'valid-frontend': fake_frontend
@@ -375,7 +545,7 @@ class TestCommandLine(unittest.TestCase):
         self.assertEqual(exit.exception.code, 1)
 
     @mock.patch('upt.upt._get_installed_frontends',
-                return_value={'valid-frontend': mock.Mock()})
+                return_value={'valid-frontend': fake_frontend_cls()})
     @mock.patch('upt.upt._get_installed_backends',
                 return_value={'valid-backend': mock.Mock()})
     def test_package_invalid_package_version(self, m_backends, m_frontends):
@@ -386,7 +556,7 @@ class TestCommandLine(unittest.TestCase):
             raise upt.exceptions.InvalidPackageVersionError('valid-backend',
                                                             'pkgname',
                                                             '13.37')
-        fake_frontend = mock.Mock()
+        fake_frontend = fake_frontend_cls()
         fake_frontend().parse.side_effect = frontend_fail
         m_frontends.return_value = {
             'valid-frontend': fake_frontend
@@ -396,7 +566,7 @@ class TestCommandLine(unittest.TestCase):
         self.assertEqual(exit.exception.code, 1)
 
     @mock.patch('upt.upt._get_installed_frontends',
-                return_value={'valid-frontend': mock.Mock()})
+                return_value={'valid-frontend': fake_frontend_cls()})
     @mock.patch('upt.upt._get_installed_backends')
     def test_package_update_not_supported(self, m_backends, m_frontends):
         cmdline = 'package -f valid-frontend -b valid-backend -u pkgname'
@@ -406,6 +576,7 @@ class TestCommandLine(unittest.TestCase):
             raise NotImplementedError
 
         fake_backend = mock.Mock()
+        fake_backend().current_version.return_value = '41.0'
         fake_backend().update_package.side_effect = backend_fail
         m_backends.return_value = {
             'valid-backend': fake_backend,
@@ -415,7 +586,7 @@ class TestCommandLine(unittest.TestCase):
         self.assertEqual(exit.exception.code, 1)
 
     @mock.patch('upt.upt._get_installed_frontends',
-                return_value={'valid-frontend': mock.Mock()})
+                return_value={'valid-frontend': fake_frontend_cls()})
     @mock.patch('upt.upt._get_installed_backends')
     @mock.patch('sys.stdout', new_callable=StringIO)
     def test_package_update_already_up_to_date(self, m_stdout,
@@ -429,12 +600,13 @@ class TestCommandLine(unittest.TestCase):
         def backend_update(*args, **kwargs):
             raise upt.upt.PackageUpToDateException('pkgname', '42.0')
 
-        fake_frontend = mock.Mock()
+        fake_frontend = fake_frontend_cls()
         fake_frontend().parse.side_effect = frontend_parse
         m_frontends.return_value = {
             'valid-frontend': fake_frontend
         }
         fake_backend = mock.Mock()
+        fake_backend().current_version.return_value = '41.0'
         fake_backend().update_package.side_effect = backend_update
         m_backends.return_value = {
             'valid-backend': fake_backend,
@@ -443,8 +615,31 @@ class TestCommandLine(unittest.TestCase):
         self.assertIn(str(upt.upt.PackageUpToDateException('pkgname', '42.0')),
                       m_stdout.getvalue().split('\n')[-2])
 
+    @mock.patch('upt.upt._get_installed_frontends')
+    @mock.patch('upt.upt._get_installed_backends')
+    def test_integrity_error(self, m_backends, m_frontends):
+        error = upt.download.ChecksumMismatch('https://example.com/foo.tgz',
+                                              'sha256', 'expected', 'actual')
+        fake_frontend = fake_frontend_cls()
+        fake_frontend().parse.side_effect = error
+        m_frontends.return_value = {'valid-frontend': fake_frontend}
+        fake_backend = mock.Mock()
+        fake_backend().current_version.return_value = '41.0'
+        m_backends.return_value = {'valid-backend': fake_backend}
+        argv = list(sys.argv)
+        for cmdline in ('package pkgname', 'package -u pkgname',
+                        'licenses audit pkgname'):
+            with self.subTest(cmdline=cmdline):
+                sys.argv[:] = argv + cmdline.split()
+                with self.assertRaises(SystemExit) as exit, \
+                        mock.patch('sys.stderr',
+                                   new_callable=StringIO) as m_stderr:
+                    upt.upt.main()
+                self.assertEqual(exit.exception.code, 1)
+                self.assertEqual(m_stderr.getvalue(), f'{error}\n')
+
     @mock.patch('upt.upt._get_installed_frontends',
-                return_value={'valid-frontend': mock.Mock()})
+                return_value={'valid-frontend': fake_frontend_cls()})
     @mock.patch('upt.upt._get_installed_backends')
     @mock.patch('sys.stderr', new_callable=StringIO)
     def test_package_update_unavailable(self, m_stderr, m_backends,
@@ -459,12 +654,13 @@ class TestCommandLine(unittest.TestCase):
         def backend_update(*args, **kwargs):
             raise upt.upt.PackageUpToDateException('pkgname', '42.0')
 
-        fake_frontend = mock.Mock()
+        fake_frontend = fake_frontend_cls()
         fake_frontend().parse.side_effect = frontend_parse
         m_frontends.return_value = {
             'valid-frontend': fake_frontend
         }
         fake_backend = mock.Mock()
+        fake_backend().current_version.return_value = '41.0'
         fake_backend().update_package.side_effect = backend_update
         m_backends.return_value = {
             'valid-backend': fake_backend,
@@ -476,10 +672,207 @@ class TestCommandLine(unittest.TestCase):
                                                           'pkgname')
         self.assertIn(str(expected), m_stderr.getvalue().split('\n')[-2])
 
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_cache_stats(self, m_stdout):
+        sys.argv.extend('cache stats'.split())
+        with self.assertRaises(SystemExit) as exit:
+            upt.upt.main()
+        self.assertEqual(exit.exception.code, 0)
+        self.assertIn('Archives: 0\n', m_stdout.getvalue())
+        self.assertIn('Checksums: 0 file(s)\n', m_stdout.getvalue())
+        self.assertIn('License guesses: 0\n', m_stdout.getvalue())
+        self.assertIn('Metadata: 0 package(s)\n', m_stdout.getvalue())
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    @mock.patch('upt.cache.MetadataCache.prune', return_value=1)
+    @mock.patch('upt.checksum.ChecksumCache.prune', return_value=2)
+    @mock.patch('upt.cache.ArchiveCache.prune', return_value=3)
+    def test_cache_prune(self, m_prune, m_checksum_prune, m_metadata_prune,
+                         m_stdout):
+        sys.argv.extend('cache prune --max-size 10M'.split())
+        with self.assertRaises(SystemExit) as exit:
+            upt.upt.main()
+        self.assertEqual(exit.exception.code, 0)
+        m_prune.assert_called_once_with(10 * 1024 * 1024)
+        m_checksum_prune.assert_called_once_with()
+        m_metadata_prune.assert_called_once_with()
+        self.assertEqual(m_stdout.getvalue(),
+                         'Removed 3 archive(s)\n'
+                         'Removed the checksums of 2 file(s)\n'
+                         'Removed the expired metadata of 1 package(s)\n')
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    @mock.patch('upt.cache.MetadataCache.clear', return_value=0)
+    @mock.patch('upt.licenses.GuessCache.clear', return_value=0)
+    @mock.patch('upt.checksum.ChecksumCache.clear', return_value=0)
+    @mock.patch('upt.cache.ArchiveCache.clear', return_value=0)
+    def test_cache_clear(self, m_clear, m_checksum_clear, m_guess_clear,
+                         m_metadata_clear, m_stdout):
+        sys.argv.extend('cache clear'.split())
+        with self.assertRaises(SystemExit) as exit:
+            upt.upt.main()
+        self.assertEqual(exit.exception.code, 0)
+        m_clear.assert_called_once_with()
+        m_checksum_clear.assert_called_once_with()
+        m_guess_clear.assert_called_once_with()
+        m_metadata_clear.assert_called_once_with()
+
+    @mock.patch('upt.upt._get_installed_frontends',
+                return_value={'valid-frontend': fake_frontend_cls()})
+    @mock.patch('upt.upt._get_installed_backends',
+                return_value={'valid-backend': mock.Mock()})
+    @mock.patch('upt.upt.package')
+    def test_package_archive_cache(self, m_package, m_backends, m_frontends):
+        caches = []
+        m_package.side_effect = lambda *args, **kwargs: caches.append(
+            (upt.cache.get_archive_cache(),
+             upt.checksum.get_checksum_cache(),
+             upt.licenses.get_guess_cache(),
+             upt.cache.get_metadata_cache()))
+        sys.argv.extend('package pkgname'.split())
+        upt.upt.main()
+        self.assertIsInstance(caches[0][0], upt.cache.ArchiveCache)
+        self.assertIsInstance(caches[0][1], upt.checksum.ChecksumCache)
+        self.assertIsInstance(caches[0][2], upt.licenses.GuessCache)
+        self.assertIsInstance(caches[0][3], upt.cache.MetadataCache)
+        self.assertEqual(caches[0][3].ttl, upt.cache.DEFAULT_METADATA_TTL)
+        self.assertIsNone(upt.cache.get_archive_cache())
+        self.assertIsNone(upt.checksum.get_checksum_cache())
+        self.assertIsNone(upt.licenses.get_guess_cache())
+        self.assertIsNone(upt.cache.get_metadata_cache())
+
+        sys.argv[-1:] = '--metadata-ttl 2d pkgname'.split()
+        upt.upt.main()
+        self.assertEqual(caches[1][3].ttl, 2 * 86400)
+
+        sys.argv[-3:] = '--no-cache pkgname'.split()
+        upt.upt.main()
+        self.assertEqual(caches[2], (None, None, None, None))
+
+    @mock.patch('upt.upt._get_installed_frontends',
+                return_value={'valid-frontend': fake_frontend_cls()})
+    @mock.patch('upt.upt._get_installed_backends',
+                return_value={'valid-backend': mock.Mock()})
+    @mock.patch('upt.upt.package')
+    def test_package_workspace(self, m_package, m_backends, m_frontends):
+        workspaces = []
+        m_package.side_effect = lambda *args, **kwargs: workspaces.append(
+            upt.upt.get_workspace())
+        sys.argv.extend('package pkgname'.split())
+        with mock.patch('tempfile.tempdir', self.tmpdir):
+            upt.upt.main()
+        self.assertIsInstance(workspaces[0], upt.Workspace)
+        self.assertFalse(os.path.exists(workspaces[0].directory))
+        self.assertIsNone(upt.upt._workspace)
+
+    @mock.patch('upt.upt._get_installed_frontends')
+    @mock.patch('upt.upt._get_installed_backends', return_value={})
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_licenses_audit(self, m_stdout, m_backends, m_frontends):
+        fake_frontend = fake_frontend_cls()
+        fake_frontend().parse.side_effect = None
+        fake_frontend().parse.return_value = upt.Package(
+            'pkgname', '1.0', licenses=[upt.licenses.MITLicense()])
+        m_frontends.return_value = {'valid-frontend': fake_frontend}
+        sys.argv.extend('licenses audit -r pkgname'.split())
+        upt.upt.main()
+        self.assertEqual(m_stdout.getvalue(), '')
+
+        sys.argv[-2:] = '--policy not(osi) pkgname'.split()
+        with self.assertRaises(SystemExit) as exit:
+            upt.upt.main()
+        self.assertEqual(exit.exception.code, 1)
+        self.assertEqual(m_stdout.getvalue(), 'pkgname@1.0: MIT\n')
+
+    @mock.patch('upt.upt._get_installed_frontends',
+                return_value={'valid-frontend': fake_frontend_cls()})
+    @mock.patch('upt.upt._get_installed_backends', return_value={})
+    @mock.patch('sys.stderr', new_callable=StringIO)
+    def test_licenses_audit_invalid_policy(self, m_stderr, m_backends,
+                                           m_frontends):
+        sys.argv.extend('licenses audit --policy osi+gpl pkgname'.split())
+        with self.assertRaises(SystemExit) as exit:
+            upt.upt.main()
+        self.assertEqual(exit.exception.code, 2)
+
+    @mock.patch('upt.upt._get_installed_frontends',
+                return_value={'valid-frontend': fake_frontend_cls()})
+    @mock.patch('upt.upt._get_installed_backends',
+                return_value={'valid-backend': mock.Mock()})
+    @mock.patch('upt.upt.package')
+    def test_package_jobs(self, m_package, m_backends, m_frontends):
+        sys.argv.extend('package -r -j 4 pkgname'.split())
+        upt.upt.main()
+        self.assertEqual(m_package.call_args[1], {'jobs': 4})
+
+    @mock.patch('upt.upt._get_installed_frontends',
+                return_value={'valid-frontend': fake_frontend_cls()})
+    @mock.patch('upt.upt._get_installed_backends',
+                return_value={'valid-backend': mock.Mock()})
+    @mock.patch('sys.stderr', new_callable=StringIO)
+    def test_package_invalid_jobs(self, m_stderr, m_backends, m_frontends):
+        for jobs in ('0', 'two'):
+            sys.argv[1:] = ['package', '-j', jobs, 'pkgname']
+            with self.assertRaises(SystemExit) as exit:
+                upt.upt.main()
+            self.assertEqual(exit.exception.code, 2)
+            self.assertIn(f'invalid positive integer: {jobs}',
+                          m_stderr.getvalue())
+
+    @mock.patch('upt.upt._get_installed_frontends', return_value={})
+    def test_licenses_no_frontends(self, m_frontends):
+        sys.argv.extend('licenses audit pkgname'.split())
+        with self.assertRaises(SystemExit):
+            upt.upt.main()
+
+
+class TestWorkspace(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+
+    def test_path(self):
+        workspace = upt.Workspace(self.tmpdir)
+        self.assertEqual(os.path.dirname(workspace.directory), self.tmpdir)
+        path1 = workspace.path('foo.tar.gz')
+        path2 = workspace.path('foo.tar.gz')
+        self.assertNotEqual(path1, path2)
+        for path in (path1, path2):
+            self.assertEqual(os.path.basename(path), 'foo.tar.gz')
+            self.assertTrue(os.path.isdir(os.path.dirname(path)))
+
+    def test_unique(self):
+        self.assertNotEqual(upt.Workspace(self.tmpdir).directory,
+                            upt.Workspace(self.tmpdir).directory)
+
+    def test_cleanup(self):
+        with upt.Workspace(self.tmpdir) as workspace:
+            with open(workspace.path('foo'), 'w'):
+                pass
+        self.assertFalse(os.path.exists(workspace.directory))
+
+    @mock.patch('atexit.register')
+    def test_get_workspace(self, register_fn):
+        workspace = upt.Workspace(self.tmpdir)
+        upt.upt.set_workspace(workspace)
+        self.addCleanup(upt.upt.set_workspace, None)
+        self.assertIs(upt.upt.get_workspace(), workspace)
+
+        with mock.patch('tempfile.tempdir', self.tmpdir):
+            upt.upt.set_workspace(None)
+            workspace = upt.upt.get_workspace()
+        self.assertIs(upt.upt.get_workspace(), workspace)
+        register_fn.assert_called_once_with(workspace.cleanup)
+
 
 class TestArchive(unittest.TestCase):
     def setUp(self):
-        pass
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.workspace = upt.Workspace(tmpdir.name)
+        upt.upt.set_workspace(self.workspace)
+        self.addCleanup(upt.upt.set_workspace, None)
 
     @mock.patch('os.stat', return_value=mock.Mock(st_size=42))
     def test_size(self, stat_fn):
@@ -491,27 +884,300 @@ class TestArchive(unittest.TestCase):
         archive._filepath = '/fake/path'
         self.assertEqual(archive.size, 12)
 
+    @mock.patch('upt.download.remote_size', return_value=42)
+    def test_size_remote(self, remote_size_fn):
+        archive = upt.Archive('http://example.com/source.tar.gz')
+        self.assertEqual(archive.size, 42)
+        self.assertIsNone(archive._filepath)
+        remote_size_fn.assert_called_once_with(
+            'http://example.com/source.tar.gz')
+
+    @mock.patch('upt.download.remote_size', return_value=None)
+    @mock.patch('upt.download.download')
+    def test_size_remote_unknown(self, download_fn,
+                                 remote_size_fn):
+        download_fn.return_value = upt.download.DownloadResult(6, {})
+        archive = upt.Archive('http://example.com/source.tar.gz')
+        with mock.patch('os.stat', return_value=mock.Mock(st_size=6)):
+            self.assertEqual(archive.size, 6)
+        download_fn.assert_called_once()
+
+    @mock.patch('upt.download.remote_size')
+    def test_size_download_in_progress(self, remote_size_fn):
+        archive = upt.Archive('http://example.com/source.tar.gz')
+        archive._set_length(42)
+        self.assertEqual(archive.size, 42)
+        remote_size_fn.assert_not_called()
+
+    @mock.patch('upt.download.remote_size')
+    def test_size_cached(self, remote_size_fn):
+        cache = mock.Mock()
+        cache.lookup.return_value = upt.cache.CachedArchive('/path', 42, {},
+                                                            {})
+        with mock.patch('upt.cache.get_archive_cache', return_value=cache):
+            archive = upt.Archive('http://example.com/source.tar.gz')
+            self.assertEqual(archive.size, 42)
+        remote_size_fn.assert_not_called()
+
     def test_filename(self):
         archive = upt.Archive('http://example.com/source.tar.gz')
         self.assertEqual(archive.filename, 'source.tar.gz')
 
-    @mock.patch('urllib.request.urlretrieve',
-                return_value=('/tmpdir/source.tar.gz', None))
-    @mock.patch('tempfile.gettempdir', return_value='/tmpdir')
-    def test_filepath(self, gettempdir_fn, urlretrieve_fn):
+    @mock.patch('upt.download.download')
+    def test_filepath(self, download_fn):
+        download_fn.side_effect = self._fake_download
         archive = upt.Archive('http://example.com/source.tar.gz')
-        self.assertEqual(archive.filepath, '/tmpdir/source.tar.gz')
+        filepath = archive.filepath
+        self.assertEqual(os.path.basename(filepath), 'source.tar.gz')
+        self.assertTrue(filepath.startswith(self.workspace.directory))
+        self.assertEqual(archive.filepath, filepath)
+        download_fn.assert_called_once()
+        self.assertEqual(archive.size, 6)
+
+        # Archives with the same filename do not share a path.
+        other = upt.Archive('http://example.org/source.tar.gz')
+        self.assertNotEqual(other.filepath, filepath)
+
+    @staticmethod
+    def _fake_download(url, filepath, hasher=None, **kwargs):
+        with open(filepath(), 'wb') as f:
+            f.write(b'foobar')
+        hasher.update(b'foobar')
+        return upt.download.DownloadResult(6, {})
+
+    @mock.patch('upt.checksum.compute_checksum')
+    @mock.patch('upt.download.download')
+    def test_checksum(self, download_fn, compute_checksum_fn):
+        download_fn.side_effect = self._fake_download
+        archive = upt.Archive('http://example.com/source.tar.gz')
+        self.assertEqual(archive._checksum('md5'),
+                         '3858f62230ac3c915f300c664312c63f')
+        self.assertEqual(archive._checksum('md5'),
+                         '3858f62230ac3c915f300c664312c63f')
+        download_fn.assert_called_once()
+        compute_checksum_fn.assert_not_called()
 
-    @mock.patch('upt.checksum.compute_checksum', return_value='hash-output')
-    @mock.patch('urllib.request.urlretrieve',
-                return_value=('/tmpdir/source.tar.gz', None))
-    @mock.patch('tempfile.gettempdir', return_value='/tmpdir')
-    def test_checksum(self, gettmpdir_fn, urlretrieve_fn, compute_checksum_fn):
+    @mock.patch('upt.checksum.compute_checksum')
+    @mock.patch('upt.download.download')
+    def test_download_multiple_checksums(self, download_fn,
+                                         compute_checksum_fn):
+        download_fn.side_effect = self._fake_download
+        archive = upt.Archive('http://example.com/source.tar.gz', md5='md5')
+        archive.download(['md5', 'sha256_base64', 'sha512'])
+        self.assertEqual(archive.md5, 'md5')
+        self.assertEqual(archive.sha256,
+                         'c3ab8ff13720e8ad9047dd39466b3c8974e592c2fa383d4a3960714caef0c4f2')  # noqa
+        self.assertEqual(archive.sha256_base64,
+                         'w6uP8Tcg6K2QR905Rms8iXTlksL6OD1KOWBxTK7wxPI=')
+        self.assertEqual(archive.sha512[:16], '0a50261ebd1a390f')
+        self.assertEqual(archive.size, 6)
+        download_fn.assert_called_once()
+        compute_checksum_fn.assert_not_called()
+
+    @mock.patch('upt.checksum.compute_checksums',
+                return_value={'md5': 'hash-output'})
+    @mock.patch('upt.download.download')
+    def test_download_already_downloaded(self, download_fn,
+                                         compute_checksums_fn):
+        archive = upt.Archive('url')
+        archive._filepath = '/fake/path'
+        archive.download(['md5'])
+        download_fn.assert_not_called()
+        compute_checksums_fn.assert_called_once_with('/fake/path', {'md5'},
+                                                     mock.ANY, use_cache=False)
+        self.assertEqual(archive.md5, 'hash-output')
+
+    @mock.patch('upt.checksum.compute_checksums',
+                return_value={'md5': 'md5', 'sha512': 'sha512'})
+    def test_wanted_hashes(self, compute_checksums_fn):
+        archive = upt.Archive('url')
+        archive._filepath = '/fake/path'
+        archive.wanted_hashes.update(['md5', 'sha512'])
+        self.assertEqual(archive.md5, 'md5')
+        self.assertEqual(archive.sha512, 'sha512')
+        compute_checksums_fn.assert_called_once_with(
+            '/fake/path', {'md5', 'sha512'}, mock.ANY, use_cache=False)
+
+    @mock.patch('upt.download.download')
+    def test_derived_checksum(self, download_fn):
+        archive = upt.Archive('url', sha256='c3ab8ff13720e8ad9047dd39466b3c8974e592c2fa383d4a3960714caef0c4f2')  # noqa
+        self.assertEqual(archive.sha256_base64,
+                         'w6uP8Tcg6K2QR905Rms8iXTlksL6OD1KOWBxTK7wxPI=')
+        download_fn.assert_not_called()
+
+    @mock.patch('upt.download.download')
+    def test_download_cache(self, download_fn):
+        download_fn.side_effect = self._fake_download
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = upt.cache.ArchiveCache(os.path.join(tmpdir, 'cache'))
+            self.addCleanup(cache.close)
+            with mock.patch('upt.cache.get_archive_cache',
+                            return_value=cache):
+                # Cache miss
+                archive = upt.Archive('http://example.com/source.tar.gz')
+                archive.download(['md5'])
+                download_fn.assert_called_once()
+                self.assertEqual(cache.stats()['archives'], 1)
+
+                # Cache hit
+                archive = upt.Archive('http://example.com/source.tar.gz')
+                self.assertEqual(archive.md5,
+                                 '3858f62230ac3c915f300c664312c63f')
+                self.assertEqual(archive.size, 6)
+                download_fn.assert_called_once()
+
+                # Checksums computed later are added to the cache.
+                self.assertEqual(archive.sha512[:16], '0a50261ebd1a390f')
+                entry = cache.lookup('http://example.com/source.tar.gz')
+                self.assertEqual(entry.hashes['sha512'][:16],
+                                 '0a50261ebd1a390f')
+
+                # The cached archive does not match the expected checksum
+                archive = upt.Archive('http://example.com/source.tar.gz',
+                                      md5='other-md5')
+                archive.download()
+                self.assertEqual(download_fn.call_count, 2)
+
+    @staticmethod
+    def _fake_download_empty(url, filepath, hasher=None, **kwargs):
+        with open(filepath(), 'wb'):
+            pass
+        return upt.download.DownloadResult(0, {'etag': '"5678"'})
+
+    @mock.patch('upt.download.download')
+    def test_download_cache_revalidation(self, download_fn):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = upt.cache.ArchiveCache(os.path.join(tmpdir, 'cache'))
+            self.addCleanup(cache.close)
+            path = os.path.join(tmpdir, 'source.tar.gz')
+            with open(path, 'wb') as f:
+                f.write(b'foobar')
+            cache.store('http://example.com/source.tar.gz', path,
+                        {'sha256': 'sha256'}, {'etag': '"1234"'})
+            with mock.patch('upt.cache.get_archive_cache',
+                            return_value=cache):
+                # Not modified upstream: the cached archive is used.
+                download_fn.side_effect = upt.download.NotModified('url')
+                archive = upt.Archive('http://example.com/source.tar.gz')
+                self.assertEqual(archive.sha256, 'sha256')
+                self.assertEqual(archive.size, 6)
+                headers = download_fn.call_args[1]['headers']
+                self.assertEqual(headers, {'If-None-Match': '"1234"'})
+
+                # Modified upstream: the new archive is cached.
+                download_fn.side_effect = self._fake_download_empty
+                archive = upt.Archive('http://example.com/source.tar.gz')
+                self.assertEqual(archive.sha256,
+                                 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855')  # noqa
+                entry = cache.lookup('http://example.com/source.tar.gz')
+                self.assertEqual(entry.validators, {'etag': '"5678"'})
+
+    @mock.patch('upt.download.download')
+    def test_download_cache_evicted(self, download_fn):
+        # Another process evicts the archive right after it was looked up.
+        def lookup(cache, url, known_hashes=None):
+            entry = lookup_fn(cache, url, known_hashes)
+            if entry is not None:
+                os.remove(entry.path)
+            return entry
+        lookup_fn = upt.cache.ArchiveCache.lookup
+        url = 'http://example.com/source.tar.gz'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = upt.cache.ArchiveCache(os.path.join(tmpdir, 'cache'))
+            self.addCleanup(cache.close)
+            path = os.path.join(tmpdir, 'source.tar.gz')
+            with open(path, 'wb') as f:
+                f.write(b'foobar')
+            with mock.patch('upt.cache.get_archive_cache',
+                            return_value=cache), \
+                    mock.patch('upt.cache.ArchiveCache.lookup', lookup):
+                # The cached archive is downloaded again.
+                cache.store(url, path, {'sha256': 'sha256'})
+                download_fn.side_effect = self._fake_download
+                archive = upt.Archive(url)
+                self.assertEqual(archive.md5,
+                                 '3858f62230ac3c915f300c664312c63f')
+                download_fn.assert_called_once()
+                self.assertEqual(download_fn.call_args[1]['headers'], {})
+
+                # Even if it was not modified upstream.
+                cache.store(url, path, {'sha256': 'sha256'},
+                            {'etag': '"1234"'})
+
+                def download(url, filepath, hasher=None, headers=None,
+                             **kwargs):
+                    if headers:
+                        raise upt.download.NotModified(url)
+                    return self._fake_download(url, filepath, hasher)
+                download_fn.reset_mock()
+                download_fn.side_effect = download
+                archive = upt.Archive(url)
+                self.assertEqual(archive.md5,
+                                 '3858f62230ac3c915f300c664312c63f')
+                self.assertEqual(download_fn.call_count, 2)
+
+    @mock.patch('upt.download.download')
+    def test_download_verify(self, download_fn):
+        download_fn.side_effect = self._fake_download
+        archive = upt.Archive('http://example.com/source.tar.gz', size=6)
+        archive.sha256 = 'sha256'
+        archive.download(['md5'])
+        kwargs = download_fn.call_args[1]
+        self.assertEqual(kwargs['expected_size'], 6)
+        self.assertEqual(kwargs['expected_hashes'], {'sha256': 'sha256'})
+        hasher = download_fn.call_args[0][2]
+        self.assertEqual(hasher.hash_names, {'md5', 'sha256'})
+        self.assertEqual(archive.sha256, 'sha256')
+
+        archive = upt.Archive('http://example.com/source.tar.gz', size=6,
+                              sha256='sha256')
+        archive.download(['md5'], verify=False)
+        kwargs = download_fn.call_args[1]
+        self.assertIsNone(kwargs['expected_size'])
+        self.assertEqual(kwargs['expected_hashes'], {})
+
+    @mock.patch('upt.download.download')
+    def test_download_verify_failure(self, download_fn):
+        download_fn.side_effect = upt.ChecksumMismatch('url', 'md5', 'a', 'b')
+        archive = upt.Archive('http://example.com/source.tar.gz', md5='a')
+        with self.assertRaises(upt.ChecksumMismatch):
+            archive.download()
+        self.assertIsNone(archive._filepath)
+
+    @mock.patch('upt.checksum.compute_checksum')
+    @mock.patch('upt.download.download')
+    def test_download_in_memory(self, download_fn, compute_checksum_fn):
+        download_fn.return_value = upt.download.DownloadResult(6, {},
+                                                               b'foobar')
         archive = upt.Archive('http://example.com/source.tar.gz')
-        self.assertEqual(archive._checksum('fake-hash'), 'hash-output')
-        self.assertEqual(archive._checksum('fake-hash'), 'hash-output')
-        urlretrieve_fn.assert_called_once()
-        compute_checksum_fn.assert_called_once()
+        archive.download()
+        self.assertEqual(download_fn.call_args[1]['spool_max_size'],
+                         upt.Archive.spool_max_size)
+        self.assertIsNone(archive._filepath)
+        self.assertEqual(archive.size, 6)
+        self.assertEqual(archive.md5, '3858f62230ac3c915f300c664312c63f')
+        compute_checksum_fn.assert_not_called()
+        with archive.open() as f:
+            self.assertEqual(f.read(), b'foobar')
+        self.assertEqual(os.listdir(self.workspace.directory), [])
+
+        # Using the path of the archive writes it to the disk.
+        with open(archive.filepath, 'rb') as f:
+            self.assertEqual(f.read(), b'foobar')
+        self.assertEqual(len(os.listdir(self.workspace.directory)), 1)
+        self.assertFalse(os.path.exists(archive.filepath + '.part'))
+        with archive.open() as f:
+            self.assertEqual(f.read(), b'foobar')
+        download_fn.assert_called_once()
+
+    @mock.patch('upt.download.download')
+    def test_clean_in_memory(self, download_fn):
+        download_fn.return_value = upt.download.DownloadResult(6, {},
+                                                               b'foobar')
+        archive = upt.Archive('http://example.com/source.tar.gz')
+        archive.download()
+        upt.Package('foo', '1.0', archives=[archive])._clean()
+        self.assertIsNone(archive._data)
 
     @mock.patch('upt.checksum.compute_checksum', return_value='hash-output')
     def test_checksums_provided(self, compute_checksum_fn):
@@ -558,6 +1224,14 @@ class TestRecursion(unittest.TestCase):
         self.backend.create_package.assert_called_once()
         self.backend.needs_requirement.assert_not_called()
 
+    def test_backend_checksums(self):
+        self.package.archives = [upt.Archive('url')]
+        self.backend.checksums = ('md5', 'sha256')
+        upt.upt.package('foo', None, self.frontend, self.backend,
+                        None, False, [])
+        self.assertEqual(self.package.archives[0].wanted_hashes,
+                         {'md5', 'sha256'})
+
     def test_recursion_disabled(self):
         self.package.requirements = {
             'run': [upt.PackageRequirement('bar')]
@@ -568,6 +1242,259 @@ class TestRecursion(unittest.TestCase):
         self.backend.needs_requirement.assert_not_called()
 
 
+class TestAuditLicenses(unittest.TestCase):
+    def setUp(self):
+        self.packages = {
+            'foo': upt.Package('foo', '42', licenses=[
+                upt.licenses.MITLicense()],
+                requirements={'run': [upt.PackageRequirement('bar')],
+                              'test': [upt.PackageRequirement('baz')]}),
+            'bar': upt.Package('bar', '1.0', licenses=[
+                upt.licenses.AladdinFreePublicLicense()],
+                requirements={'run': [upt.PackageRequirement('foo'),
+                                      upt.PackageRequirement('qux')]}),
+            'baz': upt.Package('baz', '2.0'),
+        }
+        self.frontend = mock.Mock()
+        self.frontend.parse.side_effect = self._parse
+        self.policy = upt.licenses.Policy('dfsg and gpl')
+
+    def _parse(self, name, version):
+        try:
+            return self.packages[name]
+        except KeyError:
+            raise upt.exceptions.InvalidPackageNameError('frontend', name)
+
+    def test_not_recursive(self):
+        results = upt.upt.audit_licenses('foo', None, self.frontend,
+                                         self.policy)
+        self.assertEqual(list(results), [])
+        self.frontend.parse.assert_called_once_with('foo', None)
+
+    def test_recursive(self):
+        results = list(upt.upt.audit_licenses('foo', '42', self.frontend,
+                                              self.policy, recursive=True))
+        self.assertEqual(results, [
+            (self.packages['bar'], [upt.licenses.AladdinFreePublicLicense()]),
+            (self.packages['baz'], [upt.licenses.UnknownLicense()]),
+        ])
+        self.assertEqual(self.frontend.parse.call_args_list, [
+            mock.call('foo', '42'), mock.call('bar', None),
+            mock.call('baz', None), mock.call('qux', None),
+        ])
+
+    def test_streaming(self):
+        results = upt.upt.audit_licenses('foo', None, self.frontend,
+                                         self.policy, recursive=True)
+        next(results)
+        self.assertEqual(self.frontend.parse.call_count, 2)
+
+    def test_invalid_package(self):
+        results = upt.upt.audit_licenses('qux', None, self.frontend,
+                                         self.policy)
+        with self.assertRaises(upt.exceptions.InvalidPackageNameError):
+            list(results)
+
+
+class TestRecursionGraph(unittest.TestCase):
+    def setUp(self):
+        self.requirements = {
+            'foo': ['bar', 'baz'],
+            'bar': ['qux'],
+            'baz': ['bar', 'qux'],
+            'qux': [],
+        }
+        self.frontend = mock.Mock()
+        self.frontend.parse.side_effect = self._parse
+        self.backend = mock.Mock()
+        self.backend.needs_requirement.side_effect = self._needs_requirement
+        self.created = []
+        self.backend.create_package.side_effect = (
+            lambda pkg, output: self.created.append(pkg.name))
+
+    def _parse(self, name, version):
+        return upt.Package(name, version or '1.0', requirements={
+            'run': [upt.PackageRequirement(requirement)
+                    for requirement in self.requirements[name]]
+        })
+
+    def _needs_requirement(self, requirement, phase):
+        self.assertIs(threading.current_thread(), threading.main_thread())
+        return True
+
+    def _package(self, jobs=1, packaged=None):
+        upt.upt.package('foo', None, self.frontend, self.backend, None, True,
+                        packaged, jobs=jobs)
+
+    def test_topological_order(self):
+        self._package()
+        self.assertEqual(self.created, ['qux', 'bar', 'baz', 'foo'])
+        self.assertEqual(self.frontend.parse.call_count, 4)
+
+    def test_jobs(self):
+        with mock.patch('upt.aio.run', wraps=upt.aio.run) as run_fn:
+            self._package(jobs=4)
+        run_fn.assert_called_once_with(mock.ANY, 4)
+        self.assertEqual(self.created, ['qux', 'bar', 'baz', 'foo'])
+
+    def test_concurrent_parse(self):
+        # Both requirements of foo are parsed at the same time.
+        barrier = threading.Barrier(2, timeout=5)
+
+        def parse(name, version):
+            if name in ('bar', 'baz'):
+                barrier.wait()
+            return self._parse(name, version)
+        self.frontend.parse.side_effect = parse
+        self._package(jobs=2)
+        self.assertEqual(self.created[-1], 'foo')
+
+    @mock.patch('upt.checksum.compute_many', wraps=upt.checksum.compute_many)
+    def test_archive_checksums(self, compute_many_fn):
+        # Archives that are available locally are hashed before creating
+        # packages, all at once.
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        cache = upt.cache.ArchiveCache(os.path.join(tmpdir.name, 'cache'))
+        self.addCleanup(cache.close)
+        path = os.path.join(tmpdir.name, 'bar.tar.gz')
+        with open(path, 'wb') as f:
+            f.write(b'bar')
+        cache.store('https://example.com/bar.tar.gz', path,
+                    {'sha256': hashlib.sha256(b'bar').hexdigest()})
+        path = os.path.join(tmpdir.name, 'qux.tar.gz')
+        with open(path, 'wb') as f:
+            f.write(b'qux')
+
+        def parse(name, version):
+            upt_pkg = self._parse(name, version)
+            upt_pkg.archives = [upt.Archive(f'https://example.com/'
+                                            f'{name}.tar.gz')]
+            if name == 'qux':
+                # Downloaded by the frontend
+                upt_pkg.archives[0]._filepath = path
+            return upt_pkg
+
+        def create_package(upt_pkg, output):
+            self.created.append(upt_pkg.name)
+            if upt_pkg.name == 'qux':
+                self.assertEqual(upt_pkg.archives[0]._hashes,
+                                 {'md5': hashlib.md5(b'qux').hexdigest()})
+        self.frontend.parse.side_effect = parse
+        self.backend.checksums = ['md5']
+        self.backend.create_package.side_effect = create_package
+        with mock.patch('upt.cache.get_archive_cache', return_value=cache):
+            self._package(jobs=2)
+        self.assertEqual(self.created, ['qux', 'bar', 'baz', 'foo'])
+        self.assertEqual(compute_many_fn.call_count, 2)
+        entry = cache.lookup('https://example.com/bar.tar.gz')
+        self.assertEqual(entry.hashes['md5'], hashlib.md5(b'bar').hexdigest())
+
+    def test_cycle(self):
+        self.requirements['qux'] = ['foo']
+        self._package()
+        self.assertEqual(sorted(self.created), ['bar', 'baz', 'foo', 'qux'])
+        self.assertEqual(self.created[0], 'foo')
+
+    def test_packaged(self):
+        self._package(packaged=['bar'])
+        self.assertEqual(self.created, ['qux', 'baz', 'foo'])
+        # The default value of "packaged" is not shared between calls.
+        self.created.clear()
+        self._package()
+        self._package()
+        self.assertEqual(self.created, ['qux', 'bar', 'baz', 'foo'] * 2)
+
+    def test_parse_error(self):
+        def parse(name, version):
+            if name == 'qux':
+                raise upt.exceptions.InvalidPackageNameError('frontend', name)
+            return self._parse(name, version)
+        self.frontend.parse.side_effect = parse
+        with mock.patch('upt.Package._clean') as clean_fn:
+            with self.assertRaises(SystemExit):
+                self._package()
+        self.assertEqual(self.created, [])
+        self.assertEqual(clean_fn.call_count, 3)
+
+    def test_create_error(self):
+        def create_package(pkg, output):
+            raise upt.exceptions.UnhandledFrontendError('backend', 'frontend')
+        self.backend.create_package.side_effect = create_package
+        with mock.patch('upt.Package._clean') as clean_fn:
+            with self.assertRaises(SystemExit):
+                self._package()
+        self.backend.create_package.assert_called_once()
+        self.assertEqual(clean_fn.call_count, 4)
+
+
+class TestRecursionAsync(unittest.TestCase):
+    def setUp(self):
+        self.requirements = {
+            'foo': ['bar', 'baz'],
+            'bar': [],
+            'baz': ['bar'],
+        }
+        self.created = []
+        test = self
+
+        class AsyncFrontend(upt.Frontend):
+            name = 'async-frontend'
+
+            def parse(self, name, version=None):
+                raise AssertionError('parse_async() should be used')
+
+            async def parse_async(self, name, version=None):
+                await asyncio.sleep(0)
+                return upt.Package(name, '1.0', requirements={
+                    'run': [upt.PackageRequirement(requirement)
+                            for requirement in test.requirements[name]]
+                })
+
+        class AsyncBackend(upt.Backend):
+            name = 'async-backend'
+
+            def package_versions(self, name):
+                raise AssertionError('package_versions_async() should be '
+                                     'used')
+
+            async def package_versions_async(self, name):
+                return []
+
+            async def create_package_async(self, upt_pkg, output=None):
+                test.created.append(upt_pkg.name)
+
+        self.frontend = AsyncFrontend()
+        self.backend = AsyncBackend()
+
+    def test_async_hooks(self):
+        upt.upt.package('foo', None, self.frontend, self.backend, None, True,
+                        jobs=2)
+        self.assertEqual(self.created, ['bar', 'baz', 'foo'])
+
+    def test_sync_backend(self):
+        backend = mock.Mock()
+        backend.needs_requirement.return_value = True
+        backend.create_package.side_effect = (
+            lambda pkg, output: self.created.append(pkg.name))
+        upt.upt.package('foo', None, self.frontend, backend, None, True)
+        self.assertEqual(self.created, ['bar', 'baz', 'foo'])
+        self.assertEqual(backend.needs_requirement.call_count, 2)
+
+    def test_update(self):
+        async def current_version_async(frontend, pkgname, output=None):
+            return '0.9'
+        diffs = []
+
+        async def update_package_async(pdiff, output=None):
+            diffs.append(pdiff)
+        self.backend.current_version_async = current_version_async
+        self.backend.update_package_async = update_package_async
+        upt.upt.update('foo', None, self.frontend, self.backend, None)
+        self.assertEqual(len(diffs), 1)
+        self.assertEqual(diffs[0].old_version, '1.0')
+
+
 class TestBackend(unittest.TestCase):
     def setUp(self):
         self.backend = upt.upt.Backend()
@@ -639,6 +1566,162 @@ class TestBackend(unittest.TestCase):
             self.backend.needs_requirement_interactive.assert_called()
 
 
+class FakePackage(upt.Package):
+    def __init__(self, name):
+        super().__init__(name, '1.0')
+        self.extra = {'foo': [1, 2]}
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        cache = upt.cache.MetadataCache(os.path.join(tmpdir.name, 'db'))
+        self.addCleanup(cache.close)
+        upt.cache.set_metadata_cache(cache)
+        self.addCleanup(upt.cache.set_metadata_cache, None)
+        self.package = FakePackage('foo')
+        self.package.homepage = 'https://example.com'
+        self.package.requirements = {
+            'run': [upt.PackageRequirement('bar', '>=1.0'),
+                    upt.PackageRequirement('baz')],
+        }
+        self.package.licenses = [upt.licenses.MITLicense(),
+                                 upt.licenses.UnknownLicense()]
+        archive = upt.Archive('https://example.com/foo.tar.gz', size=42,
+                              sha256='sha256')
+        archive.md5 = 'md5'
+        self.package.archives = [archive]
+        self.frontend = mock.Mock()
+        self.frontend.name = 'fake-frontend'
+        self.frontend.parse.return_value = self.package
+
+    def test_serialization(self):
+        data = upt.upt._package_to_dict(self.package)
+        json.dumps(data)
+        upt_pkg = upt.upt._package_from_dict(data)
+        self.assertIsInstance(upt_pkg, FakePackage)
+        self.assertEqual(str(upt_pkg), 'foo@1.0')
+        self.assertEqual(upt_pkg.homepage, 'https://example.com')
+        self.assertEqual(upt_pkg.extra, {'foo': [1, 2]})
+        self.assertEqual(upt_pkg.requirements, self.package.requirements)
+        self.assertEqual(upt_pkg.licenses, self.package.licenses)
+        archive = upt_pkg.archives[0]
+        self.assertEqual(archive.url, 'https://example.com/foo.tar.gz')
+        self.assertEqual(archive.archive_type, upt.ArchiveType.SOURCE_TARGZ)
+        self.assertEqual(archive._expected_size, 42)
+        self.assertEqual(archive._expected_hashes,
+                         {'md5': 'md5', 'sha256': 'sha256'})
+
+    def test_unknown_class(self):
+        data = upt.upt._package_to_dict(self.package)
+        data['class'] = 'upt_removed_frontend:Package'
+        self.assertIs(type(upt.upt._package_from_dict(data)), upt.Package)
+
+    def test_parse_package(self):
+        for _ in range(2):
+            upt_pkg = upt.upt.parse_package(self.frontend, 'foo', None)
+            self.assertEqual(upt_pkg.requirements,
+                             self.package.requirements)
+        self.frontend.parse.assert_called_once_with('foo', None)
+        # The latest version is also cached as a pinned version.
+        upt.upt.parse_package(self.frontend, 'foo', '1.0')
+        self.frontend.parse.assert_called_once_with('foo', None)
+
+        upt.cache.set_metadata_cache(None)
+        upt.upt.parse_package(self.frontend, 'foo', None)
+        self.assertEqual(self.frontend.parse.call_count, 2)
+
+    def test_parse_package_async(self):
+        for _ in range(2):
+            upt_pkg = upt.aio.run(upt.upt.parse_package_async(
+                self.frontend, 'foo', '1.0'))
+            self.assertEqual(str(upt_pkg), 'foo@1.0')
+        self.frontend.parse.assert_called_once_with('foo', '1.0')
+
+    def test_unserializable_package(self):
+        self.package.requirements = mock.Mock()
+        upt.upt.parse_package(self.frontend, 'foo', None)
+        upt.upt.parse_package(self.frontend, 'foo', None)
+        self.assertEqual(self.frontend.parse.call_count, 2)
+
+    def test_invalid_cached_metadata(self):
+        upt.upt.parse_package(self.frontend, 'foo', '1.0')
+        cache = upt.cache.get_metadata_cache()
+        data = cache.lookup('fake-frontend', 'foo', '1.0')
+        invalid = [
+            None,
+            [],
+            {**data, 'format': upt.upt._METADATA_FORMAT + 1},
+            {**data, 'frontend_version': '0.1'},
+            {**data, 'package': {**data['package'],
+                                 'archives': [{'url': 'url',
+                                               'type': 'SOURCE_ZIP'}]}},
+            {k: v for k, v in data.items() if k != 'package'},
+        ]
+        package = dict(data['package'])
+        del package['requirements']
+        invalid.append({**data, 'package': package})
+        for i, value in enumerate(invalid, start=2):
+            with self.subTest(value=value):
+                cache.store('fake-frontend', 'foo', '1.0', value)
+                upt_pkg = upt.upt.parse_package(self.frontend, 'foo', '1.0')
+                self.assertIs(upt_pkg, self.package)
+                self.assertEqual(self.frontend.parse.call_count, i)
+
+        # Undecodable rows are ignored as well.
+        with cache._db:
+            cache._db.execute("UPDATE metadata SET data = x'00'")
+        upt.upt.parse_package(self.frontend, 'foo', '1.0')
+        self.assertEqual(self.frontend.parse.call_count, len(invalid) + 2)
+
+    def test_frontend_version(self):
+        with mock.patch('upt.upt._plugin_version', return_value='1.0'):
+            upt.upt.parse_package(self.frontend, 'foo', '1.0')
+            upt.upt.parse_package(self.frontend, 'foo', '1.0')
+        self.frontend.parse.assert_called_once()
+        # Upgrading the frontend invalidates the cache.
+        with mock.patch('upt.upt._plugin_version', return_value='2.0'):
+            upt.upt.parse_package(self.frontend, 'foo', '1.0')
+        self.assertEqual(self.frontend.parse.call_count, 2)
+
+    def test_unserializable_attribute(self):
+        class FakeArchive(upt.Archive):
+            pass
+
+        class FakeRequirement(upt.PackageRequirement):
+            pass
+
+        values = [
+            ('released', datetime.date(2021, 1, 1)),
+            ('keywords', {'foo', 'bar'}),
+            ('platforms', ('linux', 'macos')),
+            ('archives', [FakeArchive('https://example.com/foo.tar.gz')]),
+            ('requirements', {'run': [FakeRequirement('bar')]}),
+        ]
+        for attr, value in values:
+            with self.subTest(attr=attr):
+                self.frontend.parse.reset_mock()
+                upt_pkg = FakePackage('foo')
+                setattr(upt_pkg, attr, value)
+                self.frontend.parse.return_value = upt_pkg
+                with self.assertRaises(TypeError):
+                    upt.upt._package_to_dict(upt_pkg)
+                for _ in range(2):
+                    self.assertEqual(getattr(upt.upt.parse_package(
+                        self.frontend, 'foo', None), attr), value)
+                self.assertEqual(self.frontend.parse.call_count, 2)
+
+    def test_update(self):
+        backend = mock.Mock(checksums=())
+        backend.current_version.return_value = '0.9'
+        upt.upt.update('foo', '1.0', self.frontend, backend, None)
+        upt.upt.update('foo', '1.0', self.frontend, backend, None)
+        self.assertEqual(self.frontend.parse.call_args_list, [
+            mock.call('foo', '0.9'), mock.call('foo', '1.0'),
+        ])
+
+
 class TestUpdate(unittest.TestCase):
     def test_update_already_up_to_date(self):
         frontend = mock.Mock()
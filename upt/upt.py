@@ -2,22 +2,38 @@
 #
 # Licensed under the 3-clause BSD license. See the LICENSE file.
 import argparse
+import asyncio
+import atexit
+import collections
+import concurrent.futures
 from enum import Enum
+import importlib
+import io
+import json
 import logging
 import os
-import urllib.request
+import shutil
 import sys
 import tempfile
+import threading
+import zlib
 
 from packaging.specifiers import SpecifierSet
-import pkg_resources
-
+import upt.aio
+import upt.cache
 import upt.checksum
+import upt.download
 import upt.exceptions
+import upt.licenses
 import upt.log
 
 
 class Backend(object):
+    # Names of the checksums of the archives (such as 'sha256') used by this
+    # backend. They are all computed in a single pass over an archive, the
+    # first time one of its checksums is needed.
+    checksums = ()
+
     def current_version(self, frontend, pkgname, output=None):
         """Return the currently packaged version of a package.
 
@@ -41,11 +57,14 @@ class Backend(object):
                 continue  # pragma: nocover
 
     def needs_requirement(self, req, phase):
-        logger = logging.getLogger('upt')
         if not hasattr(self, 'package_versions'):
             return self.needs_requirement_interactive(req, phase)
 
         versions = self.package_versions(req.name)
+        return self._needs_version(req, versions)
+
+    def _needs_version(self, req, versions):
+        logger = logging.getLogger('upt')
         if not versions:
             logger.info(f'Dependency {req}: currently not packaged. '
                         f'Packaging it.')
@@ -92,20 +111,90 @@ class ArchiveUnavailable(Exception):
         return 'No such archive could be found'
 
 
+class Workspace(object):
+    """A private working directory, in which archives are downloaded.
+
+    The workspace is a directory with a unique name, so that concurrent runs
+    of upt never share files. Every file gets its own subdirectory, so that
+    archives with the same filename, possibly handled by different threads,
+    do not overwrite each other either.
+
+    directory: the directory in which the workspace is created; defaults to
+               the system's temporary directory.
+    """
+    def __init__(self, directory=None):
+        self.directory = tempfile.mkdtemp(prefix='upt-', dir=directory)
+
+    def path(self, filename):
+        """Return a new path for a file named FILENAME."""
+        return os.path.join(tempfile.mkdtemp(dir=self.directory), filename)
+
+    def cleanup(self):
+        """Remove the workspace and all the files it contains."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
+
+
+_workspace = None
+_workspace_lock = threading.Lock()
+
+
+def get_workspace():
+    """Return the Workspace used by upt.Archive.
+
+    If none was set using set_workspace(), a workspace is created, and
+    removed when the interpreter exits.
+    """
+    global _workspace
+    with _workspace_lock:
+        if _workspace is None:
+            _workspace = Workspace()
+            atexit.register(_workspace.cleanup)
+        return _workspace
+
+
+def set_workspace(workspace):
+    """Make upt.Archive use WORKSPACE (a Workspace, or None)."""
+    global _workspace
+    with _workspace_lock:
+        _workspace = workspace
+
+
 class Archive(object):
     '''An archive file.
 
     This can be a source tarball, a Python wheel, a Ruby gem, a binary, etc.
+
+    Archives are downloaded lazily. Small archives (no bigger than
+    spool_max_size bytes) are kept in memory, and only written to the disk if
+    the filepath attribute is used: backends that only need checksums, or
+    that read the archive using open(), never touch the disk.
     '''
+    spool_max_size = 512 * 1024
+
     def __init__(self, url, archive_type=ArchiveType.SOURCE_TARGZ, size=0,
                  md5=None, sha256=None, rmd160=None, sha256_base64=None,
                  sha512=None):
         self.url = url
         self.archive_type = archive_type
         self._size = size
+        # Size and checksums given by the frontend, checked when downloading
+        self._expected_size = size or None
+        self._expected_hashes = {}
         self._filepath = None  # Absolute path on the local filesystem
+        self._data = None  # Content of the archive, if kept in memory
         self._filename = None  # Filename on the local filesystem
         self._hashes = {}
+        # Checksums computed along with any other one, see Backend.checksums
+        self.wanted_hashes = set()
+        self._lock = threading.RLock()  # Protects downloads
+        # Size announced by the server while downloading the archive
+        self._content_length = None
         if md5 is not None:
             self.md5 = md5
         if sha256 is not None:
@@ -119,30 +208,220 @@ class Archive(object):
 
     @property
     def filepath(self):
-        if self._filepath is None:
-            self._filepath = os.path.join(tempfile.gettempdir(), self.filename)
-            urllib.request.urlretrieve(self.url, filename=self._filepath)
+        with self._lock:
+            if self._filepath is None:
+                if self._data is None:
+                    self.download()
+                if self._data is not None:
+                    filepath = get_workspace().path(self.filename)
+                    with open(f'{filepath}.part', 'wb') as f:
+                        f.write(self._data)
+                    os.replace(f'{filepath}.part', filepath)
+                    self._filepath = filepath
+                    self._data = None
         return self._filepath
 
+    def open(self):
+        """Return a binary file object to read the archive.
+
+        Archives kept in memory are read from memory. The members of an
+        archive may be inspected without writing it to the disk, for
+        instance using tarfile.open(fileobj=archive.open()).
+        """
+        with self._lock:
+            if not self._downloaded():
+                self.download()
+            if self._data is not None:
+                return io.BytesIO(self._data)
+            return open(self._filepath, 'rb')
+
+    def _downloaded(self):
+        return self._filepath is not None or self._data is not None
+
+    def download(self, hash_names=(), verify=True):
+        """Download the archive, computing checksums on the fly.
+
+        hash_names: the names of the checksums (such as 'md5' or 'sha256')
+                    that should be computed while downloading the archive.
+                    Checksums that are already known are not computed again.
+        verify: whether the size and the checksums given by the frontend
+                should be checked while downloading the archive. If they do
+                not match, upt.download.SizeMismatch or
+                upt.download.ChecksumMismatch is raised, and the archive is
+                not kept.
+
+        The checksums listed in the wanted_hashes attribute are computed as
+        well. Backends that need several checksums should list them in
+        Backend.checksums, or call this method before accessing them, so
+        that the archive is only read once.
+        """
+        wanted_hashes = {hash_name for hash_name in self.wanted_hashes
+                         if upt.checksum.is_available(hash_name)}
+        with self._lock:
+            self._download(set(hash_names) | wanted_hashes, verify)
+
+    def _download(self, hash_names, verify=True):
+        self._hashes.update(upt.checksum.derive_checksums(self._hashes,
+                                                          hash_names))
+        hash_names = hash_names - self._hashes.keys()
+        if self._downloaded():
+            # Already downloaded: we have no choice but to read the archive.
+            self._compute_hashes(hash_names)
+            return
+
+        filepath = None
+
+        def get_filepath():
+            # Archives kept in memory do not need a directory in the
+            # workspace.
+            nonlocal filepath
+            if filepath is None:
+                filepath = get_workspace().path(self.filename)
+            return filepath
+
+        cache = upt.cache.get_archive_cache()
+        entry = None
+        headers = {}
+        if cache is not None:
+            entry = cache.lookup(self.url, self._hashes)
+            if entry is not None:
+                # Archives that were served along with validators are
+                # revalidated: this only costs a "304 Not Modified" if the
+                # archive did not change upstream.
+                headers = upt.download.conditional_headers(entry.validators)
+                if not headers and self._use_cached_archive(
+                        entry, get_filepath(), hash_names):
+                    return
+            # The cache indexes archives by their sha256 checksum.
+            hash_names.add('sha256')
+
+        expected_hashes = {}
+        expected_size = None
+        if verify:
+            expected_hashes = {
+                hash_name: value
+                for hash_name, value in self._expected_hashes.items()
+                if upt.checksum.is_available(hash_name)
+            }
+            expected_size = self._expected_size
+        hasher = upt.checksum.Hasher(hash_names | expected_hashes.keys())
+
+        def download(headers):
+            return upt.download.download(self.url, get_filepath, hasher,
+                                         headers=headers,
+                                         size_callback=self._set_length,
+                                         expected_size=expected_size,
+                                         expected_hashes=expected_hashes,
+                                         spool_max_size=self.spool_max_size)
+        try:
+            result = download(headers)
+        except upt.download.NotModified:
+            if self._use_cached_archive(entry, get_filepath(), hash_names):
+                return
+            result = download({})
+        if result.data is None:
+            self._filepath = filepath
+        else:
+            self._data = result.data
+        hashes = hasher.hexdigests()
+        for hash_name, value in hashes.items():
+            self._hashes.setdefault(hash_name, value)
+        if self._size == 0:
+            self._size = result.size
+        if cache is not None:
+            cache.store(self.url, filepath, hashes, result.validators,
+                        result.data)
+
+    def _use_cached_archive(self, entry, filepath, hash_names):
+        """Use the cached archive described by ENTRY, a CachedArchive.
+
+        Return False if it was evicted from the cache (maybe by another upt
+        process) since it was looked up, in which case it should be
+        downloaded again.
+        """
+        try:
+            upt.cache.link_or_copy(entry.path, f'{filepath}.part')
+        except FileNotFoundError:
+            return False
+        os.replace(f'{filepath}.part', filepath)
+        self._filepath = filepath
+        self._size = entry.size
+        self._hashes.update(entry.hashes)
+        self._compute_hashes(hash_names)
+        return True
+
+    def _compute_hashes(self, hash_names):
+        """Compute the missing HASH_NAMES of a downloaded archive at once."""
+        hash_names = hash_names - self._hashes.keys()
+        if not hash_names:
+            return
+        if self._data is not None:
+            hasher = upt.checksum.Hasher(hash_names)
+            hasher.update(self._data)
+            hashes = hasher.hexdigests()
+        else:
+            # Files in the workspace do not outlive this run: the checksums
+            # are remembered by the archive cache instead.
+            hashes = upt.checksum.compute_checksums(self._filepath,
+                                                    hash_names, self._hashes,
+                                                    use_cache=False)
+        self._add_hashes(hashes)
+
+    def _add_hashes(self, hashes):
+        for hash_name, value in hashes.items():
+            self._hashes.setdefault(hash_name, value)
+        cache = upt.cache.get_archive_cache()
+        if cache is not None and hashes and 'sha256' in self._hashes:
+            cache.add_hashes(self.url, {'sha256': self._hashes['sha256'],
+                                        **hashes})
+
     @property
     def filename(self):
         if self._filename is None:
             self._filename = os.path.basename(self.url)
         return self._filename
 
+    def _set_length(self, content_length):
+        self._content_length = content_length
+
     @property
     def size(self):
         if self._size == 0:
-            self._size = os.stat(self.filepath).st_size
+            self._size = (self._remote_size() or
+                          os.stat(self.filepath).st_size)
         return self._size
 
+    def _remote_size(self):
+        """Try and find the size of the archive without downloading it."""
+        if self._data is not None:
+            return len(self._data)
+        if self._filepath is not None:
+            return None
+        if self._content_length is not None:
+            # The archive is being downloaded.
+            return self._content_length
+        cache = upt.cache.get_archive_cache()
+        if cache is not None:
+            entry = cache.lookup(self.url, self._hashes)
+            if entry is not None:
+                return entry.size
+        return upt.download.remote_size(self.url)
+
     def _checksum(self, hash_name):
         try:
             return self._hashes[hash_name]
         except KeyError:
-            value = upt.checksum.compute_checksum(self.filepath, hash_name)
-            self._hashes[hash_name] = value
-            return value
+            pass
+        with self._lock:
+            self._hashes.update(upt.checksum.derive_checksums(self._hashes,
+                                                              [hash_name]))
+            if hash_name not in self._hashes:
+                self.download([hash_name])
+            return self._hashes[hash_name]
+
+    def _set_expected_checksum(self, hash_name, value):
+        self._hashes[hash_name] = value
+        self._expected_hashes[hash_name] = value
 
     @property
     def md5(self):
@@ -150,7 +429,7 @@ class Archive(object):
 
     @md5.setter
     def md5(self, value):
-        self._hashes['md5'] = value
+        self._set_expected_checksum('md5', value)
 
     @property
     def rmd160(self):
@@ -158,7 +437,7 @@ class Archive(object):
 
     @rmd160.setter
     def rmd160(self, value):
-        self._hashes['rmd160'] = value
+        self._set_expected_checksum('rmd160', value)
 
     @property
     def sha256(self):
@@ -166,7 +445,7 @@ class Archive(object):
 
     @sha256.setter
     def sha256(self, value):
-        self._hashes['sha256'] = value
+        self._set_expected_checksum('sha256', value)
 
     @property
     def sha256_base64(self):
@@ -174,7 +453,7 @@ class Archive(object):
 
     @sha256_base64.setter
     def sha256_base64(self, value):
-        self._hashes['sha256_base64'] = value
+        self._set_expected_checksum('sha256_base64', value)
 
     @property
     def sha512(self):
@@ -182,7 +461,7 @@ class Archive(object):
 
     @sha512.setter
     def sha512(self, value):
-        self._hashes['sha512'] = value
+        self._set_expected_checksum('sha512', value)
 
 
 class PackageRequirement(object):
@@ -254,10 +533,71 @@ class Package(object):
         else:
             raise ArchiveUnavailable()
 
+    def prefetch_archives(self, types=None, digests=(), max_workers=4):
+        """Download archives concurrently, computing checksums on the fly.
+
+        types: an iterable of ArchiveType values; only the archives of these
+               types are downloaded. By default, all archives are downloaded.
+        digests: the names of the checksums to compute while downloading, see
+                 Archive.download.
+        max_workers: the maximal number of simultaneous downloads.
+
+        Backends may call this method before generating a package definition,
+        so that they do not have to wait for downloads in the middle of it.
+        The checksums of archives that were already downloaded are computed
+        concurrently as well.
+        """
+        archives = [archive for archive in self.archives
+                    if types is None or archive.archive_type in types]
+        downloaded = [archive for archive in archives
+                      if archive._filepath is not None]
+        if downloaded:
+            self._compute_checksums(downloaded, digests, max_workers)
+        archives = [archive for archive in archives
+                    if archive._filepath is None]
+        if not archives:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(archive.download, digests)
+                       for archive in archives]
+            for future in futures:
+                future.result()
+
+    @staticmethod
+    def _compute_checksums(archives, digests, max_workers):
+        hash_names = set(digests)
+        for archive in archives:
+            hash_names.update(hash_name
+                              for hash_name in archive.wanted_hashes
+                              if upt.checksum.is_available(hash_name))
+        hash_names = {hash_name for hash_name in hash_names
+                      if any(hash_name not in archive._hashes
+                             for archive in archives)}
+        if not hash_names:
+            return
+        results = upt.checksum.compute_many(
+            [archive._filepath for archive in archives], hash_names,
+            max_workers,
+            {archive._filepath: archive._hashes for archive in archives},
+            use_cache=False)
+        for archive in archives:
+            archive._add_hashes(results[archive._filepath])
+
+    def _want_checksums(self, hash_names):
+        for archive in self.archives:
+            archive.wanted_hashes.update(hash_names)
+
     def _clean(self):
         for archive in self.archives:
+            archive._data = None
             if archive._filepath is not None:
                 os.remove(archive._filepath)
+                try:
+                    # The directory created for this archive by the
+                    # workspace.
+                    os.rmdir(os.path.dirname(archive._filepath))
+                except OSError:
+                    pass
 
 
 class PackageDiff(object):
@@ -301,6 +641,16 @@ class PackageDiff(object):
         ]
 
 
+def _positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'invalid positive integer: {value}')
+    return number
+
+
 def create_parser(frontends, backends):
     parser = argparse.ArgumentParser(prog='upt')
 
@@ -314,6 +664,71 @@ def create_parser(frontends, backends):
     subparsers.add_parser('list-frontends',
                           help='List installed frontends')
 
+    # Manage the caches of archives, checksums, license guesses and metadata
+    parser_cache = subparsers.add_parser('cache',
+                                         help='Manage the caches')
+    cache_subparsers = parser_cache.add_subparsers(title='Cache commands',
+                                                   dest='cache_cmd')
+    cache_subparsers.required = True
+    cache_subparsers.add_parser('stats', help='Show cache statistics')
+    parser_cache_prune = cache_subparsers.add_parser(
+        'prune', help='Evict the least recently used archives, the checksums '
+                      'of modified files and expired metadata')
+    parser_cache_prune.add_argument('--max-size', type=upt.cache.parse_size,
+                                    default=upt.cache.DEFAULT_MAX_SIZE,
+                                    help='Maximal size of the archive cache, '
+                                         'such as 512M or 2G (default: 1G)')
+    cache_subparsers.add_parser('clear', help='Remove all cached archives, '
+                                              'checksums, license guesses and '
+                                              'metadata')
+
+    # Check licenses
+    parser_licenses = subparsers.add_parser('licenses',
+                                            help='Check licenses')
+    licenses_subparsers = parser_licenses.add_subparsers(
+        title='Licenses commands', dest='licenses_cmd')
+    licenses_subparsers.required = True
+    parser_audit = licenses_subparsers.add_parser(
+        'audit', help='List the packages whose licenses violate a policy')
+    parser_audit.add_argument('-f', '--frontend',
+                              required=len(frontends) > 1,
+                              choices=frontends,
+                              default=frontends[0] if frontends else None,
+                              help='Frontend to use')
+    parser_audit.add_argument('-p', '--policy', type=upt.licenses.Policy,
+                              default=upt.licenses.Policy('dfsg and gpl'),
+                              help='Policy the licenses must comply with, '
+                                   'combining osi, gpl, dfsg and known with '
+                                   'and, or, not and parentheses (default: '
+                                   '"dfsg and gpl")')
+    parser_audit.add_argument('-r', '--recursive', action='store_true',
+                              help='Also check the requirements, '
+                                   'recursively')
+    parser_audit.add_argument('-c', '--color', action='store_true',
+                              help='Show colored logging output')
+    parser_audit.add_argument('--debug', action='store_const',
+                              const=logging.DEBUG, dest='log_level',
+                              default=logging.ERROR,
+                              help='Print debug messages.')
+    parser_audit.add_argument('--no-cache', action='store_false',
+                              dest='cache',
+                              help='Do not use the caches of archives, '
+                                   'checksums, license guesses and '
+                                   'metadata')
+    parser_audit.add_argument('--cache-max-size', type=upt.cache.parse_size,
+                              default=upt.cache.DEFAULT_MAX_SIZE,
+                              help='Maximal size of the archive cache, '
+                                   'such as 512M or 2G (default: 1G)')
+    parser_audit.add_argument('--metadata-ttl',
+                              type=upt.cache.parse_duration,
+                              default=upt.cache.DEFAULT_METADATA_TTL,
+                              help='How long the metadata of the latest '
+                                   'version of a package is cached, such as '
+                                   '30m or 2d (default: 6h)')
+    parser_audit.add_argument('package', help='Name of the package. '
+                                              'Use <package>@<version> to '
+                                              'check a specific version.')
+
     # Actually package software
     parser_package = subparsers.add_parser('package',
                                            help='Package a piece of software')
@@ -341,10 +756,30 @@ def create_parser(frontends, backends):
                               help='Suppress all logging output')
     parser_package.add_argument('-r', '--recursive', action='store_true',
                                 help='Recursively package requirements'),
+    parser_package.add_argument('-j', '--jobs', type=_positive_int,
+                                default=1,
+                                help='Number of packages to parse or create '
+                                     'at the same time, when packaging '
+                                     'recursively (default: 1)')
     parser_package.add_argument('-c', '--color', action='store_true',
                                 help='Show colored logging output'),
     parser_package.add_argument('-u', '--update', action='store_true',
                                 help='Update package'),
+    parser_package.add_argument('--no-cache', action='store_false',
+                                dest='cache',
+                                help='Do not use the caches of archives, '
+                                     'checksums, license guesses and '
+                                     'metadata')
+    parser_package.add_argument('--cache-max-size', type=upt.cache.parse_size,
+                                default=upt.cache.DEFAULT_MAX_SIZE,
+                                help='Maximal size of the archive cache, '
+                                     'such as 512M or 2G (default: 1G)')
+    parser_package.add_argument('--metadata-ttl',
+                                type=upt.cache.parse_duration,
+                                default=upt.cache.DEFAULT_METADATA_TTL,
+                                help='How long the metadata of the latest '
+                                     'version of a package is cached, such '
+                                     'as 30m or 2d (default: 6h)')
     parser_package.add_argument('package', help='Name of the package. '
                                                 'Use <package>@<version> to '
                                                 'package a specific version.')
@@ -352,11 +787,129 @@ def create_parser(frontends, backends):
     return parser
 
 
+def _import_object(value):
+    """Import the object designated by VALUE, such as "module:Class"."""
+    module_name, _, attrs = value.partition(':')
+    obj = importlib.import_module(module_name.strip())
+    for attr in filter(None, attrs.strip().split('.')):
+        obj = getattr(obj, attr)
+    return obj
+
+
+# Version of the distribution providing each plugin class loaded by a
+# _LazyPlugin.
+_plugin_versions = {}
+
+
+def _plugin_version(plugin):
+    """Return the version of the distribution providing PLUGIN, or None."""
+    return _plugin_versions.get(type(plugin))
+
+
+class _LazyPlugin(object):
+    """A frontend or backend class, imported the first time it is used.
+
+    VALUE is the value of an entry point, such as "module:Class", and VERSION
+    the version of the distribution providing it. Calling a _LazyPlugin
+    instantiates the plugin class, just like calling the class itself would.
+    """
+    def __init__(self, value, version=None):
+        self.value = value
+        self.version = version
+        self._cls = None
+
+    def load(self):
+        if self._cls is None:
+            self._cls = _import_object(self.value)
+            _plugin_versions.setdefault(self._cls, self.version)
+        return self._cls
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+
+_PLUGIN_GROUPS = ('upt.frontends', 'upt.backends')
+
+
+def _scan_entry_points(groups):
+    """Return the (name, value, version) tuples of the entry points of each
+    group, VERSION being the version of the distribution providing them."""
+    try:
+        from importlib.metadata import distributions
+    except ImportError:  # Python < 3.8
+        import pkg_resources
+        return {group: [(ep.name, f'{ep.module_name}:{".".join(ep.attrs)}',
+                         ep.dist.version)
+                        for ep in pkg_resources.iter_entry_points(group)]
+                for group in groups}
+
+    # Entry points do not know their distribution before Python 3.10.
+    result = {group: [] for group in groups}
+    for dist in distributions():
+        for ep in dist.entry_points:
+            if ep.group in result:
+                result[ep.group].append((ep.name, ep.value, dist.version))
+    return result
+
+
+def _entry_points_key():
+    # Installing, upgrading or removing a distribution adds or removes files
+    # in one of the sys.path entries, which changes its mtime.
+    key = []
+    for path in sys.path:
+        try:
+            mtime = os.stat(path or os.curdir).st_mtime_ns
+        except OSError:
+            mtime = None
+        key.append([path, mtime])
+    return key
+
+
+# Bumped whenever the format of the cached entry points changes.
+_ENTRY_POINTS_FORMAT = 2
+
+
+def _get_entry_points(group):
+    """Return the (name, value, version) tuples of the entry points of GROUP.
+
+    The entry points of upt plugins are cached in a small JSON file stored in
+    upt.cache.cache_dir(), which is refreshed whenever sys.path, or the
+    modification time of one of its entries, changes.
+    """
+    path = os.path.join(upt.cache.cache_dir(), 'entry_points.json')
+    key = _entry_points_key()
+    try:
+        with open(path) as f:
+            index = json.load(f)
+        if index.get('format') == _ENTRY_POINTS_FORMAT and \
+                index['key'] == key:
+            return [tuple(ep) for ep in index['groups'][group]]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    groups = _scan_entry_points(_PLUGIN_GROUPS + (group,))
+    tmppath = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmppath, 'w') as f:
+            json.dump({'format': _ENTRY_POINTS_FORMAT, 'key': key,
+                       'groups': groups}, f)
+        os.replace(tmppath, path)
+    except OSError:
+        # Not being able to cache the entry points is no big deal.
+        try:
+            os.remove(tmppath)
+        except OSError:
+            pass
+    return groups[group]
+
+
 def _get_installed_plugins(entrypoint):
+    # Plugins are named after their entry point, so that listing them does not
+    # require importing them.
     plugins = {}
-    for ep in pkg_resources.iter_entry_points(entrypoint):
-        plugin_cls = ep.load()
-        plugins[plugin_cls.name] = plugin_cls
+    for name, value, version in _get_entry_points(entrypoint):
+        plugins.setdefault(name, _LazyPlugin(value, version))
 
     return plugins
 
@@ -369,39 +922,387 @@ def _get_installed_backends():
     return _get_installed_plugins('upt.backends')
 
 
-def package(pkg_name, version, frontend, backend, output, recursive,
-            packaged=[]):
-    logger = logging.getLogger('upt')
+def _package_to_dict(upt_pkg):
+    """Return a JSON-serializable representation of UPT_PKG.
 
+    Only the checksums and size given by the frontend are kept for archives.
+    Other attributes, such as those set by the Package subclass of a
+    frontend, are kept as is. TypeError is raised if they, or the archives
+    and requirements of UPT_PKG, cannot be restored from the returned
+    value, so that partial packages are never cached.
+    """
+    cls = type(upt_pkg)
+    attributes = {}
+    for attr, value in vars(upt_pkg).items():
+        if attr in ('requirements', 'licenses', 'archives', 'frontend'):
+            continue
+        if json.loads(json.dumps(value)) != value:
+            raise TypeError(f'Attribute {attr} cannot be serialized: '
+                            f'{value!r}')
+        attributes[attr] = value
+    for requirements in upt_pkg.requirements.values():
+        for requirement in requirements:
+            if type(requirement) is not PackageRequirement:
+                raise TypeError(f'Cannot serialize {requirement!r}')
+    for archive in upt_pkg.archives:
+        if type(archive) is not Archive:
+            raise TypeError(f'Cannot serialize {archive!r}')
+    return {
+        'class': f'{cls.__module__}:{cls.__qualname__}',
+        'attributes': attributes,
+        'requirements': {
+            phase: [[requirement.name, requirement.specifier]
+                    for requirement in requirements]
+            for phase, requirements in upt_pkg.requirements.items()
+        },
+        'licenses': [license.spdx_identifier
+                     for license in upt_pkg.licenses],
+        'archives': [{
+            'url': archive.url,
+            'type': archive.archive_type.name,
+            'size': archive._expected_size,
+            'hashes': archive._expected_hashes,
+        } for archive in upt_pkg.archives],
+    }
+
+
+def _package_from_dict(data):
+    """Return the package serialized as DATA by _package_to_dict()."""
     try:
-        upt_pkg = None
-        upt.log.logger_set_formatter(logger, 'Frontend')
-        upt_pkg = frontend.parse(pkg_name, version)
+        cls = _import_object(data['class'])
+    except (ImportError, AttributeError):
+        cls = None
+    if not (isinstance(cls, type) and issubclass(cls, Package)):
+        cls = Package
+    attributes = data['attributes']
+    upt_pkg = cls.__new__(cls)
+    Package.__init__(
+        upt_pkg, attributes['name'], attributes['version'],
+        requirements={
+            phase: [PackageRequirement(name, specifier)
+                    for name, specifier in requirements]
+            for phase, requirements in data['requirements'].items()
+        },
+        licenses=[upt.licenses.get_license_by_spdx_identifier(spdx_id)
+                  for spdx_id in data['licenses']],
+        archives=[Archive(archive['url'], ArchiveType[archive['type']],
+                          size=archive['size'] or 0, **archive['hashes'])
+                  for archive in data['archives']])
+    vars(upt_pkg).update(attributes)
+    return upt_pkg
+
+
+# Bumped whenever the format returned by _package_to_dict() changes.
+_METADATA_FORMAT = 1
+
+
+def _cached_package(frontend, name, version):
+    cache = upt.cache.get_metadata_cache()
+    if cache is None:
+        return None
+    logger = logging.getLogger('upt')
+    try:
+        data = cache.lookup(frontend.name, name, version)
+        # Metadata cached by another version of upt or of the frontend may
+        # not be what the current one would return.
+        if data is None or data['format'] != _METADATA_FORMAT or \
+                data['frontend_version'] != _plugin_version(frontend):
+            return None
+        upt_pkg = _package_from_dict(data['package'])
+    except (KeyError, TypeError, ValueError, zlib.error) as e:
+        logger.debug(f'Ignoring the cached metadata of '
+                     f'{name}@{version or "latest"}: {e!r}')
+        return None
+    logger.debug(f'Using cached metadata for {name}@{version or "latest"}')
+    return upt_pkg
+
+
+def _cache_package(frontend, name, version, upt_pkg):
+    cache = upt.cache.get_metadata_cache()
+    if cache is None:
+        return
+    try:
+        data = {
+            'format': _METADATA_FORMAT,
+            'frontend_version': _plugin_version(frontend),
+            'package': _package_to_dict(upt_pkg),
+        }
+    except (AttributeError, TypeError, ValueError) as e:
+        # Frontends may store unexpected objects in a package: let us not
+        # fail because of the cache.
+        logger = logging.getLogger('upt')
+        logger.debug(f'Cannot cache the metadata of {upt_pkg}: {e}')
+        return
+    cache.store(frontend.name, name, version, data)
+    if version is None and upt_pkg.version:
+        # The latest version of a package is also a pinned version.
+        cache.store(frontend.name, name, upt_pkg.version, data)
+
+
+def parse_package(frontend, name, version):
+    """Return the package parsed by FRONTEND, using the metadata cache."""
+    upt_pkg = _cached_package(frontend, name, version)
+    if upt_pkg is None:
+        upt_pkg = upt.aio.call_sync(frontend, 'parse', name, version)
+        _cache_package(frontend, name, version, upt_pkg)
+    return upt_pkg
+
+
+async def parse_package_async(frontend, name, version):
+    """Coroutine version of parse_package()."""
+    upt_pkg = _cached_package(frontend, name, version)
+    if upt_pkg is None:
+        upt_pkg = await upt.aio.call(frontend, 'parse', name, version)
+        _cache_package(frontend, name, version, upt_pkg)
+    return upt_pkg
+
+
+async def _needs_requirement(backend, requirement, phase):
+    # Backends relying on the default needs_requirement() may provide
+    # package_versions_async() instead of package_versions().
+    if (getattr(type(backend), 'needs_requirement', None) is
+            Backend.needs_requirement and
+            upt.aio.get_hook(backend, 'package_versions') is not None):
+        versions = await backend.package_versions_async(requirement.name)
+        return backend._needs_version(requirement, versions)
+    return backend.needs_requirement(requirement, phase)
+
+
+async def _resolve_requirements(pkg_name, version, frontend, backend,
+                                recursive, packaged, limit):
+    """Parse a package and, if RECURSIVE, all the requirements it needs.
+
+    Return a dict mapping the name of each package to a (package,
+    requirement names) tuple, in the order in which packages were found.
+    Packages are parsed concurrently, at most LIMIT (an asyncio.Semaphore) at
+    a time, but backend.needs_requirement() is only called from the thread
+    running the event loop. Requirements whose name is in PACKAGED are
+    ignored.
+    """
+    async def parse(name, version):
+        async with limit:
+            upt_pkg = await parse_package_async(frontend, name, version)
         upt_pkg.frontend = frontend.name
-        upt.log.logger_set_formatter(logger, 'Backend')
-        backend.create_package(upt_pkg, output=output)
-        packaged.append(pkg_name)
-        if recursive:
-            for phase, requirements in upt_pkg.requirements.items():
-                for requirement in requirements:
-                    # Let's not repackage what we have already packaged.
-                    if requirement.name in packaged:
-                        continue
+        upt_pkg._want_checksums(backend.checksums)
+        return upt_pkg
+
+    loop = asyncio.get_event_loop()
+    found = [pkg_name]
+    seen = set(packaged) | {pkg_name}
+    parsed = {}
+    pending = {loop.create_task(parse(pkg_name, version)): pkg_name}
+    try:
+        while pending:
+            done, _ = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = pending.pop(task)
+                upt_pkg = task.result()
+                dependencies = set()
+                parsed[name] = (upt_pkg, dependencies)
+                if not recursive:
+                    continue
+                for phase, requirements in upt_pkg.requirements.items():
+                    for requirement in requirements:
+                        if requirement.name == name:
+                            continue
+                        if requirement.name in seen:
+                            # Already in the graph, or already packaged.
+                            if requirement.name not in packaged:
+                                dependencies.add(requirement.name)
+                            continue
+                        if await _needs_requirement(backend, requirement,
+                                                    phase):
+                            seen.add(requirement.name)
+                            found.append(requirement.name)
+                            dependencies.add(requirement.name)
+                            task = loop.create_task(
+                                parse(requirement.name, None))
+                            pending[task] = requirement.name
+    except BaseException:
+        for task in pending:
+            task.cancel()
+        for upt_pkg, _ in parsed.values():
+            upt_pkg._clean()
+        raise
+
+    return {name: parsed[name] for name in found}
+
+
+def _compute_archive_checksums(packages):
+    """Compute the checksums wanted by the backend for the archives of
+    PACKAGES that are available locally.
+
+    Archives downloaded while parsing packages, and archives found in the
+    archive cache, are hashed concurrently, instead of one at a time while
+    packages are being created. Checksums of cached archives are added to the
+    archive cache, where Archive.download() will find them.
+    """
+    downloaded = []
+    cached = []
+    cache = upt.cache.get_archive_cache()
+    for upt_pkg in packages:
+        for archive in upt_pkg.archives:
+            hash_names = {hash_name for hash_name in archive.wanted_hashes
+                          if upt.checksum.is_available(hash_name)}
+            if not hash_names:
+                continue
+            if archive._filepath is not None:
+                downloaded.append(archive)
+            elif archive._data is None and cache is not None:
+                entry = cache.lookup(archive.url, archive._hashes)
+                if entry is not None and hash_names - entry.hashes.keys():
+                    cached.append((archive.url, entry, hash_names))
+    try:
+        if downloaded:
+            Package._compute_checksums(downloaded, (), None)
+        if not cached:
+            return
+        results = upt.checksum.compute_many(
+            [entry.path for _, entry, _ in cached],
+            set().union(*(hash_names for _, _, hash_names in cached)),
+            known_hashes={entry.path: entry.hashes
+                          for _, entry, _ in cached},
+            use_cache=False)
+    except OSError as e:
+        # Archives are hashed again when needed: let us not fail here.
+        logger = logging.getLogger('upt')
+        logger.debug(f'Could not compute the checksums of archives: {e}')
+        return
+    for url, entry, _ in cached:
+        cache.add_hashes(url, {'sha256': entry.hashes['sha256'],
+                               **results[entry.path]})
+
+
+async def _create_packages(graph, backend, output, limit):
+    """Create all the packages of GRAPH, in topological order.
+
+    GRAPH is returned by _resolve_requirements(). A package is only created
+    once all of its requirements have been created, unless they depend on
+    each other: cycles are broken by creating the package that was found
+    first. At most LIMIT (an asyncio.Semaphore) packages are created at a
+    time. The archives that are available locally are hashed beforehand,
+    see _compute_archive_checksums().
+    """
+    async def create(upt_pkg):
+        try:
+            async with limit:
+                await upt.aio.call(backend, 'create_package', upt_pkg,
+                                   output=output)
+        finally:
+            # We always want to clean up after ourselves.
+            upt_pkg._clean()
+
+    loop = asyncio.get_event_loop()
+    remaining = dict(graph)
+    created = set()
+    running = {}
+    try:
+        await loop.run_in_executor(
+            None, _compute_archive_checksums,
+            [upt_pkg for upt_pkg, _ in graph.values()])
+        while remaining or running:
+            ready = [name for name, (_, dependencies) in remaining.items()
+                     if dependencies <= created]
+            if not ready and not running:
+                ready = [next(iter(remaining))]
+            for name in ready:
+                upt_pkg, _ = remaining.pop(name)
+                running[loop.create_task(create(upt_pkg))] = name
+            done, _ = await asyncio.wait(
+                running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = running.pop(task)
+                task.result()
+                created.add(name)
+    finally:
+        # Packages that are being created must not be cleaned up under the
+        # feet of the backend: let them finish.
+        if running:
+            done, _ = await asyncio.wait(running)
+            for task in done:
+                # Only the first error is reported.
+                task.exception()
+        for upt_pkg, _ in remaining.values():
+            upt_pkg._clean()
+
+
+async def _package(pkg_name, version, frontend, backend, output, recursive,
+                   packaged, jobs):
+    logger = logging.getLogger('upt')
+    limit = asyncio.Semaphore(jobs)
+    upt.log.logger_set_formatter(logger, 'Frontend')
+    graph = await _resolve_requirements(pkg_name, version, frontend, backend,
+                                        recursive, packaged, limit)
+    upt.log.logger_set_formatter(logger, 'Backend')
+    await _create_packages(graph, backend, output, limit)
+
+
+def package(pkg_name, version, frontend, backend, output, recursive,
+            packaged=None, jobs=1):
+    """Package PKG_NAME and, if RECURSIVE, all the requirements it needs.
 
-                    if backend.needs_requirement(requirement, phase):
-                        package(requirement.name, None, frontend, backend,
-                                output, recursive, packaged)
+    The whole requirement graph is parsed first. Packages are then created in
+    topological order, so that requirements are packaged before the packages
+    that need them. Up to JOBS packages are parsed or created at the same
+    time. Packages whose name is in PACKAGED are not packaged.
+
+    The asynchronous hooks of the frontend and the backend (such as
+    parse_async()) are used when they are defined; synchronous hooks are run
+    in a pool of JOBS threads.
+    """
+    packaged = set(packaged or ())
+
+    try:
+        upt.aio.run(_package(pkg_name, version, frontend, backend, output,
+                             recursive, packaged, jobs), jobs)
     except upt.exceptions.UnhandledFrontendError as e:
         print(e, file=sys.stderr)
         sys.exit(1)
     except (upt.exceptions.InvalidPackageNameError,
-            upt.exceptions.InvalidPackageVersionError) as e:
+            upt.exceptions.InvalidPackageVersionError,
+            upt.download.IntegrityError) as e:
         print(e, file=sys.stderr)
         sys.exit(1)
-    finally:
-        if upt_pkg is not None:
-            # We always want to clean up after ourselves.
-            upt_pkg._clean()
+
+
+def audit_licenses(pkg_name, version, frontend, policy, recursive=False):
+    """Check the licenses of a package against a policy.
+
+    Yield a (package, licenses) tuple for every package whose licenses do not
+    comply with POLICY, an upt.licenses.Policy, as soon as the package has
+    been parsed. If RECURSIVE is True, all the requirements of the package are
+    checked as well, whatever their phase.
+    """
+    logger = logging.getLogger('upt')
+    queue = collections.deque([(pkg_name, version)])
+    seen = {pkg_name}
+    while queue:
+        name, version = queue.popleft()
+        upt_pkg = None
+        try:
+            upt_pkg = parse_package(frontend, name, version)
+            upt_pkg.frontend = frontend.name
+            violations = policy.violations(upt_pkg.licenses)
+            if violations:
+                yield upt_pkg, violations
+            if not recursive:
+                continue
+            for requirements in upt_pkg.requirements.values():
+                for requirement in requirements:
+                    if requirement.name not in seen:
+                        seen.add(requirement.name)
+                        queue.append((requirement.name, None))
+        except (upt.exceptions.InvalidPackageNameError,
+                upt.exceptions.InvalidPackageVersionError) as e:
+            # The package itself must exist, but a missing requirement should
+            # not prevent us from checking the other ones.
+            if name == pkg_name:
+                raise
+            logger.warning(e)
+        finally:
+            if upt_pkg is not None:
+                upt_pkg._clean()
 
 
 def _extract_name_version_from_package(package):
@@ -416,15 +1317,18 @@ def update(pkg_name, version, frontend, backend, output):
     logger = logging.getLogger('upt')
 
     upt.log.logger_set_formatter(logger, 'Backend')
-    old_version = backend.current_version(frontend, pkg_name, output)
+    old_version = upt.aio.call_sync(backend, 'current_version', frontend,
+                                    pkg_name, output)
 
     # Parse both the old and the new version of the package in order to create
     # a "diff".
     upt.log.logger_set_formatter(logger, 'Frontend')
-    old_pkg = frontend.parse(pkg_name, old_version)
+    old_pkg = parse_package(frontend, pkg_name, old_version)
     old_pkg.frontend = frontend.name
-    new_pkg = frontend.parse(pkg_name, version)
+    new_pkg = parse_package(frontend, pkg_name, version)
     new_pkg.frontend = frontend.name
+    old_pkg._want_checksums(backend.checksums)
+    new_pkg._want_checksums(backend.checksums)
     diff = PackageDiff(old_pkg, new_pkg)
     if diff.new_version == old_version:
         raise PackageUpToDateException(pkg_name, old_version)
@@ -433,13 +1337,106 @@ def update(pkg_name, version, frontend, backend, output):
     upt.log.logger_set_formatter(logger, 'Backend')
     logger.info(f'Updating {pkg_name} from {old_version} to {new_pkg.version}')
     try:
-        backend.update_package(diff, output=output)
+        upt.aio.call_sync(backend, 'update_package', diff, output=output)
     except NotImplementedError:
         logger.error(f'The "{backend.name}" backend  does not implement the '
                      'update feature yet.')
         sys.exit(1)
 
 
+def package_command(args, frontends, backends):
+    # There will not be a KeyError here, since argparse will catch "wrong"
+    # values for us.
+    frontend = frontends[args.frontend]()
+    backend = backends[args.backend]()
+    name, version = _extract_name_version_from_package(args.package)
+    upt.log.create_logger(args.log_level, args.color)
+    if args.update:
+        try:
+            update(name, version, frontend, backend, args.output)
+        except PackageUpToDateException as e:
+            logger = logging.getLogger('upt')
+            logger.info(e)
+        except (upt.exceptions.InvalidPackageNameError,
+                upt.exceptions.InvalidPackageVersionError) as e:
+            logger = logging.getLogger('upt')
+            upt.log.logger_set_formatter(logger, 'Frontend')
+            logger.error(e)
+            sys.exit(1)
+        except upt.download.IntegrityError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+    else:
+        package(name, version, frontend, backend, args.output,
+                args.recursive, jobs=args.jobs)
+
+
+def licenses_command(args, frontends):
+    frontend = frontends[args.frontend]()
+    name, version = _extract_name_version_from_package(args.package)
+    logger = upt.log.create_logger(args.log_level, args.color)
+    upt.log.logger_set_formatter(logger, 'Frontend')
+    found = False
+    try:
+        for upt_pkg, violations in audit_licenses(name, version, frontend,
+                                                  args.policy,
+                                                  args.recursive):
+            found = True
+            licenses = ', '.join(license.spdx_identifier
+                                 for license in violations)
+            print(f'{upt_pkg.name}@{upt_pkg.version}: {licenses}',
+                  flush=True)
+    except (upt.exceptions.UnhandledFrontendError,
+            upt.exceptions.InvalidPackageNameError,
+            upt.exceptions.InvalidPackageVersionError,
+            upt.download.IntegrityError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if found:
+        sys.exit(1)
+
+
+def cache_command(args):
+    cache = upt.cache.ArchiveCache()
+    checksum_cache = upt.checksum.ChecksumCache()
+    guess_cache = upt.licenses.GuessCache()
+    metadata_cache = upt.cache.MetadataCache()
+    try:
+        if args.cache_cmd == 'stats':
+            stats = cache.stats()
+            print(f'Directory: {stats["directory"]}')
+            print(f'URLs: {stats["urls"]}')
+            print(f'Archives: {stats["archives"]}')
+            print(f'Size: {stats["size"]} bytes')
+            stats = checksum_cache.stats()
+            print(f'Checksums: {stats["files"]} file(s)')
+            stats = guess_cache.stats()
+            print(f'License guesses: {stats["guesses"]}')
+            stats = metadata_cache.stats()
+            print(f'Metadata: {stats["packages"]} package(s)')
+        elif args.cache_cmd == 'prune':
+            removed = cache.prune(args.max_size)
+            print(f'Removed {removed} archive(s)')
+            removed = checksum_cache.prune()
+            print(f'Removed the checksums of {removed} file(s)')
+            removed = metadata_cache.prune()
+            print(f'Removed the expired metadata of {removed} package(s)')
+        elif args.cache_cmd == 'clear':
+            removed = cache.clear()
+            print(f'Removed {removed} archive(s)')
+            removed = checksum_cache.clear()
+            print(f'Removed the checksums of {removed} file(s)')
+            removed = guess_cache.clear()
+            print(f'Removed {removed} license guess(es)')
+            removed = metadata_cache.clear()
+            print(f'Removed the metadata of {removed} package(s)')
+    finally:
+        metadata_cache.close()
+        guess_cache.close()
+        checksum_cache.close()
+        cache.close()
+
+
 def main():
     frontends = _get_installed_frontends()
     backends = _get_installed_backends()
@@ -452,12 +1449,12 @@ def main():
     # We need to handle this here, because if we let the parser run in an
     # environment without frontends/backends, it will return a useless error
     # message, such as "choose a frontend in {}".
-    if sys.argv[1] == 'package':
+    if sys.argv[1] in ('package', 'licenses'):
         if not frontends:
             sys.exit('You need to install at least one frontend, for instance '
                      'upt-cpan, upt-pypi or upt-rubygems')
 
-        if not backends:
+        if sys.argv[1] == 'package' and not backends:
             sys.exit('You need to install at least one backend, for instance '
                      'upt-fedora, upt-freebsd, upt-guix, upt-nix or '
                      'upt-openbsd')
@@ -474,25 +1471,42 @@ def main():
             print(frontend)
         sys.exit(0)
 
-    if args.cmd == 'package':
-        # There will not be a KeyError here, since argparse will catch "wrong"
-        # values for us.
-        frontend = frontends[args.frontend]()
-        backend = backends[args.backend]()
-        name, version = _extract_name_version_from_package(args.package)
-        upt.log.create_logger(args.log_level, args.color)
-        if args.update:
-            try:
-                update(name, version, frontend, backend, args.output)
-            except PackageUpToDateException as e:
-                logger = logging.getLogger('upt')
-                logger.info(e)
-            except (upt.exceptions.InvalidPackageNameError,
-                    upt.exceptions.InvalidPackageVersionError) as e:
-                logger = logging.getLogger('upt')
-                upt.log.logger_set_formatter(logger, 'Frontend')
-                logger.error(e)
-                sys.exit(1)
-        else:
-            package(name, version, frontend, backend, args.output,
-                    args.recursive)
+    if args.cmd == 'cache':
+        cache_command(args)
+        sys.exit(0)
+
+    if args.cmd in ('package', 'licenses'):
+        if args.cache:
+            upt.cache.set_archive_cache(
+                upt.cache.ArchiveCache(max_size=args.cache_max_size))
+            upt.checksum.set_checksum_cache(upt.checksum.ChecksumCache())
+            upt.licenses.set_guess_cache(upt.licenses.GuessCache())
+            upt.cache.set_metadata_cache(
+                upt.cache.MetadataCache(ttl=args.metadata_ttl))
+        workspace = Workspace()
+        set_workspace(workspace)
+        try:
+            if args.cmd == 'package':
+                package_command(args, frontends, backends)
+            else:
+                licenses_command(args, frontends)
+        finally:
+            set_workspace(None)
+            workspace.cleanup()
+            upt.download.close_session()
+            cache = upt.cache.get_archive_cache()
+            if cache is not None:
+                cache.close()
+                upt.cache.set_archive_cache(None)
+            checksum_cache = upt.checksum.get_checksum_cache()
+            if checksum_cache is not None:
+                checksum_cache.close()
+                upt.checksum.set_checksum_cache(None)
+            guess_cache = upt.licenses.get_guess_cache()
+            if guess_cache is not None:
+                guess_cache.close()
+                upt.licenses.set_guess_cache(None)
+            metadata_cache = upt.cache.get_metadata_cache()
+            if metadata_cache is not None:
+                metadata_cache.close()
+                upt.cache.set_metadata_cache(None)